@@ -1,16 +1,187 @@
-from flask import Flask, request, render_template_string, redirect, session
+from flask import Flask, Response, g, has_request_context, request, render_template, redirect, session, stream_with_context
+from markupsafe import Markup, escape
 import requests
+from requests.adapters import HTTPAdapter
+import array
+import asyncio
+import base64
+import bisect
+import concurrent.futures
+import contextvars
+import csv
+import datetime
+import fcntl
+import functools
+import glob
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import mimetypes
 import os
-from werkzeug.security import check_password_hash
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import check_password_hash, generate_password_hash
 import urllib.parse
+import zipfile
+import zlib
+
+try:
+    import redis
+except ImportError:  # la caché compartida es opcional
+    redis = None
+try:
+    import openpyxl
+    from openpyxl.utils.exceptions import InvalidFileException
+except ImportError:  # solo lo necesita la importación desde XLSX
+    openpyxl = None
+    InvalidFileException = zipfile.BadZipFile
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess as prometheus_multiprocess
+except ImportError:  # sin prometheus_client las métricas no se recogen
+    prometheus_client = None
+try:
+    import brotli
+except ImportError:  # sin brotli se comprime solo con gzip
+    brotli = None
+try:
+    import httpx
+except ImportError:  # sin httpx las lecturas en paralelo van en hilos con el cliente síncrono
+    httpx = None
+try:
+    import a2wsgi
+except ImportError:  # solo lo necesita el modo ASGI
+    a2wsgi = None
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY")
 if not app.secret_key:
     raise RuntimeError("SECRET_KEY environment variable is not set")
+# Proxies de confianza delante de la aplicación (nginx, balanceador): con ellos, remote_addr es la
+# IP del cliente según X-Forwarded-For. Sin proxy se deja en 0: la cabecera la podría falsear cualquiera.
+PROXY_SALTOS = int(os.environ.get("PROXY_SALTOS", "0"))
+if PROXY_SALTOS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_SALTOS, x_proto=PROXY_SALTOS, x_host=PROXY_SALTOS)
+
+# 🧩 Plantillas: templates/ se compila una vez al arrancar y el bytecode se guarda en disco
+JINJA_CACHE_DIR = os.environ.get("JINJA_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ascensoralert-jinja"))
+os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+app.jinja_options = {**app.jinja_options, "bytecode_cache": FileSystemBytecodeCache(JINJA_CACHE_DIR)}
+
+# Opciones de los desplegables, compartidas por las macros de templates/_macros.html
+TIPOS_LEAD = ["Comunidad", "Hotel/Apartamentos", "Empresa", "Otro"]
+LOCALIDADES = [
+    "Agaete", "Agüimes", "Arguineguín", "Arinaga", "Artenara", "Arucas", "Carrizal", "Cruce de Arinaga",
+    "El Burrero", "El Tablero", "Gáldar", "Ingenio", "Jinámar", "La Aldea de San Nicolás", "La Pardilla",
+    "Las Palmas de Gran Canaria", "Maspalomas", "Mogán", "Moya", "Playa de Mogán", "Playa del Inglés",
+    "Puerto Rico", "San Bartolomé de Tirajana", "San Fernando", "San Mateo", "Santa Brígida",
+    "Santa Lucía de Tirajana", "Santa María de Guía", "Tafira", "Tejeda", "Teror", "Valleseco",
+    "Valsequillo", "Vecindario",
+]
+TIPOS_EQUIPO = ["Ascensor", "Elevador", "Montaplatos", "Montacargas", "Plataforma Salvaescaleras", "Otro"]
+EMPRESAS_MANTENEDORAS = [
+    "FAIN Ascensores", "KONE", "Otis", "Schindler", "TKE", "Orona", "APlus Ascensores", "Ascensores Canarias",
+    "Ascensores Domingo", "Ascensores Vulcano Canarias", "Elevadores Canarios", "Fedes Ascensores", "Gratecsa",
+    "Lift Technology", "Omega Elevadores", "Q Ascensores",
+]
+app.jinja_env.globals.update(
+    TIPOS_LEAD=TIPOS_LEAD,
+    LOCALIDADES=LOCALIDADES,
+    TIPOS_EQUIPO=TIPOS_EQUIPO,
+    EMPRESAS_MANTENEDORAS=EMPRESAS_MANTENEDORAS,
+)
+
+
+def precompilar_plantillas():
+    # Con auto_reload desactivado (producción) get_template ya no vuelve a mirar el disco
+    for nombre in app.jinja_env.list_templates():
+        app.jinja_env.get_template(nombre)
+
+
+precompilar_plantillas()
+
+# 🖼️ Estáticos con huella: /static/<fichero>?v=<hash del contenido>
+# Al arrancar se calcula el hash de cada fichero de static/ y se precomprimen (gzip y, si está
+# instalado, brotli) los de texto. Las URLs con la versión actual se sirven como immutable durante
+# un año: mientras el fichero no cambie, el navegador no vuelve a pedirlo.
+ESTATICOS_COMPRIMIBLES = (".css", ".js", ".svg", ".json", ".txt", ".map")
+ESTATICOS_MAX_AGE = 365 * 24 * 3600
+
+
+def cargar_estaticos():
+    """nombre relativo -> {"hash", "mimetype", "gzip", "br"}; vacío si no hay carpeta static/."""
+    estaticos = {}
+    carpeta = app.static_folder
+    if not carpeta or not os.path.isdir(carpeta):
+        return estaticos
+    for raiz, _, ficheros in os.walk(carpeta):
+        for fichero in ficheros:
+            ruta = os.path.join(raiz, fichero)
+            nombre = os.path.relpath(ruta, carpeta).replace(os.sep, "/")
+            with open(ruta, "rb") as f:
+                contenido = f.read()
+            activo = {
+                "hash": hashlib.sha1(contenido).hexdigest()[:12],
+                "mimetype": mimetypes.guess_type(fichero)[0] or "application/octet-stream",
+            }
+            if fichero.endswith(ESTATICOS_COMPRIMIBLES):
+                compresor = zlib.compressobj(9, zlib.DEFLATED, 31)
+                activo["gzip"] = compresor.compress(contenido) + compresor.flush()
+                if brotli is not None:
+                    activo["br"] = brotli.compress(contenido, quality=11)
+            estaticos[nombre] = activo
+    return estaticos
+
+
+ESTATICOS = cargar_estaticos()
+
+
+def url_estatico(nombre):
+    # Sin el fichero (p. ej. static/ fuera del despliegue) se enlaza sin versión, como antes
+    activo = ESTATICOS.get(nombre)
+    return f"/static/{nombre}?v={activo['hash']}" if activo else f"/static/{nombre}"
+
+
+app.jinja_env.globals["url_estatico"] = url_estatico
+
+
+def servir_estatico(filename):
+    activo = ESTATICOS.get(filename)
+    if activo is None:
+        return app.send_static_file(filename)
+    codificacion = next((c for c in ("br", "gzip") if c in activo and request.accept_encodings[c]), None)
+    if codificacion is None:
+        response = app.send_static_file(filename)
+    else:
+        response = Response(activo[codificacion], mimetype=activo["mimetype"])
+        response.headers["Content-Encoding"] = codificacion
+        response.set_etag(f"{activo['hash']}-{codificacion}")
+        response.make_conditional(request)
+    if "gzip" in activo:
+        response.vary.add("Accept-Encoding")
+    if request.args.get("v") == activo["hash"]:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = ESTATICOS_MAX_AGE
+        response.cache_control.immutable = True
+        response.headers.pop("Expires", None)
+    return response
+
+
+app.view_functions["static"] = servir_estatico
 
 # 🔗 Datos de Supabase
-SUPABASE_URL = "https://zdbwnxnikspdexfpuhad.supabase.co"
+SUPABASE_URL = os.environ.get("SUPABASE_URL", "https://zdbwnxnikspdexfpuhad.supabase.co")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 
 if not SUPABASE_KEY:
@@ -21,6 +192,1539 @@ HEADERS = {
     "Content-Type": "application/json",
     "Prefer": "return=representation"
 }
+
+# 🔌 Cliente HTTP de Supabase: conexiones reutilizadas, timeouts, reintentos y cortacircuitos
+# Un hueco del pool por hilo del worker de gunicorn
+SUPABASE_POOL_SIZE = int(os.environ.get("SUPABASE_POOL_SIZE", "10"))
+SUPABASE_CONNECT_TIMEOUT = float(os.environ.get("SUPABASE_CONNECT_TIMEOUT", "3.05"))
+SUPABASE_READ_TIMEOUT = float(os.environ.get("SUPABASE_READ_TIMEOUT", "15"))
+SUPABASE_REINTENTOS = int(os.environ.get("SUPABASE_REINTENTOS", "3"))
+SUPABASE_BACKOFF = float(os.environ.get("SUPABASE_BACKOFF", "0.2"))
+SUPABASE_BACKOFF_MAX = 2.0
+# Fallos seguidos que abren el circuito y segundos que permanece abierto
+SUPABASE_UMBRAL_FALLOS = int(os.environ.get("SUPABASE_UMBRAL_FALLOS", "5"))
+SUPABASE_ENFRIAMIENTO = float(os.environ.get("SUPABASE_ENFRIAMIENTO", "30"))
+ESTADOS_REINTENTABLES = {429, 500, 502, 503, 504}
+METODOS_IDEMPOTENTES = {"GET", "HEAD"}
+
+
+class SupabaseNoDisponible(Exception):
+    pass
+
+
+class SupabaseClient:
+    def __init__(self, base_url, headers, pool_size=SUPABASE_POOL_SIZE,
+                 timeout=(SUPABASE_CONNECT_TIMEOUT, SUPABASE_READ_TIMEOUT),
+                 reintentos=SUPABASE_REINTENTOS, backoff=SUPABASE_BACKOFF,
+                 umbral_fallos=SUPABASE_UMBRAL_FALLOS, enfriamiento=SUPABASE_ENFRIAMIENTO):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.reintentos = reintentos
+        self.backoff = backoff
+        self.umbral_fallos = umbral_fallos
+        self.enfriamiento = enfriamiento
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        self.montar_pool(pool_size)
+        self._lock = threading.Lock()
+        self._fallos = 0
+        self._abierto_hasta = 0.0
+        self._prueba_en_curso = False
+        # Callbacks (metodo, tabla, estado, segundos) por cada intento; los usan las métricas
+        self.observadores = []
+
+    def montar_pool(self, pool_size):
+        # Los reintentos los gestionamos nosotros para aplicar jitter y el cortacircuitos
+        self.pool_size = pool_size
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def head(self, path, **kwargs):
+        return self.request("HEAD", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request("PATCH", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+    def request(self, method, path, **kwargs):
+        """Petición a /rest/v1/{path}. Lanza SupabaseNoDisponible si el circuito está abierto o se agotan los intentos."""
+        kwargs.setdefault("timeout", self.timeout)
+        url = f"{self.base_url}/rest/v1/{path}"
+        intentos = 1 + (self.reintentos if method in METODOS_IDEMPOTENTES else 0)
+        for intento in range(intentos):
+            self._comprobar_circuito()
+            inicio = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException as exc:
+                self._observar(method, path, "error", time.perf_counter() - inicio)
+                self._registrar_fallo()
+                if intento + 1 == intentos:
+                    raise SupabaseNoDisponible(str(exc)) from exc
+                self._esperar(intento)
+                continue
+            except BaseException:
+                self._liberar_prueba()
+                raise
+            self._observar(method, path, response.status_code, time.perf_counter() - inicio)
+            if response.status_code >= 500:
+                self._registrar_fallo()
+            else:
+                self._registrar_exito()
+            if response.status_code in ESTADOS_REINTENTABLES and intento + 1 < intentos:
+                self._esperar(intento, response.headers.get("Retry-After"))
+                continue
+            return response
+
+    def _observar(self, method, path, estado, duracion):
+        tabla = path.split("?", 1)[0]
+        for observador in self.observadores:
+            observador(method, tabla, estado, duracion)
+
+    def _esperar(self, intento, retry_after=None):
+        time.sleep(self._pausa(intento, retry_after))
+
+    def _pausa(self, intento, retry_after=None):
+        # Backoff exponencial con jitter completo; Retry-After manda si viene
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), SUPABASE_BACKOFF_MAX)
+        return random.uniform(0, min(SUPABASE_BACKOFF_MAX, self.backoff * 2 ** intento))
+
+    def _comprobar_circuito(self):
+        with self._lock:
+            if self._fallos < self.umbral_fallos:
+                return
+            # Circuito abierto: tras el enfriamiento dejamos pasar una única petición de prueba
+            if time.monotonic() < self._abierto_hasta or self._prueba_en_curso:
+                raise SupabaseNoDisponible("Circuito abierto: Supabase no responde")
+            self._prueba_en_curso = True
+
+    def _registrar_fallo(self):
+        with self._lock:
+            self._fallos += 1
+            self._prueba_en_curso = False
+            if self._fallos >= self.umbral_fallos:
+                self._abierto_hasta = time.monotonic() + self.enfriamiento
+
+    def _registrar_exito(self):
+        with self._lock:
+            self._fallos = 0
+            self._prueba_en_curso = False
+
+    def _liberar_prueba(self):
+        # Excepción que no dice nada de Supabase (cancelación, error nuestro): la siguiente puede probar
+        with self._lock:
+            self._prueba_en_curso = False
+
+
+supabase = SupabaseClient(SUPABASE_URL, HEADERS)
+
+
+@app.errorhandler(SupabaseNoDisponible)
+def supabase_no_disponible(exc):
+    return f"<h3 style='color:red;'>❌ Base de datos no disponible</h3><pre>{escape(str(exc))}</pre><a href='/home'>Volver</a>", 503
+
+
+# ⚡ Cliente asíncrono de Supabase (httpx) y lecturas en paralelo
+# Las vistas que necesitan varias consultas independientes (alertas por IPO y contrato, equipos por
+# lotes de clientes) las lanzan a la vez con supabase_en_paralelo(): con httpx, como corrutinas en un
+# bucle de eventos propio que multiplexa todas las esperas sobre un único hilo y un pool de conexiones;
+# sin httpx, en hilos con el cliente síncrono. El cortacircuitos, los reintentos y las métricas son los
+# de `supabase`: los dos clientes ven Supabase igual de caído.
+SUPABASE_ASYNC_CONEXIONES = int(os.environ.get("SUPABASE_ASYNC_CONEXIONES", "100"))
+
+
+class SupabaseAsync:
+    def __init__(self, sincrono, max_conexiones=SUPABASE_ASYNC_CONEXIONES):
+        self.sincrono = sincrono
+        self.max_conexiones = max_conexiones
+        self._bucle = None
+        self._cliente = None
+        self._lock = threading.Lock()
+
+    def bucle(self):
+        # El bucle y el cliente httpx se crean al primer uso, en un hilo que vive lo que el proceso
+        with self._lock:
+            if self._bucle is None:
+                bucle = asyncio.new_event_loop()
+                threading.Thread(target=bucle.run_forever, name="supabase-async", daemon=True).start()
+                connect, read = self.sincrono.timeout
+                self._cliente = httpx.AsyncClient(
+                    base_url=f"{self.sincrono.base_url}/rest/v1/",
+                    headers=dict(self.sincrono.session.headers),
+                    timeout=httpx.Timeout(read, connect=connect),
+                    limits=httpx.Limits(max_connections=self.max_conexiones,
+                                        max_keepalive_connections=self.max_conexiones),
+                )
+                self._bucle = bucle
+        return self._bucle
+
+    async def request(self, method, path, **kwargs):
+        """Como SupabaseClient.request(), como corrutina dentro de bucle()."""
+        intentos = 1 + (self.sincrono.reintentos if method in METODOS_IDEMPOTENTES else 0)
+        for intento in range(intentos):
+            self.sincrono._comprobar_circuito()
+            inicio = time.perf_counter()
+            try:
+                response = await self._cliente.request(method, path, **kwargs)
+            except httpx.HTTPError as exc:
+                self.sincrono._observar(method, path, "error", time.perf_counter() - inicio)
+                self.sincrono._registrar_fallo()
+                if intento + 1 == intentos:
+                    raise SupabaseNoDisponible(str(exc)) from exc
+                await asyncio.sleep(self.sincrono._pausa(intento))
+                continue
+            except BaseException:
+                self.sincrono._liberar_prueba()
+                raise
+            self.sincrono._observar(method, path, response.status_code, time.perf_counter() - inicio)
+            if response.status_code >= 500:
+                self.sincrono._registrar_fallo()
+            else:
+                self.sincrono._registrar_exito()
+            if response.status_code in ESTADOS_REINTENTABLES and intento + 1 < intentos:
+                await asyncio.sleep(self.sincrono._pausa(intento, response.headers.get("Retry-After")))
+                continue
+            return response
+
+    def en_paralelo(self, peticiones):
+        """[(ruta, params)] -> respuestas de GET en el mismo orden; el hilo que llama espera una sola vez."""
+        metricas = _metricas_peticion.get()
+
+        async def todas():
+            _metricas_peticion.set(metricas)
+            return await asyncio.gather(*(self.request("GET", ruta, params=params) for ruta, params in peticiones))
+        return asyncio.run_coroutine_threadsafe(todas(), self.bucle()).result()
+
+    def cerrar(self):
+        # Cierra las conexiones desde el propio bucle del cliente
+        with self._lock:
+            if self._bucle is None:
+                return
+        asyncio.run_coroutine_threadsafe(self._cliente.aclose(), self._bucle).result()
+
+
+supabase_async = SupabaseAsync(supabase) if httpx is not None else None
+_paralelo_pool = concurrent.futures.ThreadPoolExecutor(SUPABASE_POOL_SIZE, thread_name_prefix="supabase-paralelo")
+
+
+def supabase_en_paralelo(peticiones):
+    """Varias lecturas independientes a la vez: [(ruta, params)] -> [response], en el mismo orden."""
+    if len(peticiones) <= 1:
+        return [supabase.get(ruta, params=params) for ruta, params in peticiones]
+    if supabase_async is not None:
+        return supabase_async.en_paralelo(peticiones)
+    futuros = [_paralelo_pool.submit(contextvars.copy_context().run, supabase.get, ruta, params=params)
+               for ruta, params in peticiones]
+    return [futuro.result() for futuro in futuros]
+
+# 📈 Métricas Prometheus
+# Con PROMETHEUS_MULTIPROC_DIR definido, cada worker de gunicorn escribe sus valores en ese
+# directorio y /metrics los agrega (el hook child_exit de gunicorn debe llamar a
+# prometheus_client.multiprocess.mark_process_dead). Sin prometheus_client no se mide nada.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+# Contador de llamadas a Supabase de la petición en curso. Es una contextvar y no g para que cuenten
+# también las que la petición espera en otros hilos (una_sola_carga, supabase_en_paralelo)
+_metricas_peticion = contextvars.ContextVar("metricas_peticion", default=None)
+
+
+def sin_metricas_peticion(funcion, *args):
+    # Para el trabajo en segundo plano que la petición no espera
+    _metricas_peticion.set(None)
+    return funcion(*args)
+
+
+if prometheus_client is not None:
+    METRICA_RUTAS = prometheus_client.Histogram(
+        "ascensoralert_request_duration_seconds", "Duración de las peticiones por ruta",
+        ["endpoint", "method", "status"]
+    )
+    METRICA_SUPABASE = prometheus_client.Histogram(
+        "ascensoralert_supabase_request_duration_seconds", "Duración de las llamadas HTTP a Supabase",
+        ["method", "tabla", "status"]
+    )
+    METRICA_LLAMADAS = prometheus_client.Histogram(
+        "ascensoralert_supabase_calls_per_request", "Llamadas a Supabase por petición",
+        ["endpoint"], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 500, 1000)
+    )
+
+    def _observar_supabase(method, tabla, estado, duracion):
+        METRICA_SUPABASE.labels(method, tabla, str(estado)).observe(duracion)
+        metricas = _metricas_peticion.get()
+        if metricas is not None:
+            metricas["llamadas"] += 1
+
+    supabase.observadores.append(_observar_supabase)
+
+    @app.before_request
+    def iniciar_metricas():
+        g.metricas = {"inicio": time.perf_counter(), "llamadas": 0}
+        _metricas_peticion.set(g.metricas)
+
+    @app.after_request
+    def registrar_metricas(response):
+        metricas = g.get("metricas")
+        if metricas is None or request.endpoint == "metrics":
+            return response
+        endpoint = request.endpoint or "desconocido"
+        method, status = request.method, str(response.status_code)
+
+        # Al cerrar la respuesta: en las de streaming incluye el cuerpo y sus llamadas
+        def observar():
+            METRICA_RUTAS.labels(endpoint, method, status).observe(time.perf_counter() - metricas["inicio"])
+            METRICA_LLAMADAS.labels(endpoint).observe(metricas["llamadas"])
+
+        response.call_on_close(observar)
+        return response
+
+
+@app.route("/metrics")
+def metrics():
+    if prometheus_client is None:
+        return "Métricas no disponibles: falta el paquete prometheus_client", 501
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return "No autorizado", 401
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registro = prometheus_client.CollectorRegistry()
+        prometheus_multiprocess.MultiProcessCollector(registro)
+    else:
+        registro = prometheus_client.REGISTRY
+    return Response(prometheus_client.generate_latest(registro), mimetype=prometheus_client.CONTENT_TYPE_LATEST)
+
+
+# 🗄️ Caché de lectura de clientes y equipos
+# Registros por tabla+id y consultas de listado. Los listados llevan en la clave la
+# generación de cada tabla: una escritura la incrementa y deja obsoletos solo esos listados.
+CACHE_TTL = float(os.environ.get("CACHE_TTL", "60"))
+CACHE_MAX_ENTRADAS = int(os.environ.get("CACHE_MAX_ENTRADAS", "2048"))
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL")
+
+
+class CacheLocal:
+    # TTL + LRU en memoria del proceso. Los valores se comparten: no mutarlos.
+    def __init__(self, max_entradas=CACHE_MAX_ENTRADAS):
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()
+        self._generaciones = {}
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            valor, caduca = entrada
+            if caduca < time.monotonic():
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return valor
+
+    def set(self, clave, valor, ttl):
+        with self._lock:
+            self._datos[clave] = (valor, time.monotonic() + ttl)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def delete(self, *claves):
+        with self._lock:
+            for clave in claves:
+                self._datos.pop(clave, None)
+
+    def contar(self, clave, ttl):
+        # Contador de ventana fija: la cuenta empieza de cero cuando caduca
+        with self._lock:
+            ahora = time.monotonic()
+            valor, caduca = self._datos.get(clave, (0, 0))
+            if caduca < ahora:
+                valor, caduca = 0, ahora + ttl
+            self._datos[clave] = (valor + 1, caduca)
+            self._datos.move_to_end(clave)
+            return valor + 1
+
+    def incr(self, clave):
+        # Contadores sin caducidad, fuera del LRU para que nunca se pierda una generación
+        with self._lock:
+            self._generaciones[clave] = self._generaciones.get(clave, 0) + 1
+            return self._generaciones[clave]
+
+    def generacion(self, clave):
+        with self._lock:
+            return self._generaciones.get(clave, 0)
+
+
+class CacheRedis:
+    # Backend compartido entre workers de gunicorn. Si Redis falla, se comporta como un fallo de caché.
+    def __init__(self, url):
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def get(self, clave):
+        try:
+            valor = self._redis.get(clave)
+        except redis.RedisError:
+            return None
+        return None if valor is None else json.loads(valor)
+
+    def set(self, clave, valor, ttl):
+        try:
+            self._redis.set(clave, json.dumps(valor), ex=max(1, int(ttl)))
+        except redis.RedisError:
+            pass
+
+    def delete(self, *claves):
+        try:
+            self._redis.delete(*claves)
+        except redis.RedisError:
+            pass
+
+    def contar(self, clave, ttl):
+        try:
+            pipe = self._redis.pipeline()
+            pipe.incr(clave)
+            pipe.expire(clave, max(1, int(ttl)), nx=True)
+            return pipe.execute()[0]
+        except redis.RedisError:
+            return 0
+
+    def incr(self, clave):
+        try:
+            return self._redis.incr(clave)
+        except redis.RedisError:
+            return None
+
+    def generacion(self, clave):
+        try:
+            return int(self._redis.get(clave) or 0)
+        except redis.RedisError:
+            return None
+
+
+class CacheLectura:
+    def __init__(self, backend, ttl=CACHE_TTL, prefijo="ascensoralert:"):
+        self.backend = backend
+        self.ttl = ttl
+        self.prefijo = prefijo
+
+    def clave_registro(self, tabla, registro_id):
+        return f"{self.prefijo}{tabla}:{registro_id}"
+
+    def clave_lista(self, tablas, consulta):
+        generaciones = [self.backend.generacion(f"{self.prefijo}{tabla}:gen") for tabla in tablas]
+        if None in generaciones:
+            return None  # sin generación fiable no se cachea el listado
+        return f"{self.prefijo}lista:{':'.join(map(str, generaciones))}:{consulta}"
+
+    def obtener(self, clave, cargar, ttl=None):
+        """Lectura a través de la caché: cargar() devuelve (valor, error) y solo se guarda si no hay error.
+
+        Cada valor se guarda con la versión de datos de la página que lo cargó (ver condicional()).
+        """
+        if clave is not None:
+            entrada = self.backend.get(clave)
+            if isinstance(entrada, dict) and entrada.keys() == {"valor", "version"}:
+                anotar_version_leida(entrada["version"])
+                return entrada["valor"], None
+        version = version_en_curso()
+        valor, error = cargar()
+        if error is None and clave is not None:
+            self.backend.set(clave, {"valor": valor, "version": version}, self.ttl if ttl is None else ttl)
+        return valor, error
+
+    def contar(self, nombre, ventana):
+        # Eventos en la ventana actual de `ventana` segundos, compartido si el backend es Redis
+        return self.backend.contar(f"{self.prefijo}{nombre}:{int(time.time() // ventana)}", ventana)
+
+    def cuenta(self, nombre, ventana):
+        # Valor actual de contar() sin sumar
+        return self.backend.get(f"{self.prefijo}{nombre}:{int(time.time() // ventana)}") or 0
+
+    def olvidar(self, nombre, ventana):
+        self.backend.delete(f"{self.prefijo}{nombre}:{int(time.time() // ventana)}")
+
+    def invalidar(self, tabla, registro_id=None):
+        if registro_id is not None:
+            self.backend.delete(self.clave_registro(tabla, registro_id))
+        self.backend.incr(f"{self.prefijo}{tabla}:gen")
+
+
+if CACHE_REDIS_URL and redis is not None:
+    cache = CacheLectura(CacheRedis(CACHE_REDIS_URL))
+else:
+    cache = CacheLectura(CacheLocal())
+
+
+def obtener_registro(tabla, registro_id, instantanea=False):
+    """Devuelve (registro, error) de clientes/equipos por id, pasando por la caché.
+
+    Con instantanea=True (formularios de edición) puede servir la última versión buena si
+    Supabase no responde; el updated_at oculto del formulario evita pisar cambios posteriores.
+    """
+    def cargar():
+        response = supabase.get(f"{tabla}?id=eq.{registro_id}")
+        if response.status_code == 200 and response.json():
+            return response.json()[0], None
+        return None, response
+    if instantanea:
+        return obtener_instantanea(f"{tabla}:{registro_id}", (tabla,), cargar)
+    return cache.obtener(cache.clave_registro(tabla, registro_id), cargar)
+
+
+def actualizar_registro(tabla, registro_id, data, version=None):
+    """PATCH de clientes/equipos por id en una sola llamada; devuelve (conflicto, error).
+
+    version es el updated_at que se mostró en el formulario: solo se actualiza si nadie ha
+    cambiado el registro desde entonces. count=exact dice cuántas filas casaron; 0 es conflicto.
+    """
+    params = [("id", f"eq.{registro_id}")]
+    if version:
+        params.append(("updated_at", f"eq.{version}"))
+    response = supabase.patch(tabla, params=params, json=data, headers={"Prefer": "return=minimal,count=exact"})
+    if response.status_code not in (200, 204):
+        return False, response
+    cache.invalidar(tabla, registro_id)
+    return _total_content_range(response) == 0, None
+
+
+def conflicto_edicion(tabla, registro_id, data):
+    """Devuelve (registro para el formulario, cambios ajenos, error) tras un conflicto de versión.
+
+    El formulario conserva lo que escribió el usuario con la versión actual, para que pueda revisar
+    los campos que otra persona cambió (cambios ajenos: [(campo, valor actual)]) y reenviar.
+    """
+    actual, error = obtener_registro(tabla, registro_id)
+    if error is not None:
+        return None, None, error
+    cambios = [(campo, actual.get(campo)) for campo, valor in data.items() if (actual.get(campo) or "") != (valor or "")]
+    return dict(actual, **data), cambios, None
+
+
+# ⏳ Instantáneas de las vistas de lectura (stale-while-revalidate)
+# La primera página de cada consulta del dashboard y del listado, y las páginas de edición, guardan
+# su último resultado bueno con la hora y las generaciones de sus tablas. Si solo ha pasado el tiempo, se sirve al
+# momento y se refresca en segundo plano; si ha habido escrituras, se espera a la nueva hasta
+# SWR_ESPERA segundos. Si Supabase tarda más o falla, se sirve la anterior avisando de su edad.
+# Una sola carga por consulta a la vez en cada proceso (y un refresco por SWR_VENTANA entre
+# procesos con Redis): 50 dashboards simultáneos hacen una llamada, no 50.
+SWR_ACTIVO = os.environ.get("SWR_ACTIVO", "1") == "1"
+SWR_ESPERA = float(os.environ.get("SWR_ESPERA", "2"))
+SWR_MAX_EDAD = int(os.environ.get("SWR_MAX_EDAD", "86400"))  # después se olvida la instantánea
+SWR_VENTANA = 10
+SWR_HILOS = int(os.environ.get("SWR_HILOS", "4"))
+
+_cargas_en_curso = {}
+_cargas_lock = threading.Lock()
+_cargas_pool = concurrent.futures.ThreadPoolExecutor(SWR_HILOS, thread_name_prefix="instantaneas")
+
+
+def una_sola_carga(clave, cargar, en_segundo_plano=True):
+    """Future de cargar(); si ya hay una carga de `clave` en curso en este proceso, la misma.
+
+    Con en_segundo_plano=False la carga nueva se hace en el hilo que llama (que iba a esperarla
+    de todos modos) y el pool queda para los refrescos.
+    """
+    with _cargas_lock:
+        futuro = _cargas_en_curso.get(clave)
+        if futuro is not None:
+            return futuro
+        futuro = _cargas_en_curso[clave] = concurrent.futures.Future()
+    if en_segundo_plano:
+        # Con las contextvars de quien la lanza: sus llamadas cuentan en las métricas de esa petición
+        _cargas_pool.submit(contextvars.copy_context().run, _ejecutar_carga, clave, futuro, cargar)
+    else:
+        _ejecutar_carga(clave, futuro, cargar)
+    return futuro
+
+
+def _ejecutar_carga(clave, futuro, cargar):
+    try:
+        futuro.set_result(cargar())
+    except BaseException as exc:
+        futuro.set_exception(exc)
+    finally:
+        with _cargas_lock:
+            _cargas_en_curso.pop(clave, None)
+
+
+def espera_restante():
+    # SWR_ESPERA es el máximo por petición, no por consulta: la versión del ETag y la vista lo comparten
+    if not has_request_context():
+        return SWR_ESPERA
+    limite = g.setdefault("limite_espera", time.monotonic() + SWR_ESPERA)
+    return max(0.0, limite - time.monotonic())
+
+
+def _guardar_instantanea(clave, generaciones, version, cargar):
+    """Devuelve (valor, error, version).
+
+    Las generaciones y la versión se toman antes de leer: una escritura durante la carga la deja ya
+    obsoleta. La versión viaja con el resultado porque quien lo espera puede ser otra petición.
+    """
+    valor, error = cargar()
+    if error is None:
+        cache.backend.set(clave, {"valor": valor, "marca": time.time(), "gen": generaciones, "version": version},
+                          SWR_MAX_EDAD)
+    return valor, error, version
+
+
+def _resultado_carga(futuro, timeout=None):
+    valor, error, version = futuro.result(timeout=timeout)
+    if error is None:
+        anotar_version_leida(version)
+    return valor, error
+
+
+def _servir_instantanea(instantanea):
+    edad = time.time() - instantanea["marca"]
+    g.edad_datos = max(g.get("edad_datos") or 0, edad)
+    return instantanea["valor"], None
+
+
+def obtener_instantanea(consulta, tablas, cargar):
+    """Lectura stale-while-revalidate: cargar() devuelve (valor, error), como en cache.obtener().
+
+    Sin instantánea previa se comporta como una lectura normal. Cuando se sirve una antigua,
+    g.edad_datos queda con su edad en segundos para avisar en la página.
+    """
+    if not SWR_ACTIVO:
+        return cache.obtener(cache.clave_lista(tablas, consulta), cargar)
+    generaciones = [cache.backend.generacion(f"{cache.prefijo}{tabla}:gen") for tabla in tablas]
+    if None in generaciones:
+        return cargar()
+    clave = f"{cache.prefijo}instantanea:{consulta}"
+    instantanea = cache.backend.get(clave)
+    al_dia = instantanea is not None and instantanea["gen"] == generaciones
+    version = version_en_curso()
+
+    def refrescar():
+        return _guardar_instantanea(clave, generaciones, version, cargar)
+
+    if al_dia:
+        if time.time() - instantanea["marca"] < cache.ttl:
+            anotar_version_leida(instantanea.get("version"))
+            return instantanea["valor"], None
+        if cache.contar(f"refresco:{consulta}", SWR_VENTANA) <= 1:
+            una_sola_carga(clave, functools.partial(sin_metricas_peticion, refrescar))
+        return _servir_instantanea(instantanea)
+
+    if instantanea is None:
+        return _resultado_carga(una_sola_carga(clave, refrescar, en_segundo_plano=False))
+    futuro = una_sola_carga(clave, refrescar)
+    try:
+        valor, error = _resultado_carga(futuro, timeout=espera_restante())
+        if error is None:
+            return valor, None
+    except (concurrent.futures.TimeoutError, SupabaseNoDisponible):
+        pass
+    return _servir_instantanea(instantanea)
+
+
+@app.context_processor
+def contexto_instantanea():
+    return {"edad_datos": g.get("edad_datos")}
+
+
+# 🏷️ ETag y GET condicional
+# Token de versión de clientes+equipos: con caché compartida, sus generaciones (sin llamadas);
+# si no, una llamada mínima a rpc/version_datos (sql/version_datos.sql); si falla, las
+# generaciones locales. Los tokens hechos de generaciones solo ven las escrituras de la aplicación:
+# caducan con el TTL de la caché, como los propios datos, para recoger también los cambios de fuera.
+# La caché y las instantáneas guardan el token con que se cargó cada valor; si la página usa alguno
+# de otra versión, sale sin ETag: nunca se etiqueta un cuerpo con una versión más nueva que sus datos.
+def _version_plantillas():
+    # Las páginas enlazan los estáticos por su hash: si cambian, cambia también el HTML
+    resumen = hashlib.sha1()
+    for nombre in sorted(app.jinja_env.list_templates()):
+        resumen.update(app.jinja_env.loader.get_source(app.jinja_env, nombre)[0].encode())
+    for nombre, activo in sorted(ESTATICOS.items()):
+        resumen.update(f"{nombre}:{activo['hash']}".encode())
+    return resumen.hexdigest()[:12]
+
+
+VERSION_PLANTILLAS = _version_plantillas()
+
+
+def version_en_curso():
+    # Token con que condicional() etiqueta la página en curso; None fuera de una vista condicional
+    return g.get("version_datos") if has_request_context() else None
+
+
+def anotar_version_leida(version):
+    # Datos cargados con otra versión que la actual: la página no puede llevar el ETag actual
+    if has_request_context() and "version_datos" in g and version != g.version_datos:
+        g.datos_de_otra_version = True
+
+
+def version_datos():
+    """Devuelve (token, ultima_modificacion); ultima_modificacion es None si no se conoce."""
+    if replica_disponible():
+        return f"s{replica.version()}", None
+    claves = [f"{cache.prefijo}{tabla}:gen" for tabla in ("clientes", "equipos")]
+    if isinstance(cache.backend, CacheRedis):
+        generaciones = [cache.backend.generacion(clave) for clave in claves]
+        if None not in generaciones:
+            return f"g{generaciones}:{int(time.time() // CACHE_TTL)}", None
+    try:
+        response = supabase.get("rpc/version_datos")
+    except SupabaseNoDisponible:
+        response = None
+    if response is not None and response.status_code == 200:
+        fechas = [datetime.datetime.fromisoformat(v[0]) for v in response.json().values() if v and v[0]]
+        return f"r{response.text}", max(fechas) if fechas else None
+    generaciones = [cache.backend.generacion(clave) for clave in claves]
+    return f"l{generaciones}:{int(time.time() // CACHE_TTL)}", None
+
+
+def _version_datos_a_tiempo():
+    # Como version_datos(), pero sin esperar más de lo que queda de SWR_ESPERA; None si Supabase va lento
+    if not SWR_ACTIVO or replica_disponible():
+        return version_datos()
+    generaciones = [cache.backend.generacion(f"{cache.prefijo}{tabla}:gen") for tabla in ("clientes", "equipos")]
+    try:
+        return una_sola_carga(f"version_datos:{generaciones}", version_datos).result(timeout=espera_restante())
+    except concurrent.futures.TimeoutError:
+        return None
+
+
+def condicional(vista):
+    # ETag/Last-Modified en las vistas de lectura; si el navegador ya tiene esa versión, 304 sin renderizar
+    @functools.wraps(vista)
+    def envoltura(*args, **kwargs):
+        if request.method != "GET" or "usuario" not in session:
+            return vista(*args, **kwargs)
+        version = _version_datos_a_tiempo()
+        if version is None:
+            # Sin versión no hay 304 posible: la vista tira de sus instantáneas
+            return vista(*args, **kwargs)
+        token, ultima = version
+        g.version_datos = token
+        etag = hashlib.sha1(
+            f"{VERSION_PLANTILLAS}:{datetime.date.today()}:{token}:{request.full_path}".encode()
+        ).hexdigest()
+        if ultima is not None:
+            ultima = ultima.replace(microsecond=0)
+        if request.if_none_match:
+            sin_cambios = request.if_none_match.contains_weak(etag)
+        else:
+            sin_cambios = ultima is not None and request.if_modified_since is not None \
+                and ultima <= request.if_modified_since
+        if sin_cambios:
+            response = Response(status=304)
+        else:
+            response = app.make_response(vista(*args, **kwargs))
+            if response.status_code != 200 or g.get("edad_datos") or g.get("datos_de_otra_version"):
+                # Una instantánea o entrada de caché anterior no debe quedar en el navegador con el ETag
+                # de la versión actual: al revalidar daría 304 sobre datos viejos
+                return response
+        # Débil: la misma versión vale comprimida o sin comprimir
+        response.set_etag(etag, weak=True)
+        if ultima is not None:
+            response.last_modified = ultima
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+    return envoltura
+
+
+# 🪞 Réplica local en SQLite (opcional)
+# Con REPLICA_SQLITE, un hilo por worker copia clientes y equipos a ese fichero y lo mantiene al día
+# por (updated_at, id) cada REPLICA_SINCRONIZAR segundos. El dashboard, /leads y la búsqueda leen de
+# ahí con SQL indexado en vez de ir a Supabase. Tras una escritura de la aplicación (cambia la
+# generación de la tabla en la caché) la siguiente lectura sincroniza antes de leer, así que cada
+# usuario ve sus propios cambios. Los borrados hechos fuera se detectan comparando el número de filas
+# con el de Supabase (count=exact) cada REPLICA_RECONCILIAR segundos. Los workers comparten el fichero y un
+# bloqueo fcntl hace que sincronicen de uno en uno.
+REPLICA_SQLITE = os.environ.get("REPLICA_SQLITE")
+REPLICA_SINCRONIZAR = int(os.environ.get("REPLICA_SINCRONIZAR", "30"))
+REPLICA_RECONCILIAR = int(os.environ.get("REPLICA_RECONCILIAR", "600"))
+REPLICA_POR_PAGINA = 1000
+# Cada pasada vuelve a pedir los últimos segundos: filas de transacciones que confirmaron tarde
+REPLICA_SOLAPE = datetime.timedelta(seconds=5)
+REPLICA_COLUMNAS = {
+    "clientes": ("id", "tipo_cliente", "direccion", "nombre_cliente", "codigo_postal", "localidad", "zona",
+                 "persona_contacto", "telefono", "email", "observaciones", "updated_at"),
+    "equipos": ("id", "cliente_id", "tipo_equipo", "empresa_mantenedora", "ubicacion", "descripcion",
+                "fecha_vencimiento_contrato", "rae", "ipo_proxima", "updated_at"),
+}
+# "cambio" numera las pasadas de sincronización: el índice de búsqueda recoge por ahí lo nuevo
+REPLICA_ESQUEMA = """
+create table if not exists clientes (
+    id integer primary key, tipo_cliente text, direccion text, nombre_cliente text, codigo_postal text,
+    localidad text, zona text, persona_contacto text, telefono text, email text, observaciones text,
+    updated_at text, cambio integer
+);
+create table if not exists equipos (
+    id integer primary key, cliente_id integer, tipo_equipo text, empresa_mantenedora text, ubicacion text,
+    descripcion text, fecha_vencimiento_contrato text, rae text, ipo_proxima text, updated_at text, cambio integer
+);
+create table if not exists replica (clave text primary key, valor text);
+create index if not exists equipos_cliente_id_idx on equipos (cliente_id);
+create index if not exists equipos_ipo_proxima_idx on equipos (ipo_proxima, id);
+create index if not exists equipos_fecha_vencimiento_contrato_idx on equipos (fecha_vencimiento_contrato, id);
+create index if not exists equipos_empresa_mantenedora_idx on equipos (empresa_mantenedora, cliente_id);
+create index if not exists clientes_localidad_idx on clientes (localidad);
+create index if not exists clientes_codigo_postal_idx on clientes (codigo_postal, id);
+create index if not exists clientes_direccion_idx on clientes (direccion, id);
+create index if not exists clientes_cambio_idx on clientes (cambio, id);
+"""
+SQL_OPERADORES = {"eq": "=", "gte": ">=", "lte": "<="}
+
+
+def ids_en_supabase(tabla):
+    """Devuelve (ids, error): el conjunto de ids de la tabla, por páginas."""
+    ids, despues_id = set(), 0
+    while True:
+        response = supabase.get(tabla, params=[("select", "id"), ("id", f"gt.{despues_id}"), ("order", "id.asc"),
+                                               ("limit", REPLICA_POR_PAGINA)])
+        if response.status_code != 200:
+            return None, response
+        pagina = [fila["id"] for fila in response.json()]
+        ids.update(pagina)
+        if len(pagina) < REPLICA_POR_PAGINA:
+            return ids, None
+        despues_id = pagina[-1]
+
+
+class ReplicaSQLite:
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._local = threading.local()
+        self._cargada = False
+        self._pasadas = 0
+        # Generaciones de clientes/equipos en la caché cuando empezó la última sincronización buena
+        self.generaciones = None
+        os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+        with self.conexion() as conexion:
+            conexion.execute("pragma journal_mode=wal")
+            conexion.executescript(REPLICA_ESQUEMA)
+
+    def conexion(self):
+        # Una conexión por hilo; WAL deja leer mientras otro worker escribe
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=30)
+            conexion.row_factory = sqlite3.Row
+            conexion.execute("pragma synchronous=normal")
+            self._local.conexion = conexion
+        return conexion
+
+    def _consultar(self, sql, args=()):
+        return [dict(fila) for fila in self.conexion().execute(sql, args)]
+
+    def _meta(self, clave, defecto=None):
+        fila = self.conexion().execute("select valor from replica where clave = ?", (clave,)).fetchone()
+        return json.loads(fila[0]) if fila else defecto
+
+    def _guardar_meta(self, conexion, clave, valor):
+        conexion.execute("insert or replace into replica (clave, valor) values (?, ?)", (clave, json.dumps(valor)))
+
+    @property
+    def lista(self):
+        """Cargada entera alguna vez y con al menos un intento de sincronizar desde que arrancó este proceso."""
+        if not self._cargada:
+            self._cargada = bool(self._meta("cargada"))
+        return self._cargada and self._pasadas > 0
+
+    def version(self):
+        return self._meta("cambio", 0)
+
+    # --- Sincronización ---------------------------------------------------------------
+
+    def sincronizar(self):
+        """Trae de Supabase lo cambiado desde la última pasada; devuelve el error o None."""
+        generaciones = [cache.backend.generacion(f"{cache.prefijo}{tabla}:gen") for tabla in ("clientes", "equipos")]
+        try:
+            with open(f"{self.ruta}.lock", "w") as bloqueo:
+                fcntl.flock(bloqueo, fcntl.LOCK_EX)
+                for tabla in REPLICA_COLUMNAS:
+                    error = self._sincronizar_tabla(tabla)
+                    if error is not None:
+                        return error
+                if time.time() - self._meta("reconciliada", 0) >= REPLICA_RECONCILIAR:
+                    error = self._reconciliar()
+                    if error is not None:
+                        return error
+                with self.conexion() as conexion:
+                    self._guardar_meta(conexion, "cargada", True)
+            self.generaciones = generaciones
+            return None
+        finally:
+            self._pasadas += 1
+
+    def _sincronizar_tabla(self, tabla):
+        marca = self._meta(f"marca:{tabla}")
+        cursor = None
+        if marca is not None:
+            cursor = ((datetime.datetime.fromisoformat(marca[0]) - REPLICA_SOLAPE).isoformat(), 0)
+        while True:
+            params = [("select", ",".join(REPLICA_COLUMNAS[tabla])), ("order", "updated_at.asc,id.asc"),
+                      ("updated_at", "not.is.null"), ("limit", REPLICA_POR_PAGINA)]
+            response = supabase.get(tabla, params=params + filtros_keyset("updated_at", "asc", cursor))
+            if response.status_code != 200:
+                return response
+            pagina = response.json()
+            if pagina:
+                cursor = (pagina[-1]["updated_at"], pagina[-1]["id"])
+                if marca is None or datetime.datetime.fromisoformat(cursor[0]) >= datetime.datetime.fromisoformat(marca[0]):
+                    marca = cursor
+                self._guardar(tabla, pagina, marca)
+            if len(pagina) < REPLICA_POR_PAGINA:
+                return None
+
+    def _guardar(self, tabla, filas, marca=None):
+        # Upsert de una página con un número de cambio nuevo, junto con la marca de agua si la hay
+        columnas = REPLICA_COLUMNAS[tabla]
+        actualizar = ", ".join(f"{columna} = excluded.{columna}" for columna in columnas[1:])
+        sql = (f"insert into {tabla} ({', '.join(columnas)}, cambio) values ({', '.join('?' * (len(columnas) + 1))}) "
+               f"on conflict (id) do update set {actualizar}, cambio = excluded.cambio")
+        with self.conexion() as conexion:
+            cambio = self.version() + 1
+            conexion.executemany(sql, [[fila.get(columna) for columna in columnas] + [cambio] for fila in filas])
+            self._guardar_meta(conexion, "cambio", cambio)
+            if marca is not None:
+                self._guardar_meta(conexion, f"marca:{tabla}", marca)
+
+    def _reconciliar(self):
+        # Si el número de filas no cuadra con Supabase (borrados hechos fuera de la aplicación, o filas
+        # que se escaparon a la marca de agua), se comparan los ids: sobran se borran, faltan se copian
+        for tabla in REPLICA_COLUMNAS:
+            response = supabase.get(tabla, params=[("select", "id"), ("limit", 1)], headers={"Prefer": "count=exact"})
+            if response.status_code not in (200, 206):
+                return response
+            if self.conexion().execute(f"select count(*) from {tabla}").fetchone()[0] == _total_content_range(response):
+                continue
+            ids, error = ids_en_supabase(tabla)
+            if error is not None:
+                return error
+            locales = {fila["id"] for fila in self._consultar(f"select id from {tabla}")}
+            self.eliminar(tabla, locales - ids)
+            faltan = sorted(ids - locales)
+            for i in range(0, len(faltan), LOTE_IDS):
+                lote = ",".join(str(registro_id) for registro_id in faltan[i:i + LOTE_IDS])
+                response = supabase.get(tabla, params=[("select", ",".join(REPLICA_COLUMNAS[tabla])), ("id", f"in.({lote})")])
+                if response.status_code != 200:
+                    return response
+                self._guardar(tabla, response.json())
+        with self.conexion() as conexion:
+            self._guardar_meta(conexion, "reconciliada", time.time())
+        return None
+
+    def eliminar(self, tabla, ids):
+        if not ids:
+            return
+        with self.conexion() as conexion:
+            conexion.executemany(f"delete from {tabla} where id = ?", [(registro_id,) for registro_id in ids])
+            self._guardar_meta(conexion, "cambio", self.version() + 1)
+
+    # --- Consultas ------------------------------------------------------------------
+
+    def _pagina_ordenada(self, consulta, args, columna, columna_id, direccion, cursor, limite):
+        # Como order=columna.dir.nullslast,id.dir con el cursor de filtros_keyset: primero los valores
+        # por el índice (columna, id) y, si no llenan la página, la cola de NULLs
+        op, sentido = (">", "asc") if direccion == "asc" else ("<", "desc")
+        if columna == columna_id:
+            extra = [] if cursor is None else [cursor[1]]
+            filtro = "" if cursor is None else f" and {columna_id} {op} ?"
+            return self._consultar(f"{consulta}{filtro} order by {columna_id} {sentido} limit ?", args + extra + [limite])
+        filas = []
+        en_nulos = cursor is not None and cursor[0] is None
+        if not en_nulos:
+            extra = [] if cursor is None else list(cursor)
+            filtro = "" if cursor is None else f" and ({columna}, {columna_id}) {op} (?, ?)"
+            filas = self._consultar(
+                f"{consulta} and {columna} is not null{filtro} order by {columna} {sentido}, {columna_id} {sentido} limit ?",
+                args + extra + [limite]
+            )
+        if len(filas) < limite:
+            extra = [cursor[1]] if en_nulos else []
+            filtro = f" and {columna_id} {op} ?" if en_nulos else ""
+            filas += self._consultar(
+                f"{consulta} and {columna} is null{filtro} order by {columna_id} {sentido} limit ?",
+                args + extra + [limite - len(filas)]
+            )
+        return filas
+
+    def _filtros(self, filtros, alias_cliente, alias_equipo):
+        # Filtros del dashboard como SQL: (condiciones de clientes, de equipos), cada una con sus argumentos
+        por_tabla = {"clientes": ([], []), "equipos": ([], [])}
+        for nombre, valor in filtros:
+            columna, op = DASHBOARD_FILTROS_FECHA.get(nombre, (nombre, "eq"))
+            tabla, alias = ("clientes", alias_cliente) if columna in DASHBOARD_FILTROS_CLIENTE else ("equipos", alias_equipo)
+            por_tabla[tabla][0].append(f" and {alias}.{columna} {SQL_OPERADORES[op]} ?")
+            por_tabla[tabla][1].append(valor)
+        return ["".join(condiciones) for condiciones, _ in por_tabla.values()], [args for _, args in por_tabla.values()]
+
+    def pagina_dashboard(self, orden, direccion, cursor, limite, contar, filtros):
+        """Devuelve (registros, total) con la forma de los de PostgREST en _pagina_dashboard."""
+        (sql_cliente, sql_equipo), (args_cliente, args_equipo) = self._filtros(filtros, "c", "e")
+        columnas_cliente = DASHBOARD_COLUMNAS_CLIENTE.split(",")
+        columnas_equipo = DASHBOARD_COLUMNAS_EQUIPO.split(",")
+        if orden in DASHBOARD_ORDEN_EQUIPO:
+            desde = f"from equipos e {'join' if sql_cliente else 'left join'} clientes c on c.id = e.cliente_id " \
+                    f"where 1 = 1{sql_equipo}{sql_cliente}"
+            args = args_equipo + args_cliente
+            seleccion = ", ".join([f"e.{col}" for col in columnas_equipo] + [f"c.{col} as c_{col}" for col in columnas_cliente]
+                                  + ["(select count(*) from equipos x where x.cliente_id = c.id) as c_total"])
+            registros = []
+            for fila in self._pagina_ordenada(f"select {seleccion} {desde}", args, f"e.{orden}", "e.id", direccion,
+                                              cursor, limite):
+                equipo = {col: fila[col] for col in columnas_equipo}
+                if fila["c_id"] is not None:
+                    equipo["clientes"] = dict({col: fila[f"c_{col}"] for col in columnas_cliente},
+                                              equipos=[{"count": fila["c_total"]}])
+                registros.append(equipo)
+        else:
+            desde = f"from clientes c where 1 = 1{sql_cliente}"
+            args = list(args_cliente)
+            if sql_equipo:
+                desde += f" and exists (select 1 from equipos e where e.cliente_id = c.id{sql_equipo})"
+                args += args_equipo
+            seleccion = ", ".join(f"c.{col}" for col in columnas_cliente)
+            registros = self._pagina_ordenada(f"select {seleccion} {desde}", args, f"c.{orden}", "c.id", direccion,
+                                              cursor, limite)
+            equipos = self._equipos_de([r["id"] for r in registros], columnas_equipo, sql_equipo, args_equipo)
+            for registro in registros:
+                registro["equipos"] = equipos.get(registro["id"], [])
+        total = self.conexion().execute(f"select count(*) {desde}", args).fetchone()[0] if contar else None
+        return registros, total
+
+    def _equipos_de(self, ids, columnas, sql_equipo="", args_equipo=()):
+        por_cliente = {}
+        if not ids:
+            return por_cliente
+        seleccion = ", ".join(f"e.{col}" for col in columnas)
+        filas = self._consultar(
+            f"select e.cliente_id as cliente_id_, {seleccion} from equipos e "
+            f"where e.cliente_id in ({','.join('?' * len(ids))}){sql_equipo} order by e.id",
+            list(ids) + list(args_equipo)
+        )
+        for fila in filas:
+            por_cliente.setdefault(fila.pop("cliente_id_"), []).append(fila)
+        return por_cliente
+
+    def clientes_con_equipos(self, columnas_cliente, columnas_equipo, despues_id, limite):
+        """Como la consulta de pagina_clientes_con_equipos(); None si alguna columna no está replicada."""
+        columnas_cliente, columnas_equipo = columnas_cliente.split(","), columnas_equipo.split(",")
+        if not set(columnas_cliente) <= set(REPLICA_COLUMNAS["clientes"]) \
+                or not set(columnas_equipo) <= set(REPLICA_COLUMNAS["equipos"]):
+            return None
+        leads_data = self._consultar(
+            f"select {', '.join(columnas_cliente)} from clientes where id > ? order by id limit ?",
+            (despues_id if despues_id is not None else -1, limite)
+        )
+        equipos = self._equipos_de([lead["id"] for lead in leads_data], columnas_equipo)
+        for lead in leads_data:
+            lead["equipos"] = equipos.get(lead["id"], [])
+        return leads_data
+
+    def ids(self, tabla):
+        return {fila[0] for fila in self.conexion().execute(f"select id from {tabla}")}
+
+    def clientes_cambiados(self, marca, limite):
+        """Clientes (columnas de búsqueda + cambio) con (cambio, id) posterior a marca, en ese orden."""
+        return self._consultar(
+            f"select {BUSQUEDA_COLUMNAS}, cambio from clientes where (cambio, id) > (?, ?) order by cambio, id limit ?",
+            (marca[0], marca[1], limite)
+        )
+
+    def buscar(self, consulta, limite):
+        # Como buscar_en_supabase(): cada palabra en alguno de los campos (like no distingue mayúsculas ASCII)
+        condiciones, args = [], []
+        for palabra in consulta.split():
+            patron = "%" + palabra.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            condiciones.append("(" + " or ".join(f"{campo} like ? escape '\\'" for campo in BUSQUEDA_CAMPOS) + ")")
+            args += [patron] * len(BUSQUEDA_CAMPOS)
+        if not condiciones:
+            return []
+        return self._consultar(
+            f"select {BUSQUEDA_COLUMNAS} from clientes where {' and '.join(condiciones)} order by id limit ?",
+            args + [limite]
+        )
+
+
+replica = ReplicaSQLite(REPLICA_SQLITE) if REPLICA_SQLITE else None
+_replica_hilo = {"iniciado": False, "lock": threading.Lock()}
+
+
+def replica_disponible():
+    """True si las lecturas pueden ir a la réplica; si la aplicación ha escrito desde la última
+    sincronización, antes la pone al día (esperando como mucho lo que queda de SWR_ESPERA)."""
+    if replica is None or not replica.lista:
+        return False
+    generaciones = [cache.backend.generacion(f"{cache.prefijo}{tabla}:gen") for tabla in ("clientes", "equipos")]
+    if generaciones != replica.generaciones:
+        try:
+            una_sola_carga("replica", replica.sincronizar).result(timeout=espera_restante())
+        except (concurrent.futures.TimeoutError, SupabaseNoDisponible):
+            pass  # se lee lo que haya: mejor algo atrasado que nada
+    return True
+
+
+def _bucle_replica():
+    while True:
+        try:
+            error = una_sola_carga("replica", replica.sincronizar, en_segundo_plano=False).result()
+        except SupabaseNoDisponible as exc:
+            error = exc
+        if error is not None:
+            app.logger.warning("Sincronización de la réplica fallida: %s", getattr(error, "text", error))
+        time.sleep(REPLICA_SINCRONIZAR * random.uniform(0.8, 1.2))
+
+
+@app.before_request
+def iniciar_replica():
+    # Como el índice de búsqueda: un hilo por worker, arrancado en su primer request
+    if replica is None or _replica_hilo["iniciado"]:
+        return
+    with _replica_hilo["lock"]:
+        if not _replica_hilo["iniciado"]:
+            threading.Thread(target=_bucle_replica, name="replica", daemon=True).start()
+            _replica_hilo["iniciado"] = True
+
+
+# 🔗 Acceso a datos: clientes con sus equipos
+# Cada vista pide solo las columnas que pinta.
+LEADS_COLUMNAS_CLIENTE = "id,nombre_cliente,tipo_cliente,direccion,localidad,persona_contacto,telefono,email,observaciones"
+LEADS_COLUMNAS_EQUIPO = "id,tipo_equipo,empresa_mantenedora,descripcion"
+DASHBOARD_COLUMNAS_CLIENTE = "id,direccion,localidad,codigo_postal"
+DASHBOARD_COLUMNAS_EQUIPO = "id,empresa_mantenedora,fecha_vencimiento_contrato,ipo_proxima"
+# Tamaño de lote para el filtro cliente_id=in.(...) del modo alternativo
+LOTE_IDS = 200
+
+
+def pagina_clientes_con_equipos(columnas_cliente, columnas_equipo, despues_id=None, limite=1000):
+    """Devuelve (leads, siguiente_id, error): una página de clientes por id, cada uno con su lista "equipos"."""
+    filtro = f"&id=gt.{despues_id}" if despues_id is not None else ""
+    leads_data = None
+    if replica_disponible():
+        leads_data = replica.clientes_con_equipos(columnas_cliente, columnas_equipo, despues_id, limite + 1)
+    if leads_data is None:
+        # Recurso embebido de PostgREST: clientes y equipos en una sola petición
+        response = supabase.get(
+            f"clientes?select={columnas_cliente},equipos({columnas_equipo})&order=id.asc&limit={limite + 1}{filtro}"
+        )
+        if response.status_code == 200:
+            leads_data = response.json()
+        elif response.status_code == 400:
+            # PostgREST no conoce la relación clientes→equipos: equipos por lotes
+            leads_data, response = _clientes_con_equipos_por_lotes(columnas_cliente, columnas_equipo, filtro, limite)
+            if leads_data is None:
+                return None, None, response
+        else:
+            return None, None, response
+
+    siguiente = None
+    if len(leads_data) > limite:
+        leads_data = leads_data[:limite]
+        siguiente = leads_data[-1]["id"]
+    return leads_data, siguiente, None
+
+
+def pagina_leads(despues_id=None):
+    """Como pagina_clientes_con_equipos() para /leads, con la primera página a través de las instantáneas.
+
+    Las siguientes se piden al recorrer el listado y no se guardan: tras servir /leads entero en
+    memoria no queda más que la primera página.
+    """
+    if replica_disponible() or despues_id is not None:
+        return pagina_clientes_con_equipos(LEADS_COLUMNAS_CLIENTE, LEADS_COLUMNAS_EQUIPO, despues_id, STREAMING_POR_PAGINA)
+
+    def cargar():
+        leads_data, siguiente, error = pagina_clientes_con_equipos(
+            LEADS_COLUMNAS_CLIENTE, LEADS_COLUMNAS_EQUIPO, despues_id, STREAMING_POR_PAGINA
+        )
+        return (None, error) if error is not None else ((leads_data, siguiente), None)
+    pagina, error = obtener_instantanea(f"leads:{STREAMING_POR_PAGINA}", ("clientes", "equipos"), cargar)
+    return (None, None, error) if error is not None else (pagina[0], pagina[1], None)
+
+
+def _clientes_con_equipos_por_lotes(columnas_cliente, columnas_equipo, filtro, limite):
+    response = supabase.get(f"clientes?select={columnas_cliente}&order=id.asc&limit={limite + 1}{filtro}")
+    if response.status_code != 200:
+        return None, response
+    leads_data = response.json()
+    por_id = {}
+    for lead in leads_data:
+        lead["equipos"] = []
+        por_id[lead["id"]] = lead
+
+    ids = list(por_id)
+    peticiones = [
+        ("equipos", [("select", f"cliente_id,{columnas_equipo}"),
+                     ("cliente_id", f"in.({','.join(str(lead_id) for lead_id in ids[i:i + LOTE_IDS])})"),
+                     ("order", "id.asc")])
+        for i in range(0, len(ids), LOTE_IDS)
+    ]
+    # Los lotes son independientes: se piden todos a la vez
+    for equipos_response in supabase_en_paralelo(peticiones):
+        if equipos_response.status_code != 200:
+            return None, equipos_response
+        for equipo in equipos_response.json():
+            por_id[equipo.pop("cliente_id")]["equipos"].append(equipo)
+    return leads_data, None
+
+
+def formatear_fecha(valor):
+    # Formatear fechas yyyy-mm-dd a dd/mm/yyyy
+    if not valor:
+        return "-"
+    partes = valor.split("-")
+    if len(partes) == 3:
+        return f"{partes[2]}/{partes[1]}/{partes[0]}"
+    return valor
+
+
+def filas_dashboard(lead):
+    # Una fila por equipo; los leads sin equipos salen en una fila propia
+    equipos = lead.get("equipos") or []
+    base = {
+        "lead_id": lead["id"],
+        "direccion": lead.get("direccion") or "-",
+        "localidad": lead.get("localidad") or "-",
+        "codigo_postal": lead.get("codigo_postal") or "-",
+        "total_equipos": len(equipos),
+    }
+    if not equipos:
+        return [dict(base, equipo_id=None, empresa_mantenedora="-",
+                     fecha_vencimiento_contrato="-", ipo_proxima="-")]
+    return [
+        dict(base,
+             equipo_id=equipo["id"],
+             empresa_mantenedora=equipo.get("empresa_mantenedora") or "-",
+             fecha_vencimiento_contrato=formatear_fecha(equipo.get("fecha_vencimiento_contrato")),
+             ipo_proxima=formatear_fecha(equipo.get("ipo_proxima")))
+        for equipo in equipos
+    ]
+
+
+# 📄 Paginación por clave (keyset) del dashboard
+# Las columnas del lead paginan sobre clientes; las fechas, sobre equipos.
+DASHBOARD_ORDEN_CLIENTE = ("id", "direccion", "localidad", "codigo_postal")
+DASHBOARD_ORDEN_EQUIPO = ("fecha_vencimiento_contrato", "ipo_proxima")
+DASHBOARD_POR_PAGINA = 50
+DASHBOARD_POR_PAGINA_MAX = 200
+# Filtros: igualdad sobre columnas de clientes o de equipos y rangos de fechas de equipos
+DASHBOARD_FILTROS_CLIENTE = ("localidad", "codigo_postal", "zona", "tipo_cliente")
+DASHBOARD_FILTROS_EQUIPO = ("tipo_equipo", "empresa_mantenedora")
+DASHBOARD_FILTROS_FECHA = {
+    "ipo_desde": ("ipo_proxima", "gte"),
+    "ipo_hasta": ("ipo_proxima", "lte"),
+    "contrato_desde": ("fecha_vencimiento_contrato", "gte"),
+    "contrato_hasta": ("fecha_vencimiento_contrato", "lte"),
+}
+
+
+def codificar_cursor(valor, ultimo_id):
+    return base64.urlsafe_b64encode(json.dumps([valor, ultimo_id]).encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor, orden):
+    """(valor, ultimo_id) del cursor de ?despues=, o None si no vale para la columna `orden`.
+
+    Viene de la URL: el valor tiene que ser del tipo de la columna (fecha ISO, texto o id) antes de ir a Supabase.
+    """
+    try:
+        valor, ultimo_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        ultimo_id = int(ultimo_id)
+        if valor is not None:
+            if orden in DASHBOARD_ORDEN_EQUIPO:
+                valor = datetime.date.fromisoformat(valor).isoformat()
+            elif not isinstance(valor, (str, int)) or isinstance(valor, bool):
+                return None
+        return valor, ultimo_id
+    except (ValueError, TypeError):
+        return None
+
+
+def _literal(valor):
+    # Valores dentro de or=(...) van entre comillas para admitir comas y paréntesis
+    texto = str(valor).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{texto}"'
+
+
+def filtros_keyset(columna, direccion, cursor, prefijo=""):
+    """Filtros PostgREST para las filas posteriores al cursor con order=columna.dir.nullslast,id.dir."""
+    if cursor is None:
+        return []
+    valor, ultimo_id = cursor
+    op = "gt" if direccion == "asc" else "lt"
+    if columna == "id":
+        return [(f"{prefijo}id", f"{op}.{ultimo_id}")]
+    if valor is None:
+        # Ya estamos en la cola de NULLs
+        return [(f"{prefijo}{columna}", "is.null"), (f"{prefijo}id", f"{op}.{ultimo_id}")]
+    v = _literal(valor)
+    return [(f"{prefijo}or", f"({columna}.{op}.{v},and({columna}.eq.{v},id.{op}.{ultimo_id}),{columna}.is.null)")]
+
+
+def filtros_supabase(filtros, tabla):
+    """Devuelve (params, inner): los filtros del dashboard como parámetros PostgREST de una consulta sobre tabla.
+
+    Los de la otra tabla van sobre el recurso embebido, que pasa a !inner para descartar las filas sin coincidencias.
+    """
+    embebido = "clientes" if tabla == "equipos" else "equipos"
+    params, inner = [], False
+    for nombre, valor in filtros:
+        if nombre in DASHBOARD_FILTROS_FECHA:
+            columna, op = DASHBOARD_FILTROS_FECHA[nombre]
+        else:
+            columna, op = nombre, "eq"
+        if (columna in DASHBOARD_FILTROS_CLIENTE) == (tabla == "clientes"):
+            params.append((columna, f"{op}.{valor}"))
+        else:
+            params.append((f"{embebido}.{columna}", f"{op}.{valor}"))
+            inner = True
+    return params, inner
+
+
+def _total_content_range(response):
+    # Content-Range: 0-49/1234 (o */1234 si no hay filas)
+    total = response.headers.get("Content-Range", "").rpartition("/")[2]
+    return int(total) if total.isdigit() else None
+
+
+def pagina_dashboard(orden="id", direccion="asc", cursor=None, por_pagina=DASHBOARD_POR_PAGINA, contar=False,
+                     filtros=()):
+    """Devuelve (filas, siguiente_cursor, total, error) de una página del dashboard."""
+    consulta = f"dashboard:{orden}:{direccion}:{json.dumps(cursor)}:{por_pagina}:{contar}:{json.dumps(filtros)}"
+    cargar = functools.partial(_pagina_dashboard, orden, direccion, cursor, por_pagina, contar, filtros)
+    if replica_disponible():
+        pagina, error = cargar()
+    elif cursor is None:
+        pagina, error = obtener_instantanea(consulta, ("clientes", "equipos"), cargar)
+    else:
+        # Solo la primera página de cada consulta tiene instantánea; las demás, la caché con su TTL
+        pagina, error = cache.obtener(cache.clave_lista(("clientes", "equipos"), consulta), cargar)
+    if error is not None:
+        return None, None, None, error
+    rows, siguiente, total = pagina
+    return rows, siguiente, total, None
+
+
+def _pagina_dashboard(orden, direccion, cursor, por_pagina, contar, filtros=()):
+    if replica_disponible():
+        registros, total = replica.pagina_dashboard(orden, direccion, cursor, por_pagina + 1, contar, filtros)
+    else:
+        registros, total, response = _pagina_dashboard_supabase(orden, direccion, cursor, por_pagina, contar, filtros)
+        if registros is None:
+            return None, response
+
+    siguiente = None
+    if len(registros) > por_pagina:
+        registros = registros[:por_pagina]
+        siguiente = codificar_cursor(registros[-1].get(orden), registros[-1]["id"])
+
+    rows = []
+    for registro in registros:
+        if orden in DASHBOARD_ORDEN_EQUIPO:
+            rows.append(fila_equipo_dashboard(registro))
+        else:
+            rows.extend(filas_dashboard(registro))
+    return (rows, siguiente, total), None
+
+
+def _pagina_dashboard_supabase(orden, direccion, cursor, por_pagina, contar, filtros):
+    # Devuelve (registros, total, response); registros es None si Supabase devolvió un error
+    headers = {"Prefer": "count=estimated"} if contar else {}
+    params = [("order", f"{orden}.{direccion}.nullslast,id.{direccion}"), ("limit", por_pagina + 1)]
+    params += filtros_keyset(orden, direccion, cursor)
+    if orden in DASHBOARD_ORDEN_EQUIPO:
+        params_filtros, inner = filtros_supabase(filtros, "equipos")
+        embebido = "clientes!inner" if inner else "clientes"
+        select = f"{DASHBOARD_COLUMNAS_EQUIPO},{embebido}({DASHBOARD_COLUMNAS_CLIENTE},equipos(count))"
+        response = supabase.get("equipos", params=[("select", select)] + params + params_filtros, headers=headers)
+    else:
+        params_filtros, inner = filtros_supabase(filtros, "clientes")
+        embebido = "equipos!inner" if inner else "equipos"
+        select = f"{DASHBOARD_COLUMNAS_CLIENTE},{embebido}({DASHBOARD_COLUMNAS_EQUIPO})"
+        response = supabase.get("clientes", params=[("select", select)] + params + params_filtros, headers=headers)
+    if response.status_code not in (200, 206):
+        return None, None, response
+    return response.json(), _total_content_range(response) if contar else None, response
+
+
+def fila_equipo_dashboard(equipo):
+    lead = equipo.get("clientes") or {}
+    conteo = lead.get("equipos") or [{"count": 0}]
+    return {
+        "lead_id": lead.get("id"),
+        "direccion": lead.get("direccion") or "-",
+        "localidad": lead.get("localidad") or "-",
+        "codigo_postal": lead.get("codigo_postal") or "-",
+        "total_equipos": conteo[0].get("count", 0),
+        "equipo_id": equipo["id"],
+        "empresa_mantenedora": equipo.get("empresa_mantenedora") or "-",
+        "fecha_vencimiento_contrato": formatear_fecha(equipo.get("fecha_vencimiento_contrato")),
+        "ipo_proxima": formatear_fecha(equipo.get("ipo_proxima")),
+    }
+
+# 🌊 Listados completos en streaming
+# La plantilla recorre un iterable que pide la siguiente página a Supabase solo cuando
+# la necesita: la cabecera y las primeras filas salen enseguida y en memoria vive una página.
+STREAMING_POR_PAGINA = int(os.environ.get("STREAMING_POR_PAGINA", "500"))
+STREAMING_BUFFER = 200  # eventos de plantilla por trozo enviado al cliente
+
+
+class FilasEnStreaming:
+    def __init__(self, filas, siguiente, cargar_pagina):
+        # cargar_pagina(cursor) -> (filas, siguiente_cursor, error)
+        self._filas = filas
+        self._siguiente = siguiente
+        self._cargar_pagina = cargar_pagina
+        self.error = None
+
+    def __iter__(self):
+        filas, cursor = self._filas, self._siguiente
+        self._filas = None  # la primera página no se retiene mientras avanzamos
+        while True:
+            yield from filas
+            if cursor is None:
+                return
+            try:
+                filas, cursor, error = self._cargar_pagina(cursor)
+            except SupabaseNoDisponible as exc:
+                filas, error = None, exc
+            if error is not None:
+                # Las cabeceras ya se enviaron: la plantilla avisa de que el listado está incompleto
+                self.error = getattr(error, "text", str(error))
+                app.logger.error("Listado en streaming interrumpido: %s", self.error)
+                return
+
+
+def respuesta_en_streaming(nombre, **contexto):
+    app.update_template_context(contexto)
+    flujo = app.jinja_env.get_template(nombre).stream(contexto)
+    flujo.enable_buffering(STREAMING_BUFFER)
+    return Response(stream_with_context(flujo), mimetype="text/html")
+
+
+# 🗜️ Compresión de respuestas
+# gzip (o brotli si está instalado y el navegador lo acepta) para HTML, CSV y JSON por encima
+# de COMPRESION_MINIMO bytes. Las respuestas en streaming se comprimen trozo a trozo y cada
+# trozo se vacía (Z_SYNC_FLUSH) para que el navegador pueda pintar las primeras filas ya.
+COMPRESION_MINIMO = int(os.environ.get("COMPRESION_MINIMO", "1024"))
+COMPRESION_NIVEL_GZIP = int(os.environ.get("COMPRESION_NIVEL_GZIP", "6"))
+COMPRESION_NIVEL_BROTLI = int(os.environ.get("COMPRESION_NIVEL_BROTLI", "5"))
+TIPOS_COMPRIMIBLES = ("text/", "application/json", "application/javascript", "image/svg+xml")
+
+
+def _codificacion_aceptada():
+    if brotli is not None and request.accept_encodings["br"]:
+        return "br"
+    if request.accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+
+def _compresor(codificacion):
+    # (comprimir, vaciar, terminar)
+    if codificacion == "br":
+        compresor = brotli.Compressor(quality=COMPRESION_NIVEL_BROTLI)
+        return compresor.process, compresor.flush, compresor.finish
+    compresor = zlib.compressobj(COMPRESION_NIVEL_GZIP, zlib.DEFLATED, 31)
+    return compresor.compress, lambda: compresor.flush(zlib.Z_SYNC_FLUSH), compresor.flush
+
+
+def _comprimir_en_streaming(cuerpo, codificacion):
+    comprimir, vaciar, terminar = _compresor(codificacion)
+    try:
+        for trozo in cuerpo:
+            if isinstance(trozo, str):
+                trozo = trozo.encode()
+            if trozo:
+                yield comprimir(trozo) + vaciar()
+        yield terminar()
+    finally:
+        if hasattr(cuerpo, "close"):
+            cuerpo.close()
+
+
+@app.after_request
+def comprimir_respuesta(response):
+    if not (response.mimetype or "").startswith(TIPOS_COMPRIMIBLES) or "Content-Encoding" in response.headers:
+        return response
+    response.vary.add("Accept-Encoding")
+    if response.status_code != 200 or request.method == "HEAD" or response.direct_passthrough:
+        return response
+    codificacion = _codificacion_aceptada()
+    if codificacion is None:
+        return response
+    if response.is_streamed:
+        response.response = _comprimir_en_streaming(response.response, codificacion)
+        response.headers.pop("Content-Length", None)
+    else:
+        datos = response.get_data()
+        if len(datos) < COMPRESION_MINIMO:
+            return response
+        comprimir, _, terminar = _compresor(codificacion)
+        response.set_data(comprimir(datos) + terminar())
+    response.headers["Content-Encoding"] = codificacion
+    return response
+
+
+# 🔐 Login: usuario en caché, rehash al coste objetivo y límite de intentos
+LOGIN_CACHE_TTL = float(os.environ.get("LOGIN_CACHE_TTL", "60"))
+# Formato de werkzeug: "scrypt:N:r:p" o "pbkdf2:sha256:iteraciones"
+PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+LOGIN_VENTANA = int(os.environ.get("LOGIN_VENTANA", "300"))
+LOGIN_MAX_INTENTOS_USUARIO = int(os.environ.get("LOGIN_MAX_INTENTOS_USUARIO", "10"))
+LOGIN_MAX_INTENTOS_IP = int(os.environ.get("LOGIN_MAX_INTENTOS_IP", "50"))
+
+
+def obtener_usuario(nombre):
+    """Devuelve (usuario, error); usuario es {"contrasena", "activo"} y contrasena None si no existe."""
+    def cargar():
+        encoded_user = urllib.parse.quote(nombre, safe="")
+        response = supabase.get(f"usuarios?nombre_usuario=eq.{encoded_user}")
+        if response.status_code != 200:
+            return None, response
+        usuarios = response.json()
+        if len(usuarios) != 1:
+            return {"contrasena": None, "activo": False}, None
+        return {
+            "contrasena": usuarios[0].get("contrasena") or "",
+            "activo": usuarios[0].get("activo", True) is not False,
+        }, None
+    return cache.obtener(cache.clave_registro("usuarios", nombre), cargar, ttl=LOGIN_CACHE_TTL)
+
+
+def login_bloqueado(usuario, ip):
+    # Solo cuentan los fallos, por usuario y por IP: el bloqueo se mira antes de calcular el hash, así que
+    # una ráfaga contra una cuenta deja de costar CPU en cuanto supera el límite, y quien sí se sabe la
+    # contraseña no se queda fuera por sus propios intentos. Toda la plantilla entra a la vez desde la IP
+    # de la oficina al empezar el turno.
+    fallos_usuario = cache.cuenta(f"login:usuario:{usuario}", LOGIN_VENTANA)
+    fallos_ip = cache.cuenta(f"login:ip:{ip}", LOGIN_VENTANA)
+    return fallos_usuario >= LOGIN_MAX_INTENTOS_USUARIO or fallos_ip >= LOGIN_MAX_INTENTOS_IP
+
+
+def registrar_fallo_login(usuario, ip):
+    cache.contar(f"login:usuario:{usuario}", LOGIN_VENTANA)
+    cache.contar(f"login:ip:{ip}", LOGIN_VENTANA)
+
+
+def actualizar_hash_si_procede(usuario, contrasena, hash_guardado):
+    # Tras un login correcto, lleva el hash al coste configurado sin que el usuario lo note
+    if hash_guardado.split("$", 1)[0] == PASSWORD_HASH_METHOD:
+        return
+    encoded_user = urllib.parse.quote(usuario, safe="")
+    nuevo = generate_password_hash(contrasena, method=PASSWORD_HASH_METHOD)
+    res = supabase.patch(f"usuarios?nombre_usuario=eq.{encoded_user}", json={"contrasena": nuevo},
+                         headers={"Prefer": "return=minimal"})
+    if res.status_code in [200, 204]:
+        cache.invalidar("usuarios", usuario)
+    else:
+        app.logger.warning("No se pudo actualizar el hash de %s: %s", usuario, res.text)
+
+
 # 🟢 Login
 @app.route("/", methods=["GET", "POST"])
 def login():
@@ -28,18 +1732,20 @@ def login():
         usuario = request.form.get("usuario")
         contrasena = request.form.get("contrasena")
         if not usuario or not contrasena:
-            return render_template_string(LOGIN_TEMPLATE, error="Usuario y contraseña requeridos")
-        encoded_user = urllib.parse.quote(usuario, safe="")
-        query = f"?nombre_usuario=eq.{encoded_user}"
-        response = requests.get(f"{SUPABASE_URL}/rest/v1/usuarios{query}", headers=HEADERS)
-
-        if response.status_code == 200 and len(response.json()) == 1:
-            user = response.json()[0]
-            if check_password_hash(user.get("contrasena", ""), contrasena):
+            return render_template("login.html", error="Usuario y contraseña requeridos")
+        if login_bloqueado(usuario, request.remote_addr):
+            return render_template("login.html", error="Demasiados intentos. Prueba de nuevo en unos minutos"), 429
+
+        user, error = obtener_usuario(usuario)
+        if error is None and user["contrasena"] and user["activo"]:
+            if check_password_hash(user["contrasena"], contrasena):
+                cache.olvidar(f"login:usuario:{usuario}", LOGIN_VENTANA)
+                actualizar_hash_si_procede(usuario, contrasena, user["contrasena"])
                 session["usuario"] = usuario
                 return redirect("/home")
-        return render_template_string(LOGIN_TEMPLATE, error="Usuario o contraseña incorrectos")
-    return render_template_string(LOGIN_TEMPLATE, error=None)
+        registrar_fallo_login(usuario, request.remote_addr)
+        return render_template("login.html", error="Usuario o contraseña incorrectos")
+    return render_template("login.html", error=None)
 
 @app.route("/logout")
 def logout():
@@ -51,9 +1757,57 @@ def logout():
 def home():
     if "usuario" not in session:
         return redirect("/")
-    return render_template_string(HOME_TEMPLATE, usuario=session["usuario"])
+    return render_template("home.html", usuario=session["usuario"], digest=resumen_digest())
 
 # 🟢 Alta de Lead
+# Campos obligatorios, compartidos por los formularios de alta y la importación masiva
+CAMPOS_OBLIGATORIOS_LEAD = ("tipo_cliente", "direccion", "nombre_cliente", "localidad")
+CAMPOS_OBLIGATORIOS_EQUIPO = ("cliente_id", "tipo_equipo")
+EQUIPO_CAMPOS_FORMULARIO = ("tipo_equipo", "empresa_mantenedora", "ubicacion", "descripcion",
+                            "fecha_vencimiento_contrato", "rae", "ipo_proxima")
+
+
+def equipos_del_formulario(form):
+    """Equipos del alta combinada: los campos repetidos van en paralelo; se descartan las filas vacías."""
+    columnas = [form.getlist(campo) for campo in EQUIPO_CAMPOS_FORMULARIO]
+    equipos = []
+    for valores in itertools.zip_longest(*columnas, fillvalue=""):
+        equipo = {campo: valor.strip() or None for campo, valor in zip(EQUIPO_CAMPOS_FORMULARIO, valores)}
+        if any(equipo.values()):
+            equipos.append(equipo)
+    return equipos
+
+
+def crear_lead_con_equipos(lead, equipos):
+    """Devuelve (lead creado, error).
+
+    Una llamada a rpc/crear_lead_con_equipos (sql/crear_lead_con_equipos.sql), atómica. Si la
+    función no está instalada: el lead y luego todos sus equipos en un único insert, y si este
+    falla se borra el lead para no dejarlo a medias.
+    """
+    response = supabase.post("rpc/crear_lead_con_equipos", json={"lead": lead, "equipos": equipos})
+    if response.status_code == 200:
+        creado = response.json()
+    elif response.status_code == 404:
+        response = supabase.post(f"clientes?select={BUSQUEDA_COLUMNAS}", json=lead)
+        if response.status_code not in (200, 201):
+            return None, response
+        creado = response.json()[0]
+        if equipos:
+            res = supabase.post("equipos", json=[dict(equipo, cliente_id=creado["id"]) for equipo in equipos],
+                                headers={"Prefer": "return=minimal"})
+            if res.status_code not in (200, 201):
+                supabase.delete(f"clientes?id=eq.{creado['id']}", headers={"Prefer": "return=minimal"})
+                return None, res
+    else:
+        return None, response
+    cache.invalidar("clientes")
+    if equipos:
+        cache.invalidar("equipos")
+    indexar_lead(creado)
+    return creado, None
+
+
 @app.route("/formulario_lead", methods=["GET", "POST"])
 def formulario_lead():
     if "usuario" not in session:
@@ -72,18 +1826,34 @@ def formulario_lead():
             "observaciones": request.form.get("observaciones")
         }
 
-        required = [data["tipo_cliente"], data["direccion"], data["nombre_cliente"], data["localidad"]]
+        required = [data[campo] for campo in CAMPOS_OBLIGATORIOS_LEAD]
         if any(not field for field in required):
             return "Datos del lead inválidos", 400
+        equipos = equipos_del_formulario(request.form)
+        if any(not equipo["tipo_equipo"] for equipo in equipos):
+            return "Datos del equipo inválidos", 400
 
-        response = requests.post(f"{SUPABASE_URL}/rest/v1/clientes?select=id", json=data, headers=HEADERS)
-        if response.status_code in [200, 201]:
-            cliente_id = response.json()[0]["id"]
-            return redirect(f"/nuevo_equipo?cliente_id={cliente_id}")
-        else:
-            return f"<h3 style='color:red;'>❌ Error al registrar lead</h3><pre>{response.text}</pre><a href='/home'>Volver</a>"
-
-    return render_template_string(FORM_TEMPLATE)
+        # Misma dirección ya registrada: se ofrece reutilizar el lead salvo que se confirme el alta
+        if request.form.get("confirmar_duplicado") != "1":
+            duplicados, error = leads_con_misma_direccion(data["direccion"], data["codigo_postal"], data["localidad"])
+            if error is not None:
+                app.logger.warning("No se pudo comprobar si el lead está duplicado: %s", error.text)
+            elif duplicados:
+                return render_template("formulario_lead.html", lead=data, equipos=equipos, duplicados=duplicados)
+
+        lead, error = crear_lead_con_equipos(data, equipos)
+        if error is not None:
+            return f"<h3 style='color:red;'>❌ Error al registrar lead</h3><pre>{escape(error.text)}</pre><a href='/home'>Volver</a>"
+        if not equipos:
+            return redirect(f"/nuevo_equipo?cliente_id={lead['id']}")
+        return f"""
+        <h3>✅ Lead registrado con {len(equipos)} equipo{"s" if len(equipos) > 1 else ""}</h3>
+        <a href='/nuevo_equipo?cliente_id={lead["id"]}' class='button'>➕ Añadir otro equipo</a><br><br>
+        <a href='/editar_lead/{lead["id"]}' class='button'>✏️ Ver lead</a><br><br>
+        <a href='/home' class='button'>🏠 Finalizar y volver al inicio</a>
+        """
+
+    return render_template("formulario_lead.html", lead={}, equipos=[], duplicados=[])
 
 # 🟢 Alta de Equipo
 @app.route("/nuevo_equipo", methods=["GET", "POST"])
@@ -92,12 +1862,6 @@ def nuevo_equipo():
         return redirect("/")
     cliente_id = request.args.get("cliente_id")
 
-    cliente_data = None
-    if cliente_id:
-        r = requests.get(f"{SUPABASE_URL}/rest/v1/clientes?id=eq.{cliente_id}", headers=HEADERS)
-        if r.status_code == 200 and r.json():
-            cliente_data = r.json()[0]
-
     if request.method == "POST":
         equipo_data = {
             "cliente_id": request.form.get("cliente_id"),
@@ -110,500 +1874,1506 @@ def nuevo_equipo():
             "ipo_proxima": request.form.get("ipo_proxima")
         }
 
-        required = [equipo_data["cliente_id"], equipo_data["tipo_equipo"]]
+        required = [equipo_data[campo] for campo in CAMPOS_OBLIGATORIOS_EQUIPO]
         if any(not field for field in required):
             return "Datos del equipo inválidos", 400
 
-        res = requests.post(f"{SUPABASE_URL}/rest/v1/equipos", json=equipo_data, headers=HEADERS)
+        res = supabase.post("equipos", json=equipo_data, headers={"Prefer": "return=minimal"})
         if res.status_code in [200, 201]:
+            cache.invalidar("equipos")
             return f"""
             <h3>✅ Equipo registrado correctamente</h3>
             <a href='/nuevo_equipo?cliente_id={cliente_id}' class='button'>➕ Añadir otro equipo</a><br><br>
             <a href='/home' class='button'>🏠 Finalizar y volver al inicio</a>
             """
         else:
-            return f"<h3 style='color:red;'>❌ Error al registrar equipo</h3><pre>{res.text}</pre><a href='/home'>Volver</a>"
-
-    return render_template_string(EQUIPO_TEMPLATE, cliente=cliente_data)
-
-# 🟢 Plantillas
-
-LOGIN_TEMPLATE = """
-<!DOCTYPE html>
-<html lang="es">
-<head>
-    <meta charset="UTF-8">
-    <title>Login</title>
-    <link rel="stylesheet" href="/static/styles.css">
-</head>
-<body>
-    <header>
-    <div class="header-container">
-        <div class="logo-container">
-            <a href="/home">
-                <img src="/static/logo-fedes-ascensores.png" alt="Logo Fedes Ascensores" class="logo">
-            </a>
-        </div>
-        <div class="title-container">
-            <h1>Bienvenido, {{ usuario }}</h1>
-        </div>
-    </div>
-</header>
-    <main>
-        <div class="menu">
-            <form method="POST">
-                <label>Usuario:</label><br>
-                <input type="text" name="usuario" required><br><br>
-                <label>Contraseña:</label><br>
-                <input type="password" name="contrasena" required><br><br>
-                <button type="submit" class="button">Iniciar Sesión</button>
-            </form>
-            {% if error %}
-            <p style="color: red;">{{ error }}</p>
-            {% endif %}
-        </div>
-    </main>
-</body>
-</html>
-"""
+            return f"<h3 style='color:red;'>❌ Error al registrar equipo</h3><pre>{escape(res.text)}</pre><a href='/home'>Volver</a>"
 
-HOME_TEMPLATE = """
-<!DOCTYPE html>
-<html lang='es'>
-<head>
-    <meta charset='UTF-8'>
-    <title>Bienvenido</title>
-    <link rel='stylesheet' href='/static/styles.css'>
-</head>
-<body>
-    <header>
-    <div class="header-container">
-        <div class="logo-container">
-            <a href="/home">
-                <img src="/static/logo-fedes-ascensores.png" alt="Logo Fedes Ascensores" class="logo">
-            </a>
-        </div>
-        <div class="title-container">
-            <h1>Bienvenido, {{ usuario }}</h1>
-        </div>
-    </div>
-</header>
-    <main>
-        <div class='menu'>
-            <a href="/formulario_lead" class='button'>➕ Añadir Lead</a>
-            <a href="/leads_dashboard" class='button'>📊 Visualizar Datos</a>
-            <a href="/logout" class='button'>🚪 Cerrar Sesión</a>
-        </div>
-    </main>
-</body>
-</html>
-"""
+    cliente_data = None
+    if cliente_id:
+        cliente_data, _ = obtener_registro("clientes", cliente_id)
+    return render_template("nuevo_equipo.html", cliente=cliente_data)
 
-FORM_TEMPLATE = """
-<!DOCTYPE html>
-<html lang="es">
-<head>
-    <meta charset="UTF-8">
-    <title>Formulario Lead</title>
-    <link rel="stylesheet" href="/static/styles.css">
-</head>
-<body>
-    <header>
-    <div class="header-container">
-        <div class="logo-container">
-            <a href="/home">
-                <img src="/static/logo-fedes-ascensores.png" alt="Logo Fedes Ascensores" class="logo">
-            </a>
-        </div>
-        <div class="title-container">
-            <h1>Introducir datos</h1>
-        </div>
-    </div>
-</header>
-    <main>
-        <div class="menu">
-            <form method="POST">
-                <label>Tipo de Lead:</label><br>
-                <select name="tipo_lead" required>
-                    <option value="">-- Selecciona un tipo --</option>
-                    <option value="Comunidad">Comunidad</option>
-                    <option value="Hotel/Apartamentos">Hotel/Apartamentos</option>
-                    <option value="Empresa">Empresa</option>
-                    <option value="Otro">Otro</option>
-                </select><br><br>
-
-                <label>Dirección:</label><br>
-                <input type="text" name="direccion" required><br><br>
-
-                <label>Nombre de la Instalación:</label><br>
-                <input type="text" name="nombre_lead" required><br><br>
-
-                <label>Código Postal:</label><br>
-                <input type="text" name="codigo_postal"><br><br>
-
-                <label>Localidad:</label><br>
-                <select name="localidad" required>
-                    <option value="">-- Selecciona una localidad --</option>
-                    <option value="Agaete">Agaete</option>
-                    <option value="Agüimes">Agüimes</option>
-                    <option value="Arguineguín">Arguineguín</option>
-                    <option value="Arinaga">Arinaga</option>
-                    <option value="Artenara">Artenara</option>
-                    <option value="Arucas">Arucas</option>
-                    <option value="Carrizal">Carrizal</option>
-                    <option value="Cruce de Arinaga">Cruce de Arinaga</option>
-                    <option value="El Burrero">El Burrero</option>
-                    <option value="El Tablero">El Tablero</option>
-                    <option value="Gáldar">Gáldar</option>
-                    <option value="Ingenio">Ingenio</option>
-                    <option value="Jinámar">Jinámar</option>
-                    <option value="La Aldea de San Nicolás">La Aldea de San Nicolás</option>
-                    <option value="La Pardilla">La Pardilla</option>
-                    <option value="Las Palmas de Gran Canaria">Las Palmas de Gran Canaria</option>
-                    <option value="Maspalomas">Maspalomas</option>
-                    <option value="Mogán">Mogán</option>
-                    <option value="Moya">Moya</option>
-                    <option value="Playa de Mogán">Playa de Mogán</option>
-                    <option value="Playa del Inglés">Playa del Inglés</option>
-                    <option value="Puerto Rico">Puerto Rico</option>
-                    <option value="San Bartolomé de Tirajana">San Bartolomé de Tirajana</option>
-                    <option value="San Fernando">San Fernando</option>
-                    <option value="San Mateo">San Mateo</option>
-                    <option value="Santa Brígida">Santa Brígida</option>
-                    <option value="Santa Lucía de Tirajana">Santa Lucía de Tirajana</option>
-                    <option value="Santa María de Guía">Santa María de Guía</option>
-                    <option value="Tafira">Tafira</option>
-                    <option value="Tejeda">Tejeda</option>
-                    <option value="Teror">Teror</option>
-                    <option value="Valleseco">Valleseco</option>
-                    <option value="Valsequillo">Valsequillo</option>
-                    <option value="Vecindario">Vecindario</option>
-                </select><br><br>
-
-                <label>Zona:</label><br>
-                <input type="text" name="zona"><br><br>
-
-                <label>Persona de Contacto:</label><br>
-                <input type="text" name="persona_contacto"><br><br>
-
-                <label>Teléfono:</label><br>
-                <input type="text" name="telefono"><br><br>
-
-                <label>Email:</label><br>
-                <input type="email" name="email"><br><br>
-
-                <label>Observaciones:</label><br>
-                <textarea name="observaciones"></textarea><br><br>
-
-                <button type="submit" class="button">Registrar Lead</button>
-            </form>
-        </div>
-    </main>
-</body>
-</html>
-"""
 
-EQUIPO_TEMPLATE = """
-<!DOCTYPE html>
-<html lang="es">
-<head>
-    <meta charset="UTF-8">
-    <title>Formulario Equipo</title>
-    <link rel="stylesheet" href="/static/styles.css">
-</head>
-<body>
-<header>
-    <div class="header-container">
-        <div class="logo-container">
-            <a href="/home">
-                <img src="/static/logo-fedes-ascensores.png" alt="Logo Fedes Ascensores" class="logo">
-            </a>
-        </div>
-        <div class="title-container">
-            <h1>Introducir datos</h1>
-        </div>
-    </div>
-</header>
-    <main>
-        <div class="menu">
-            <form method="POST">
-                <input type="hidden" name="cliente_id" value="{{ cliente['id'] }}">
-
-                <label>Tipo de Equipo:</label><br>
-                <select name="tipo_equipo" required>
-                    <option value="">-- Selecciona un tipo --</option>
-                    <option value="Ascensor">Ascensor</option>
-                    <option value="Elevador">Elevador</option>
-                    <option value="Montaplatos">Montaplatos</option>
-                    <option value="Montacargas">Montacargas</option>
-                    <option value="Plataforma Salvaescaleras">Plataforma Salvaescaleras</option>
-                    <option value="Otro">Otro</option>
-                </select><br><br>
-
-                <label>Empresa Mantenedora:</label><br>
-                <select name="empresa_mantenedora">
-                    <option value="">-- Selecciona una empresa --</option>
-                    <option value="FAIN Ascensores">FAIN Ascensores</option>
-                    <option value="KONE">KONE</option>
-                    <option value="Otis">Otis</option>
-                    <option value="Schindler">Schindler</option>
-                    <option value="TKE">TKE</option>
-                    <option value="Orona">Orona</option>
-                    <option value="APlus Ascensores">APlus Ascensores</option>
-                    <option value="Ascensores Canarias">Ascensores Canarias</option>
-                    <option value="Ascensores Domingo">Ascensores Domingo</option>
-                    <option value="Ascensores Vulcano Canarias">Ascensores Vulcano Canarias</option>
-                    <option value="Elevadores Canarios">Elevadores Canarios</option>
-                    <option value="Fedes Ascensores">Fedes Ascensores</option>
-                    <option value="Gratecsa">Gratecsa</option>
-                    <option value="Lift Technology">Lift Technology</option>
-                    <option value="Omega Elevadores">Omega Elevadores</option>
-                    <option value="Q Ascensores">Q Ascensores</option>
-                </select><br><br>
-
-                <label>Ubicación:</label><br>
-                <input type="text" name="ubicacion"><br><br>
-
-                <label>Descripción:</label><br>
-                <input type="text" name="descripcion"><br><br>
-
-                <label>Fecha Vencimiento Contrato:</label><br>
-                <input type="date" name="fecha_vencimiento_contrato"><br><br>
-
-                <label>RAE (solo para ascensores):</label><br>
-                <input type="text" name="rae"><br><br>
-
-                <label>IPO Próxima:</label><br>
-                <input type="date" name="ipo_proxima"><br><br>
-
-                <button type="submit" class="button">Registrar Equipo</button>
-            </form>
-        </div>
-    </main>
-</body>
-</html>
-"""
-EDIT_LEAD_TEMPLATE = """
-<!DOCTYPE html>
-<html lang="es">
-<head>
-    <meta charset="UTF-8">
-    <title>Editar Lead</title>
-    <link rel="stylesheet" href="/static/styles.css">
-</head>
-<body>
-<header>
-    <div class="header-container">
-        <div class="logo-container">
-            <a href="/home">
-                <img src="/static/logo-fedes-ascensores.png" alt="Logo Fedes Ascensores" class="logo">
-            </a>
-        </div>
-        <div class="title-container">
-            <h1>Editar Lead</h1>
-        </div>
-    </div>
-</header>
-<main>
-    <div class="menu">
-        <form method="POST">
-            <label>Tipo de Lead:</label><br>
-            <select name="tipo_lead" required>
-                <option value="">-- Selecciona un tipo --</option>
-                <option value="Comunidad" {% if lead.tipo_cliente == 'Comunidad' %}selected{% endif %}>Comunidad</option>
-                <option value="Hotel/Apartamentos" {% if lead.tipo_cliente == 'Hotel/Apartamentos' %}selected{% endif %}>Hotel/Apartamentos</option>
-                <option value="Empresa" {% if lead.tipo_cliente == 'Empresa' %}selected{% endif %}>Empresa</option>
-                <option value="Otro" {% if lead.tipo_cliente == 'Otro' %}selected{% endif %}>Otro</option>
-            </select><br><br>
-
-            <label>Dirección:</label><br>
-            <input type="text" name="direccion" value="{{ lead.direccion }}" required><br><br>
-
-            <label>Nombre de la Instalación:</label><br>
-            <input type="text" name="nombre_lead" value="{{ lead.nombre_cliente }}" required><br><br>
-
-            <label>Código Postal:</label><br>
-            <input type="text" name="codigo_postal" value="{{ lead.codigo_postal }}"><br><br>
-
-            <label>Localidad:</label><br>
-            <select name="localidad" required>
-                <option value="">-- Selecciona una localidad --</option>
-                <option value="Agaete" {% if lead.localidad == 'Agaete' %}selected{% endif %}>Agaete</option>
-                <option value="Agüimes" {% if lead.localidad == 'Agüimes' %}selected{% endif %}>Agüimes</option>
-                <option value="Arguineguín" {% if lead.localidad == 'Arguineguín' %}selected{% endif %}>Arguineguín</option>
-                <option value="Arinaga" {% if lead.localidad == 'Arinaga' %}selected{% endif %}>Arinaga</option>
-                <option value="Artenara" {% if lead.localidad == 'Artenara' %}selected{% endif %}>Artenara</option>
-                <option value="Arucas" {% if lead.localidad == 'Arucas' %}selected{% endif %}>Arucas</option>
-                <option value="Carrizal" {% if lead.localidad == 'Carrizal' %}selected{% endif %}>Carrizal</option>
-                <option value="Cruce de Arinaga" {% if lead.localidad == 'Cruce de Arinaga' %}selected{% endif %}>Cruce de Arinaga</option>
-                <option value="El Burrero" {% if lead.localidad == 'El Burrero' %}selected{% endif %}>El Burrero</option>
-                <option value="El Tablero" {% if lead.localidad == 'El Tablero' %}selected{% endif %}>El Tablero</option>
-                <option value="Gáldar" {% if lead.localidad == 'Gáldar' %}selected{% endif %}>Gáldar</option>
-                <option value="Ingenio" {% if lead.localidad == 'Ingenio' %}selected{% endif %}>Ingenio</option>
-                <option value="Jinámar" {% if lead.localidad == 'Jinámar' %}selected{% endif %}>Jinámar</option>
-                <option value="La Aldea de San Nicolás" {% if lead.localidad == 'La Aldea de San Nicolás' %}selected{% endif %}>La Aldea de San Nicolás</option>
-                <option value="La Pardilla" {% if lead.localidad == 'La Pardilla' %}selected{% endif %}>La Pardilla</option>
-                <option value="Las Palmas de Gran Canaria" {% if lead.localidad == 'Las Palmas de Gran Canaria' %}selected{% endif %}>Las Palmas de Gran Canaria</option>
-                <option value="Maspalomas" {% if lead.localidad == 'Maspalomas' %}selected{% endif %}>Maspalomas</option>
-                <option value="Mogán" {% if lead.localidad == 'Mogán' %}selected{% endif %}>Mogán</option>
-                <option value="Moya" {% if lead.localidad == 'Moya' %}selected{% endif %}>Moya</option>
-                <option value="Playa de Mogán" {% if lead.localidad == 'Playa de Mogán' %}selected{% endif %}>Playa de Mogán</option>
-                <option value="Playa del Inglés" {% if lead.localidad == 'Playa del Inglés' %}selected{% endif %}>Playa del Inglés</option>
-                <option value="Puerto Rico" {% if lead.localidad == 'Puerto Rico' %}selected{% endif %}>Puerto Rico</option>
-                <option value="San Bartolomé de Tirajana" {% if lead.localidad == 'San Bartolomé de Tirajana' %}selected{% endif %}>San Bartolomé de Tirajana</option>
-                <option value="San Fernando" {% if lead.localidad == 'San Fernando' %}selected{% endif %}>San Fernando</option>
-                <option value="San Mateo" {% if lead.localidad == 'San Mateo' %}selected{% endif %}>San Mateo</option>
-                <option value="Santa Brígida" {% if lead.localidad == 'Santa Brígida' %}selected{% endif %}>Santa Brígida</option>
-                <option value="Santa Lucía de Tirajana" {% if lead.localidad == 'Santa Lucía de Tirajana' %}selected{% endif %}>Santa Lucía de Tirajana</option>
-                <option value="Santa María de Guía" {% if lead.localidad == 'Santa María de Guía' %}selected{% endif %}>Santa María de Guía</option>
-                <option value="Tafira" {% if lead.localidad == 'Tafira' %}selected{% endif %}>Tafira</option>
-                <option value="Tejeda" {% if lead.localidad == 'Tejeda' %}selected{% endif %}>Tejeda</option>
-                <option value="Teror" {% if lead.localidad == 'Teror' %}selected{% endif %}>Teror</option>
-                <option value="Valleseco" {% if lead.localidad == 'Valleseco' %}selected{% endif %}>Valleseco</option>
-                <option value="Valsequillo" {% if lead.localidad == 'Valsequillo' %}selected{% endif %}>Valsequillo</option>
-                <option value="Vecindario" {% if lead.localidad == 'Vecindario' %}selected{% endif %}>Vecindario</option>
-            </select><br><br>
-
-            <label>Zona:</label><br>
-            <input type="text" name="zona" value="{{ lead.zona }}"><br><br>
-
-            <label>Persona de Contacto:</label><br>
-            <input type="text" name="persona_contacto" value="{{ lead.persona_contacto }}"><br><br>
-
-            <label>Teléfono:</label><br>
-            <input type="text" name="telefono" value="{{ lead.telefono }}"><br><br>
-
-            <label>Email:</label><br>
-            <input type="email" name="email" value="{{ lead.email }}"><br><br>
-
-            <label>Observaciones:</label><br>
-            <textarea name="observaciones">{{ lead.observaciones }}</textarea><br><br>
-            <a href="/nuevo_equipo?cliente_id={{ lead.id }}" class="button">
-    ➕ Añadir nuevo equipo
-</a>
-
-            <button type="submit" class="button">Actualizar Lead</button>
-        </form>
-    </div>
-</main>
-</body>
-</html>
-"""
 # 🟢 Listado de Leads y Equipos
 @app.route("/leads")
+@condicional
 def leads():
     if "usuario" not in session:
         return redirect("/")
-    response = requests.get(f"{SUPABASE_URL}/rest/v1/clientes?select=*", headers=HEADERS)
-    if response.status_code == 200:
-        leads_data = response.json()
-        # Para cada lead, traer sus equipos asociados
-        for lead in leads_data:
-            lead_id = lead["id"]
-            equipos_response = requests.get(f"{SUPABASE_URL}/rest/v1/equipos?cliente_id=eq.{lead_id}", headers=HEADERS)
-            if equipos_response.status_code == 200:
-                lead["equipos"] = equipos_response.json()
-            else:
-                lead["equipos"] = []
-        return render_template_string(LEADS_TEMPLATE, leads=leads_data)
-    else:
-        return f"<h3 style='color:red;'>❌ Error al obtener leads</h3><pre>{response.text}</pre><a href='/home'>Volver</a>"
-
-# 📝 Plantilla de listado de Leads y Equipos
-LEADS_TEMPLATE = """
-<!DOCTYPE html>
-<html lang='es'>
-<head>
-    <meta charset='UTF-8'>
-    <title>Leads y Equipos</title>
-    <link rel='stylesheet' href='/static/styles.css'>
-</head>
-<body>
- <header>
-    <div class="header-container">
-        <div class="logo-container">
-            <a href="/home">
-                <img src="/static/logo-fedes-ascensores.png" alt="Logo Fedes Ascensores" class="logo">
-            </a>
-        </div>
-        <div class="title-container">
-            <h1>Leads y Equipos</h1>
-        </div>
-    </div>
-</header>
-    <h1>Leads y Equipos</h1>
-    </header>
-    <main>
-        <div class='menu'>
-            {% for lead in leads %}
-                <div class='lead-box'>
-                    <h3>{{ lead.nombre_cliente }} ({{ lead.tipo_cliente }})</h3>
-                    <p>Dirección: {{ lead.direccion }}</p>
-                    <p>Localidad: {{ lead.localidad }}</p>
-                    <p>Contacto: {{ lead.persona_contacto }} - {{ lead.telefono }}</p>
-                    <p>Email: {{ lead.email }}</p>
-                    <p>Observaciones: {{ lead.observaciones }}</p>
-                    <h4>Equipos Asociados:</h4>
-                    <ul>
-                        {% for equipo in lead.equipos %}
-                            <li>{{ equipo.tipo_equipo }} - {{ equipo.empresa_mantenedora }} - {{ equipo.descripcion }}</li>
-                        {% else %}
-                            <li>No hay equipos registrados.</li>
-                        {% endfor %}
-                    </ul>
-                </div>
-                <hr>
-            {% endfor %}
-            <a href='/home' class='button'>🏠 Volver al inicio</a>
-        </div>
-    </main>
-</body>
-</html>
-"""
+    # Primera página antes de empezar a responder, para poder devolver un error normal
+    leads_data, siguiente, error = pagina_leads()
+    if error is not None:
+        return f"<h3 style='color:red;'>❌ Error al obtener leads</h3><pre>{escape(error.text)}</pre><a href='/home'>Volver</a>"
+    leads_stream = FilasEnStreaming(leads_data, siguiente, pagina_leads)
+    return respuesta_en_streaming("leads.html", leads=leads_stream)
+
 @app.route("/leads_dashboard")
+@condicional
 def leads_dashboard():
     if "usuario" not in session:
         return redirect("/")
 
-    # Consultar todos los Leads
-    response = requests.get(f"{SUPABASE_URL}/rest/v1/clientes?select=*", headers=HEADERS)
+    orden, direccion, filtros = parametros_dashboard()
+    por_pagina = min(max(request.args.get("por_pagina", DASHBOARD_POR_PAGINA, type=int) or DASHBOARD_POR_PAGINA, 1),
+                     DASHBOARD_POR_PAGINA_MAX)
+    despues = request.args.get("despues")
+    cursor = decodificar_cursor(despues, orden) if despues else None
+    # El total solo se pide en la primera página y viaja en los enlaces siguientes
+    total = request.args.get("total", type=int)
+
+    if request.args.get("todo") == "1":
+        return dashboard_en_streaming(orden, direccion, filtros)
+
+    rows, siguiente, total_pagina, error = pagina_dashboard(orden, direccion, cursor, por_pagina,
+                                                           contar=cursor is None, filtros=filtros)
+    if error is not None:
+        return f"<h3 style='color:red;'>❌ Error al obtener leads</h3><pre>{escape(error.text)}</pre><a href='/home'>Volver</a>"
+    if cursor is None:
+        total = total_pagina
+
+    base = dict(filtros, orden=orden, dir=direccion, por_pagina=por_pagina)
+    enlaces_orden = {
+        columna: "?" + urllib.parse.urlencode(dict(
+            filtros,
+            orden=columna,
+            dir="desc" if columna == orden and direccion == "asc" else "asc",
+            por_pagina=por_pagina,
+        ))
+        for columna in DASHBOARD_ORDEN_CLIENTE + DASHBOARD_ORDEN_EQUIPO
+    }
+    siguiente_url = "?" + urllib.parse.urlencode(dict(base, despues=siguiente, total=total or "")) if siguiente else None
+    primera_url = "?" + urllib.parse.urlencode(base) if cursor is not None else None
+    return render_template(
+        "leads_dashboard.html", rows=rows, total=total, orden=orden, direccion=direccion,
+        unidad="equipos" if orden in DASHBOARD_ORDEN_EQUIPO else "leads",
+        enlaces_orden=enlaces_orden, siguiente_url=siguiente_url, primera_url=primera_url,
+        todo_url="?" + urllib.parse.urlencode(dict(filtros, orden=orden, dir=direccion, todo=1)),
+        filtros=dict(filtros), exportar_url=url_exportar(orden, direccion, filtros)
+    )
+
+
+def parametros_dashboard():
+    # Orden y filtros del dashboard, compartidos por la vista y la exportación.
+    # filtros es una tupla de (parámetro, valor) en orden fijo: sirve de clave de caché.
+    orden = request.args.get("orden", "id")
+    if orden not in DASHBOARD_ORDEN_CLIENTE + DASHBOARD_ORDEN_EQUIPO:
+        orden = "id"
+    direccion = "desc" if request.args.get("dir") == "desc" else "asc"
+    filtros = []
+    for nombre in DASHBOARD_FILTROS_CLIENTE + DASHBOARD_FILTROS_EQUIPO:
+        valor = request.args.get(nombre, "").strip()
+        if valor:
+            filtros.append((nombre, valor))
+    for nombre in DASHBOARD_FILTROS_FECHA:
+        try:
+            filtros.append((nombre, datetime.date.fromisoformat(request.args.get(nombre, "")).isoformat()))
+        except ValueError:
+            pass  # vacía o mal formada: sin filtro
+    return orden, direccion, tuple(filtros)
+
+
+def url_exportar(orden, direccion, filtros):
+    return "/leads_dashboard/exportar?" + urllib.parse.urlencode(dict(filtros, orden=orden, dir=direccion))
+
+
+def filas_dashboard_completas(orden, direccion, filtros=()):
+    """Devuelve (filas, total, error): todas las filas del dashboard como FilasEnStreaming, sin pasar por la caché."""
+    (rows, siguiente, total), error = _pagina_dashboard(orden, direccion, None, STREAMING_POR_PAGINA, True, filtros)
+    if error is not None:
+        return None, None, error
+
+    def cargar_pagina(cursor):
+        pagina, error = _pagina_dashboard(orden, direccion, decodificar_cursor(cursor, orden), STREAMING_POR_PAGINA, False,
+                                          filtros)
+        return (None, None, error) if error is not None else (pagina[0], pagina[1], None)
+
+    return FilasEnStreaming(rows, siguiente, cargar_pagina), total, None
+
+
+def dashboard_en_streaming(orden, direccion, filtros=()):
+    # ?todo=1: el dashboard completo, página a página
+    rows, total, error = filas_dashboard_completas(orden, direccion, filtros)
+    if error is not None:
+        return f"<h3 style='color:red;'>❌ Error al obtener leads</h3><pre>{escape(error.text)}</pre><a href='/home'>Volver</a>"
+
+    enlaces_orden = {
+        columna: "?" + urllib.parse.urlencode(dict(
+            filtros,
+            orden=columna,
+            dir="desc" if columna == orden and direccion == "asc" else "asc",
+            todo=1,
+        ))
+        for columna in DASHBOARD_ORDEN_CLIENTE + DASHBOARD_ORDEN_EQUIPO
+    }
+    return respuesta_en_streaming(
+        "leads_dashboard.html", rows=rows, total=total,
+        orden=orden, direccion=direccion, unidad="equipos" if orden in DASHBOARD_ORDEN_EQUIPO else "leads",
+        enlaces_orden=enlaces_orden, siguiente_url=None, primera_url="?" + urllib.parse.urlencode(
+            dict(filtros, orden=orden, dir=direccion)), todo_url=None,
+        filtros=dict(filtros), exportar_url=url_exportar(orden, direccion, filtros)
+    )
+
+# 📥 Exportación del dashboard a CSV / XLSX
+EXPORT_COLUMNAS = [
+    ("direccion", "Dirección"),
+    ("localidad", "Localidad"),
+    ("codigo_postal", "Código Postal"),
+    ("total_equipos", "Total Equipos"),
+    ("empresa_mantenedora", "Empresa Mantenedora"),
+    ("fecha_vencimiento_contrato", "Vencimiento Contrato"),
+    ("ipo_proxima", "IPO Próxima"),
+]
+EXPORT_FILAS_POR_TROZO = 500
+
+
+@app.route("/leads_dashboard/exportar")
+def exportar_dashboard():
+    if "usuario" not in session:
+        return redirect("/")
+
+    formato = request.args.get("formato", "csv")
+    if formato not in ("csv", "xlsx"):
+        return "Formato de exportación no soportado", 400
+
+    orden, direccion, filtros = parametros_dashboard()
+    rows, _, error = filas_dashboard_completas(orden, direccion, filtros)
+    if error is not None:
+        return f"<h3 style='color:red;'>❌ Error al obtener leads</h3><pre>{escape(error.text)}</pre><a href='/home'>Volver</a>"
+
+    nombre = f"ascensoralert_{time.strftime('%Y%m%d')}.{formato}"
+    if formato == "csv":
+        return Response(
+            stream_with_context(_csv_dashboard(rows)), mimetype="text/csv",
+            headers={"Content-Disposition": f"attachment; filename={nombre}"}
+        )
+    return Response(
+        stream_with_context(_xlsx_dashboard(rows)),
+        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": f"attachment; filename={nombre}"}
+    )
+
+
+def _csv_dashboard(rows):
+    # BOM para que Excel abra el UTF-8 con acentos; se envía en trozos de EXPORT_FILAS_POR_TROZO filas
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=";")
+    buffer.write("\ufeff")
+    writer.writerow([titulo for _, titulo in EXPORT_COLUMNAS])
+    for n, row in enumerate(rows, 1):
+        writer.writerow([row[campo] for campo, _ in EXPORT_COLUMNAS])
+        if n % EXPORT_FILAS_POR_TROZO == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if rows.error:
+        writer.writerow(["❌ Exportación incompleta", rows.error])
+    yield buffer.getvalue()
+
+
+# XLSX mínimo (una hoja, cabecera en negrita) escrito a mano: el zip sale hacia el cliente según se
+# comprime cada fila, sin esperar a tener el libro entero. Los textos van como inlineStr, sin tabla
+# de cadenas compartidas que obligaría a guardar todas hasta el final.
+XLSX_PARTES = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Dashboard" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '<Relationship Id="rId2" Target="styles.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"/>'
+        '</Relationships>'
+    ),
+    "xl/styles.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+        '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+}
+XML_NO_VALIDOS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+
+class _SalidaZip:
+    # Destino sin seek para zipfile (escribe descriptores de datos tras cada parte): acumula
+    # lo comprimido hasta que el generador lo envía
+    def __init__(self):
+        self.trozos = []
+
+    def write(self, datos):
+        self.trozos.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b"".join(self.trozos)
+        self.trozos.clear()
+        return datos
+
+
+def _fila_xlsx(numero, valores, estilo=0):
+    atributo_estilo = f' s="{estilo}"' if estilo else ""
+    celdas = []
+    for valor in valores:
+        if valor is None or valor == "":
+            celdas.append("<c/>")
+        elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            celdas.append(f"<c><v>{valor}</v></c>")
+        else:
+            texto = XML_NO_VALIDOS.sub("", str(valor)).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+            celdas.append(f'<c t="inlineStr"{atributo_estilo}><is><t xml:space="preserve">{texto}</t></is></c>')
+    return f'<row r="{numero}">{"".join(celdas)}</row>'
+
+
+def _xlsx_dashboard(rows):
+    # Se envía lo comprimido cada EXPORT_FILAS_POR_TROZO filas: el primer byte sale con la primera página
+    salida = _SalidaZip()
+    with zipfile.ZipFile(salida, "w", zipfile.ZIP_DEFLATED) as libro:
+        for nombre, contenido in XLSX_PARTES.items():
+            libro.writestr(nombre, contenido)
+        with libro.open("xl/worksheets/sheet1.xml", "w") as hoja:
+            hoja.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                       b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            hoja.write(_fila_xlsx(1, [titulo for _, titulo in EXPORT_COLUMNAS], estilo=1).encode())
+            n = 1
+            for n, row in enumerate(rows, 2):
+                hoja.write(_fila_xlsx(n, [row[campo] for campo, _ in EXPORT_COLUMNAS]).encode())
+                if n % EXPORT_FILAS_POR_TROZO == 0:
+                    yield salida.vaciar()
+            if rows.error:
+                hoja.write(_fila_xlsx(n + 1, ["❌ Exportación incompleta", rows.error]).encode())
+            hoja.write(b"</sheetData></worksheet>")
+    yield salida.vaciar()
+
+# 🔔 Alertas de vencimiento de IPO y contrato
+# Consultas por rango sobre (fecha, id), indexadas en sql/indices.sql: el coste depende de
+# las K alertas pedidas, no del tamaño de equipos. La caché se invalida con cada escritura.
+ALERTAS_DIAS = 90
+ALERTAS_DIAS_MAX = 3650
+ALERTAS_LIMITE = 50
+ALERTAS_LIMITE_MAX = 500
+TIPOS_VENCIMIENTO = {"ipo_proxima": "IPO", "fecha_vencimiento_contrato": "Contrato"}
+
+
+def proximos_vencimientos(dias, limite, localidad=None, empresa=None, columnas=tuple(TIPOS_VENCIMIENTO)):
+    """Devuelve (alertas, error): los `limite` vencimientos más próximos de hoy a hoy+`dias`."""
+    hoy = datetime.date.today()
+    clave = cache.clave_lista(
+        ("clientes", "equipos"),
+        f"alertas:{hoy}:{dias}:{limite}:{localidad}:{empresa}:{','.join(columnas)}"
+    )
+    return cache.obtener(clave, lambda: _proximos_vencimientos(hoy, dias, limite, localidad, empresa, columnas))
+
+
+def _proximos_vencimientos(hoy, dias, limite, localidad, empresa, columnas):
+    hasta = hoy + datetime.timedelta(days=dias)
+    peticiones = []
+    for columna in columnas:
+        params = [
+            ("select", f"id,tipo_equipo,empresa_mantenedora,{columna},clientes!inner(id,direccion,localidad)"),
+            (columna, f"gte.{hoy.isoformat()}"),
+            (columna, f"lte.{hasta.isoformat()}"),
+            ("order", f"{columna}.asc,id.asc"),
+            ("limit", limite),
+        ]
+        if localidad:
+            params.append(("clientes.localidad", f"eq.{localidad}"))
+        if empresa:
+            params.append(("empresa_mantenedora", f"eq.{empresa}"))
+        peticiones.append(("equipos", params))
+    por_columna = []
+    for columna, response in zip(columnas, supabase_en_paralelo(peticiones)):
+        if response.status_code != 200:
+            return None, response
+        por_columna.append([_alerta(equipo, columna, hoy) for equipo in response.json()])
+    # Cada lista ya viene ordenada: mezclarlas cuesta O(K)
+    fusion = heapq.merge(*por_columna, key=lambda alerta: (alerta["fecha"], alerta["equipo_id"]))
+    return list(itertools.islice(fusion, limite)), None
+
+
+def _alerta(equipo, columna, hoy):
+    lead = equipo.get("clientes") or {}
+    fecha = equipo[columna]
+    return {
+        "tipo": TIPOS_VENCIMIENTO[columna],
+        "fecha": fecha,
+        "fecha_texto": formatear_fecha(fecha),
+        "dias": (datetime.date.fromisoformat(fecha) - hoy).days,
+        "equipo_id": equipo["id"],
+        "tipo_equipo": equipo.get("tipo_equipo") or "-",
+        "empresa_mantenedora": equipo.get("empresa_mantenedora") or "-",
+        "lead_id": lead.get("id"),
+        "direccion": lead.get("direccion") or "-",
+        "localidad": lead.get("localidad") or "-",
+    }
+
+
+@app.route("/alertas")
+@condicional
+def alertas():
+    if "usuario" not in session:
+        return redirect("/")
+
+    dias = min(max(request.args.get("dias", ALERTAS_DIAS, type=int) or ALERTAS_DIAS, 1), ALERTAS_DIAS_MAX)
+    limite = min(max(request.args.get("limite", ALERTAS_LIMITE, type=int) or ALERTAS_LIMITE, 1), ALERTAS_LIMITE_MAX)
+    tipo = request.args.get("tipo")
+    columnas = (tipo,) if tipo in TIPOS_VENCIMIENTO else tuple(TIPOS_VENCIMIENTO)
+    localidad = request.args.get("localidad") or None
+    empresa = request.args.get("empresa_mantenedora") or None
+
+    lista, error = proximos_vencimientos(dias, limite, localidad, empresa, columnas)
+    if error is not None:
+        return f"<h3 style='color:red;'>❌ Error al obtener alertas</h3><pre>{escape(error.text)}</pre><a href='/home'>Volver</a>"
+    return render_template(
+        "alertas.html", alertas=lista, dias=dias, limite=limite, tipo=tipo if len(columnas) == 1 else None,
+        localidad=localidad, empresa=empresa
+    )
+
+
+# 📈 Resumen: equipos por empresa, leads por localidad/zona y vencimientos por mes
+# Lo agrega Postgres (sql/resumen_dashboard.sql) y llegan unas decenas de filas, tenga equipos
+# 1.000 o 1.000.000 de registros. Se cachea con la generación de clientes+equipos: cada alta,
+# edición o borrado lo deja obsoleto y la siguiente visita lo vuelve a pedir en una llamada.
+RESUMEN_MESES = 24
+RESUMEN_MESES_MAX = 60
+
+
+def resumen_dashboard(meses=RESUMEN_MESES):
+    """Devuelve (resumen, error) con los meses de vencimientos desde el actual."""
+    hoy = datetime.date.today()
+    clave = cache.clave_lista(("clientes", "equipos"), f"resumen:{hoy}:{meses}")
+    return cache.obtener(clave, lambda: _resumen_dashboard(meses))
+
+
+def _resumen_dashboard(meses):
+    response = supabase.get("rpc/resumen_dashboard", params={"meses": meses})
     if response.status_code != 200:
-        return f"<h3 style='color:red;'>❌ Error al obtener leads</h3><pre>{response.text}</pre><a href='/home'>Volver</a>"
+        return None, response
+    resumen = response.json()
+    for fila in resumen["meses"]:
+        fila["mes_texto"] = datetime.date.fromisoformat(fila["mes"]).strftime("%m/%Y")
+    return resumen, None
+
+
+def url_dashboard_mes(columna, mes):
+    # Enlace al dashboard filtrado por los vencimientos de ese mes (filtros de fecha del dashboard)
+    inicio = datetime.date.fromisoformat(mes)
+    fin = (inicio + datetime.timedelta(days=31)).replace(day=1) - datetime.timedelta(days=1)
+    prefijo = "ipo" if columna == "ipo_proxima" else "contrato"
+    return "/leads_dashboard?" + urllib.parse.urlencode(
+        {"orden": columna, f"{prefijo}_desde": inicio.isoformat(), f"{prefijo}_hasta": fin.isoformat()}
+    )
+
+
+@app.route("/resumen")
+@condicional
+def resumen():
+    if "usuario" not in session:
+        return redirect("/")
+
+    meses = min(max(request.args.get("meses", RESUMEN_MESES, type=int) or RESUMEN_MESES, 1), RESUMEN_MESES_MAX)
+    datos, error = resumen_dashboard(meses)
+    if error is not None:
+        return f"<h3 style='color:red;'>❌ Error al obtener el resumen</h3><pre>{escape(error.text)}</pre><a href='/home'>Volver</a>"
+    return render_template("resumen.html", resumen=datos, meses=meses, url_dashboard_mes=url_dashboard_mes)
+
+
+# 🔎 Búsqueda de leads: índice de trigramas en memoria
+# Cada worker carga los clientes por páginas de id en un hilo al arrancar y mantiene el índice
+# al día con las altas y ediciones que atiende; cada BUSQUEDA_SINCRONIZAR segundos recoge
+# además las filas cambiadas por otros workers (updated_at, sql/updated_at.sql). Los borrados no
+# dejan updated_at: cada BUSQUEDA_RECONCILIAR segundos se comparan los ids del índice con los de
+# Supabase (o la réplica), y un lead que ya no existe al pedirlo se quita en el momento.
+# Mientras no ha terminado de cargar, /buscar pregunta a Supabase con ilike.
+BUSQUEDA_ACTIVA = os.environ.get("BUSQUEDA_ACTIVA", "1") == "1"
+BUSQUEDA_SINCRONIZAR = int(os.environ.get("BUSQUEDA_SINCRONIZAR", "60"))
+BUSQUEDA_RECONCILIAR = int(os.environ.get("BUSQUEDA_RECONCILIAR", "600"))
+BUSQUEDA_CAMPOS = ("direccion", "nombre_cliente", "persona_contacto", "telefono")
+BUSQUEDA_COLUMNAS = "id,direccion,nombre_cliente,persona_contacto,telefono,localidad,codigo_postal"
+BUSQUEDA_POR_PAGINA = 1000
+BUSQUEDA_LIMITE = 20
+BUSQUEDA_EXPLORAR = 2000  # candidatos revisados como mucho buscando mejores coincidencias
+
+
+def normalizar_busqueda(texto):
+    # "Agüimes, C/ Gáldar 3" -> "aguimes c galdar 3"
+    texto = unicodedata.normalize("NFKD", str(texto or "")).encode("ascii", "ignore").decode().lower()
+    return " ".join(re.split(r"[^a-z0-9]+", texto)).strip()
+
+
+def _trigramas(palabra):
+    # Con dos espacios delante, como pg_trgm: los trigramas del principio permiten buscar por prefijo
+    relleno = f"  {palabra}"
+    return {relleno[i:i + 3] for i in range(len(relleno) - 2)}
+
+
+class IndiceTrigramas:
+    # Listas de publicación como array('i') ordenados por id (4 bytes por entrada) y cada lead como
+    # tupla de BUSQUEDA_COLUMNAS: ~100k leads caben en unas decenas de MB por worker.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._publicaciones = {}  # trigrama -> array('i') de ids, ordenado
+        self._leads = {}          # id -> (texto normalizado, valores de BUSQUEDA_COLUMNAS)
+        self._columnas = BUSQUEDA_COLUMNAS.split(",")
+        self.cargado = False
+
+    def __len__(self):
+        return len(self._leads)
+
+    def ids(self):
+        with self._lock:
+            return list(self._leads)
+
+    def obtener(self, lead_id):
+        indexado = self._leads.get(int(lead_id))
+        return None if indexado is None else dict(zip(self._columnas, indexado[1]))
+
+    def actualizar(self, lead):
+        """Indexa lead (dict con id) y lo devuelve completo: las columnas que no trae se conservan."""
+        lead_id = int(lead["id"])
+        with self._lock:
+            anterior = self._leads.get(lead_id)
+            if anterior is not None:
+                lead = dict(zip(self._columnas, anterior[1]), **lead)
+                self._quitar(lead_id, anterior[0])
+            texto = " ".join(filter(None, (normalizar_busqueda(lead.get(campo)) for campo in BUSQUEDA_CAMPOS)))
+            for trigrama in self._trigramas_texto(texto):
+                publicacion = self._publicaciones.setdefault(trigrama, array.array("i"))
+                if not publicacion or publicacion[-1] < lead_id:
+                    publicacion.append(lead_id)  # carga inicial y altas: ids crecientes
+                else:
+                    bisect.insort(publicacion, lead_id)
+            self._leads[lead_id] = (f" {texto}", tuple(lead.get(columna) for columna in self._columnas))
+        return dict(zip(self._columnas, self._leads[lead_id][1]))
+
+    def eliminar(self, lead_id):
+        with self._lock:
+            anterior = self._leads.pop(int(lead_id), None)
+            if anterior is not None:
+                self._quitar(int(lead_id), anterior[0])
+
+    def _quitar(self, lead_id, texto):
+        for trigrama in self._trigramas_texto(texto):
+            publicacion = self._publicaciones[trigrama]
+            i = bisect.bisect_left(publicacion, lead_id)
+            if i < len(publicacion) and publicacion[i] == lead_id:
+                del publicacion[i]
+
+    @staticmethod
+    def _trigramas_texto(texto):
+        trigramas = set()
+        for palabra in texto.split():
+            trigramas |= _trigramas(palabra)
+        return trigramas
+
+    def buscar(self, consulta, limite=BUSQUEDA_LIMITE):
+        """Leads con todas las palabras de la consulta, sin distinguir acentos ni mayúsculas.
+
+        Las palabras de menos de tres letras solo casan como inicio de palabra. Primero salen los
+        leads en los que todas las palabras son inicio de palabra y, después, los más recientes.
+        """
+        palabras = normalizar_busqueda(consulta).split()
+        if not palabras:
+            return []
+        trigramas = set()
+        for palabra in palabras:
+            trigramas |= _trigramas(palabra) if len(palabra) < 3 else _trigramas(palabra) - _trigramas(palabra[:2])
+        prefijos_buscados = [f" {palabra}" for palabra in palabras]
+        requeridas = [f" {palabra}" if len(palabra) < 3 else palabra for palabra in palabras]
+        with self._lock:
+            # Se recorre la publicación más corta de la más reciente a la más antigua y se
+            # verifica cada candidato; se para en cuanto hay `limite` coincidencias de inicio de
+            # palabra o, si ya hay `limite` coincidencias, tras BUSQUEDA_EXPLORAR candidatos
+            candidatos = min((self._publicaciones.get(t, ()) for t in trigramas), key=len)
+            mejores, resto = [], []
+            for n, lead_id in enumerate(reversed(candidatos)):
+                if n >= BUSQUEDA_EXPLORAR and len(mejores) + len(resto) >= limite:
+                    break
+                texto, valores = self._leads[lead_id]
+                if all(prefijo in texto for prefijo in prefijos_buscados):
+                    mejores.append(valores)
+                    if len(mejores) >= limite:
+                        break
+                elif len(resto) < limite and all(palabra in texto for palabra in requeridas):
+                    resto.append(valores)
+        return [dict(zip(self._columnas, valores)) for valores in (mejores + resto)[:limite]]
+
+
+indice_leads = IndiceTrigramas()
+_indice_leads_hilo = {"iniciado": False, "lock": threading.Lock()}
+
+
+def buscar_en_supabase(consulta, limite=BUSQUEDA_LIMITE):
+    """Devuelve (leads, error): la misma búsqueda con ilike, mientras el índice no está cargado (sí distingue acentos)."""
+    condiciones = []
+    for palabra in consulta.split():
+        patron = _literal(f"*{palabra}*")
+        condiciones.append("or(" + ",".join(f"{campo}.ilike.{patron}" for campo in BUSQUEDA_CAMPOS) + ")")
+    if not condiciones:
+        return [], None
+    response = supabase.get("clientes", params=[
+        ("select", BUSQUEDA_COLUMNAS), ("and", f"({','.join(condiciones)})"), ("order", "id.asc"), ("limit", limite)
+    ])
+    if response.status_code != 200:
+        return None, response
+    return response.json(), None
+
+
+def cargar_indice_leads():
+    """Carga todos los clientes en indice_leads e indice_direcciones; devuelve el error de Supabase o None."""
+    despues_id = None
+    while True:
+        params = [("select", BUSQUEDA_COLUMNAS), ("order", "id.asc"), ("limit", BUSQUEDA_POR_PAGINA)]
+        if despues_id is not None:
+            params.append(("id", f"gt.{despues_id}"))
+        response = supabase.get("clientes", params=params)
+        if response.status_code != 200:
+            return response
+        pagina = response.json()
+        for lead in pagina:
+            indexar_lead(lead)
+        if len(pagina) < BUSQUEDA_POR_PAGINA:
+            indice_leads.cargado = True
+            return None
+        despues_id = pagina[-1]["id"]
+
+
+def sincronizar_indice_leads(marca):
+    """Indexa los clientes con (updated_at, id) posterior a marca; devuelve (nueva_marca, error)."""
+    while True:
+        params = [("select", f"{BUSQUEDA_COLUMNAS},updated_at"), ("order", "updated_at.asc,id.asc"),
+                  ("updated_at", "not.is.null"), ("limit", BUSQUEDA_POR_PAGINA)]
+        response = supabase.get("clientes", params=params + filtros_keyset("updated_at", "asc", marca))
+        if response.status_code != 200:
+            return marca, response
+        pagina = response.json()
+        for lead in pagina:
+            indexar_lead(lead)
+        if pagina:
+            marca = (pagina[-1]["updated_at"], pagina[-1]["id"])
+        if len(pagina) < BUSQUEDA_POR_PAGINA:
+            return marca, None
+
+
+def sincronizar_indice_desde_replica(marca):
+    """Indexa los clientes de la réplica con (cambio, id) posterior a marca; devuelve la nueva marca."""
+    while True:
+        pagina = replica.clientes_cambiados(marca, BUSQUEDA_POR_PAGINA)
+        for lead in pagina:
+            marca = (lead.pop("cambio"), lead["id"])
+            indexar_lead(lead)
+        if len(pagina) < BUSQUEDA_POR_PAGINA:
+            return marca
+
+
+def reconciliar_indice_leads():
+    """Quita del índice los leads borrados desde otro worker o fuera de la aplicación; devuelve el error o None."""
+    # Solo se miran los ids indexados antes de pedir los vigentes: las altas que este worker indexe
+    # mientras tanto no se tocan. La réplica se pone al día antes, para que tenga todo lo indexado.
+    indexados = indice_leads.ids()
+    if replica is not None and replica.lista:
+        error = replica.sincronizar()
+        vigentes = replica.ids("clientes")
+    else:
+        vigentes, error = ids_en_supabase("clientes")
+    if error is not None:
+        return error
+    borrados = [lead_id for lead_id in indexados if lead_id not in vigentes]
+    for lead_id in borrados:
+        desindexar_lead(lead_id)
+    if borrados:
+        app.logger.info("Índice de búsqueda: %d leads borrados fuera de este worker", len(borrados))
+    return None
+
+
+def _bucle_indice_leads():
+    # Margen para cambios que entren mientras se carga y para relojes desajustados
+    inicio = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=5)
+    marca = (inicio.isoformat(), 0)
+    # Con réplica el índice se carga y se pone al día leyendo el fichero local
+    marca_replica = (0, 0)
+    while not indice_leads.cargado:
+        if replica is not None and replica.lista:
+            marca_replica = sincronizar_indice_desde_replica(marca_replica)
+            indice_leads.cargado = True
+            break
+        try:
+            error = cargar_indice_leads()
+        except SupabaseNoDisponible as exc:
+            error = exc
+        if error is not None:
+            app.logger.error("No se pudo cargar el índice de búsqueda: %s", getattr(error, "text", error))
+            time.sleep(30 * random.uniform(0.8, 1.2))
+    app.logger.info("Índice de búsqueda cargado: %d leads", len(indice_leads))
+    reconciliado = time.time()
+    while BUSQUEDA_SINCRONIZAR > 0:
+        time.sleep(BUSQUEDA_SINCRONIZAR * random.uniform(0.8, 1.2))
+        error = None
+        try:
+            if replica is not None and replica.lista:
+                marca_replica = sincronizar_indice_desde_replica(marca_replica)
+            else:
+                marca, error = sincronizar_indice_leads(marca)
+            if error is None and time.time() - reconciliado >= BUSQUEDA_RECONCILIAR:
+                error = reconciliar_indice_leads()
+                if error is None:
+                    reconciliado = time.time()
+        except SupabaseNoDisponible as exc:
+            error = exc
+        if error is not None:
+            app.logger.warning("Sincronización del índice de búsqueda fallida: %s", getattr(error, "text", error))
+
+
+@app.before_request
+def iniciar_indice_leads():
+    # Como el programador del digest: un hilo por worker, arrancado en su primer request
+    if not BUSQUEDA_ACTIVA or _indice_leads_hilo["iniciado"]:
+        return
+    with _indice_leads_hilo["lock"]:
+        if not _indice_leads_hilo["iniciado"]:
+            threading.Thread(target=_bucle_indice_leads, name="indice-leads", daemon=True).start()
+            _indice_leads_hilo["iniciado"] = True
+
+
+def buscar_leads(consulta, limite=BUSQUEDA_LIMITE):
+    """Devuelve (leads, error) desde el índice o, si aún no está cargado, desde la réplica o Supabase."""
+    if indice_leads.cargado:
+        return indice_leads.buscar(consulta, limite), None
+    if replica_disponible():
+        return replica.buscar(consulta, limite), None
+    return buscar_en_supabase(consulta, limite)
+
+
+@app.route("/buscar")
+def buscar():
+    if "usuario" not in session:
+        return redirect("/")
+    consulta = request.args.get("q", "").strip()
+    leads, error = buscar_leads(consulta) if consulta else ([], None)
+    if error is not None:
+        return f"<h3 style='color:red;'>❌ Error al buscar leads</h3><pre>{escape(error.text)}</pre><a href='/home'>Volver</a>"
+    return render_template("buscar.html", consulta=consulta, leads=leads)
+
+
+@app.route("/buscar/sugerencias")
+def buscar_sugerencias():
+    # Typeahead: JSON corto para el buscador
+    if "usuario" not in session:
+        return {"error": "No autorizado"}, 401
+    limite = min(max(request.args.get("limite", 10, type=int) or 10, 1), BUSQUEDA_LIMITE)
+    leads, error = buscar_leads(request.args.get("q", ""), limite)
+    if error is not None:
+        return {"error": error.text}, 502
+    return {"leads": leads}
+
+
+# 🏘️ Leads duplicados: clave normalizada de dirección
+# "C/ Triana, nº 12" y "calle TRIANA 12" en el 35002 dan la misma clave. El índice clave -> ids
+# se carga y actualiza junto con el de búsqueda, así que comprobar un alta es un acceso a un dict.
+TIPOS_VIA = {
+    "c": "calle", "cl": "calle", "cll": "calle", "calle": "calle",
+    "av": "avenida", "avd": "avenida", "avda": "avenida", "avenida": "avenida",
+    "pl": "plaza", "pz": "plaza", "pza": "plaza", "plza": "plaza", "plaza": "plaza",
+    "p": "paseo", "po": "paseo", "ps": "paseo", "paseo": "paseo",
+    "ctra": "carretera", "crta": "carretera", "carretera": "carretera",
+    "cm": "camino", "cno": "camino", "camino": "camino",
+    "urb": "urbanizacion", "urbanizacion": "urbanizacion",
+    "trav": "travesia", "travesia": "travesia",
+    "bo": "barrio", "barrio": "barrio",
+}
+PALABRAS_VACIAS_DIRECCION = {"de", "del", "la", "las", "el", "los", "y", "n", "no", "num", "numero", "nro"}
+DUPLICADOS_COLUMNAS_FUSION = ("tipo_cliente", "nombre_cliente", "codigo_postal", "localidad", "zona",
+                              "persona_contacto", "telefono", "email", "observaciones")
+
+
+def clave_direccion(direccion, codigo_postal):
+    """Clave de deduplicación: código postal + dirección sin acentos, con el tipo de vía y la numeración normalizados."""
+    texto = unicodedata.normalize("NFKD", str(direccion or "")).encode("ascii", "ignore").decode().lower()
+    texto = re.sub(r"\bs\s*/\s*n\b", " sn ", texto)  # "s/n" -> sin número
+    palabras = [p for p in re.split(r"[^a-z0-9]+", texto) if p and p not in PALABRAS_VACIAS_DIRECCION]
+    if palabras and palabras[0] in TIPOS_VIA:
+        palabras[0] = TIPOS_VIA[palabras[0]]
+    elif palabras:
+        palabras.insert(0, "calle")  # sin tipo de vía, la más habitual
+    palabras = [(p.lstrip("0") or "0") if p.isdigit() else p for p in palabras]
+    return f"{re.sub(r'[^0-9]', '', str(codigo_postal or ''))}|{' '.join(palabras)}"
+
+
+class IndiceDirecciones:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = {}     # clave -> set de ids
+        self._claves = {}  # id -> clave
+
+    def actualizar(self, lead):
+        lead_id = int(lead["id"])
+        clave = clave_direccion(lead.get("direccion"), lead.get("codigo_postal"))
+        with self._lock:
+            self._quitar(lead_id)
+            self._ids.setdefault(clave, set()).add(lead_id)
+            self._claves[lead_id] = clave
+
+    def eliminar(self, lead_id):
+        with self._lock:
+            self._quitar(int(lead_id))
+
+    def _quitar(self, lead_id):
+        clave = self._claves.pop(lead_id, None)
+        if clave is not None:
+            self._ids[clave].discard(lead_id)
+            if not self._ids[clave]:
+                del self._ids[clave]
+
+    def buscar(self, clave):
+        return sorted(self._ids.get(clave, ()))
+
+    def grupos(self):
+        """Listas de ids con la misma clave, de la más numerosa a la menos."""
+        with self._lock:
+            grupos = [sorted(ids) for ids in self._ids.values() if len(ids) > 1]
+        return sorted(grupos, key=lambda ids: (-len(ids), ids[0]))
+
+
+indice_direcciones = IndiceDirecciones()
+
+
+def indexar_lead(lead):
+    # Único punto de entrada a los índices en memoria: búsqueda y direcciones
+    indice_direcciones.actualizar(indice_leads.actualizar(lead))
+
+
+def desindexar_lead(lead_id):
+    indice_leads.eliminar(lead_id)
+    indice_direcciones.eliminar(lead_id)
+
+
+def leads_con_misma_direccion(direccion, codigo_postal, localidad=None):
+    """Devuelve (leads, error): los leads ya registrados con la misma clave de dirección."""
+    clave = clave_direccion(direccion, codigo_postal)
+    if indice_leads.cargado:
+        candidatos = indice_direcciones.buscar(clave)
+        if not candidatos:
+            return [], None
+        # El índice puede ir por detrás de otros workers: se confirman los candidatos en Supabase
+        ids = ",".join(str(lead_id) for lead_id in candidatos)
+        response = supabase.get("clientes", params=[("select", BUSQUEDA_COLUMNAS), ("id", f"in.({ids})"),
+                                                    ("order", "id.asc")])
+        if response.status_code != 200:
+            return None, response
+        leads = response.json()
+        for lead_id in set(candidatos) - {lead["id"] for lead in leads}:
+            desindexar_lead(lead_id)
+        for lead in leads:
+            indexar_lead(lead)
+        return [lead for lead in leads
+                if clave_direccion(lead.get("direccion"), lead.get("codigo_postal")) == clave], None
+    # Índice aún cargando: solo los del mismo código postal (o localidad si no hay), no toda la tabla
+    params = [("select", BUSQUEDA_COLUMNAS), ("limit", 1000)]
+    if codigo_postal:
+        params.append(("codigo_postal", f"eq.{codigo_postal}"))
+    else:
+        params += [("localidad", f"eq.{localidad}"), ("or", '(codigo_postal.is.null,codigo_postal.eq."")')]
+    response = supabase.get("clientes", params=params)
+    if response.status_code != 200:
+        return None, response
+    return [lead for lead in response.json()
+            if clave_direccion(lead.get("direccion"), lead.get("codigo_postal")) == clave], None
+
+
+def fusionar_leads(conservar, otros):
+    """Pasa los equipos de otros a conservar, completa sus campos vacíos y borra otros; devuelve el error o None."""
+    ids = ",".join(str(lead_id) for lead_id in [conservar] + otros)
+    response = supabase.get("clientes", params=[("select", "*"), ("id", f"in.({ids})")])
+    if response.status_code != 200:
+        return response
+    leads = {lead["id"]: lead for lead in response.json()}
+    # Los que ya no existen (borrados o fusionados desde otro worker) salen de los índices
+    desaparecidos = [lead_id for lead_id in [conservar] + otros if lead_id not in leads]
+    for lead_id in desaparecidos:
+        desindexar_lead(lead_id)
+    if replica is not None:
+        replica.eliminar("clientes", desaparecidos)
+    if conservar not in leads:
+        return None
+    otros = [lead_id for lead_id in otros if lead_id in leads]
+    if not otros:
+        return None
+    otros_ids = ",".join(str(lead_id) for lead_id in otros)
+
+    res = supabase.patch(f"equipos?cliente_id=in.({otros_ids})", json={"cliente_id": conservar},
+                         headers={"Prefer": "return=minimal"})
+    if res.status_code not in (200, 204):
+        return res
+    cache.invalidar("equipos")
+
+    completar = {}
+    for columna in DUPLICADOS_COLUMNAS_FUSION:
+        if not leads[conservar].get(columna):
+            valor = next((leads[lead_id].get(columna) for lead_id in otros if leads[lead_id].get(columna)), None)
+            if valor:
+                completar[columna] = valor
+    if completar:
+        res = supabase.patch(f"clientes?id=eq.{conservar}", json=completar, headers={"Prefer": "return=minimal"})
+        if res.status_code not in (200, 204):
+            return res
+        cache.invalidar("clientes", conservar)
+        indexar_lead(dict(leads[conservar], **completar))
+
+    res = supabase.delete(f"clientes?id=in.({otros_ids})", headers={"Prefer": "return=minimal"})
+    if res.status_code not in (200, 204):
+        return res
+    for lead_id in otros:
+        cache.invalidar("clientes", lead_id)
+        desindexar_lead(lead_id)
+    if replica is not None:
+        replica.eliminar("clientes", otros)
+    return None
+
+
+@app.route("/duplicados")
+def duplicados():
+    if "usuario" not in session:
+        return redirect("/")
+    if not indice_leads.cargado:
+        return "<h3>⏳ El índice de leads se está cargando, vuelve a intentarlo en unos segundos.</h3><a href='/home'>Volver</a>"
+    grupos = [[indice_leads.obtener(lead_id) for lead_id in ids] for ids in indice_direcciones.grupos()]
+    return render_template("duplicados.html", grupos=grupos)
+
+
+@app.route("/duplicados/fusionar", methods=["POST"])
+def fusionar_duplicados():
+    if "usuario" not in session:
+        return redirect("/")
+    conservar = request.form.get("conservar", type=int)
+    ids = [lead_id for lead_id in request.form.getlist("ids", type=int) if lead_id != conservar]
+    if conservar is None or not ids:
+        return "Datos de fusión inválidos", 400
+    error = fusionar_leads(conservar, ids)
+    if error is not None:
+        return f"<h3 style='color:red;'>❌ Error al fusionar leads</h3><pre>{escape(error.text)}</pre><a href='/duplicados'>Volver</a>"
+    return redirect("/duplicados")
+
+
+@app.cli.command("duplicados")
+def duplicados_command():
+    """Lista los grupos de leads con la misma dirección normalizada."""
+    error = cargar_indice_leads()
+    if error is not None:
+        print(f"No se pudo cargar clientes: {error.text}")
+        return
+    grupos = indice_direcciones.grupos()
+    for ids in grupos:
+        print(" | ".join(f"{lead_id}: {indice_leads.obtener(lead_id)['direccion']}" for lead_id in ids))
+    print(f"{len(grupos)} grupos de duplicados, {sum(len(ids) - 1 for ids in grupos)} leads sobrantes")
+
+
+# 📤 Importación masiva de leads y equipos (CSV / XLSX)
+# Cada fila es un lead y, opcionalmente, uno de sus equipos; las filas con la misma dirección
+# normalizada son el mismo lead. Primera pasada: leads en lotes (return=representation para
+# conocer sus ids); segunda: equipos en lotes con su cliente_id. Si un lote falla se repite fila
+# a fila para saber cuál es la mala. El estado se guarda en disco tras cada lote: una importación
+# interrumpida se reanuda donde se quedó, y subir el mismo fichero otra vez la retoma. Un lote de
+# equipos insertado justo antes de caerse el proceso, sin llegar a guardar el estado, se repetiría.
+IMPORTAR_DIR = os.environ.get("IMPORTAR_DIR", os.path.join(tempfile.gettempdir(), "ascensoralert", "importaciones"))
+IMPORTAR_LOTE = int(os.environ.get("IMPORTAR_LOTE", "500"))
+IMPORTAR_MAX_ERRORES_MOSTRADOS = 200
+# Cabecera del fichero (sin acentos ni mayúsculas) -> columna; valen los nombres de los formularios
+IMPORTAR_COLUMNAS_LEAD = {
+    "tipo_lead": "tipo_cliente", "tipo_cliente": "tipo_cliente", "direccion": "direccion",
+    "nombre_lead": "nombre_cliente", "nombre_cliente": "nombre_cliente", "nombre_de_la_instalacion": "nombre_cliente",
+    "codigo_postal": "codigo_postal", "localidad": "localidad", "zona": "zona",
+    "persona_contacto": "persona_contacto", "persona_de_contacto": "persona_contacto",
+    "telefono": "telefono", "email": "email", "observaciones": "observaciones",
+}
+IMPORTAR_COLUMNAS_EQUIPO = {
+    "tipo_equipo": "tipo_equipo", "empresa_mantenedora": "empresa_mantenedora", "ubicacion": "ubicacion",
+    "descripcion": "descripcion", "fecha_vencimiento_contrato": "fecha_vencimiento_contrato",
+    "vencimiento_contrato": "fecha_vencimiento_contrato", "rae": "rae",
+    "ipo_proxima": "ipo_proxima", "fecha_ipo": "ipo_proxima",
+}
+IMPORTAR_FECHAS = ("fecha_vencimiento_contrato", "ipo_proxima")
+
+os.makedirs(IMPORTAR_DIR, exist_ok=True)
+
+
+def _ruta_importacion(trabajo_id, extension):
+    return os.path.join(IMPORTAR_DIR, f"{trabajo_id}.{extension}")
+
+
+def leer_filas_importacion(ruta, formato):
+    """Devuelve las filas del fichero como dicts cabecera normalizada -> texto."""
+    if formato == "xlsx":
+        libro = openpyxl.load_workbook(ruta, read_only=True, data_only=True)
+        filas = libro.worksheets[0].iter_rows(values_only=True)
+    else:
+        with open(ruta, encoding="utf-8-sig", newline="") as f:
+            texto = f.read()
+        try:
+            dialecto = csv.Sniffer().sniff(texto[:4096], delimiters=";,\t")
+        except csv.Error:
+            dialecto = csv.excel
+        filas = csv.reader(io.StringIO(texto), dialecto)
+    cabecera = [normalizar_busqueda(c).replace(" ", "_") for c in next(filas, None) or []]
+    resultado = []
+    for valores in filas:
+        fila = {}
+        for columna, valor in zip(cabecera, valores):
+            if isinstance(valor, (datetime.date, datetime.datetime)):
+                valor = valor.strftime("%Y-%m-%d")
+            fila[columna] = "" if valor is None else str(valor).strip()
+        resultado.append(fila)
+    return resultado
+
+
+def _fecha_importacion(valor):
+    # AAAA-MM-DD (también la parte de fecha de un datetime) o DD/MM/AAAA
+    for formato in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y"):
+        try:
+            return datetime.datetime.strptime(valor[:10], formato).date().isoformat()
+        except ValueError:
+            continue
+    raise ValueError(f"fecha no válida: {valor}")
+
+
+def preparar_importacion(filas):
+    """Devuelve (grupos, errores): un grupo por lead con sus filas y equipos; errores por número de fila (1 = cabecera)."""
+    grupos, por_clave, errores = [], {}, {}
+    for n, fila in enumerate(filas, 2):
+        if not any(fila.values()):
+            continue
+        lead = {columna: None for columna in set(IMPORTAR_COLUMNAS_LEAD.values())}
+        equipo = {columna: None for columna in set(IMPORTAR_COLUMNAS_EQUIPO.values())}
+        for cabecera, valor in fila.items():
+            if valor and cabecera in IMPORTAR_COLUMNAS_LEAD:
+                lead[IMPORTAR_COLUMNAS_LEAD[cabecera]] = valor
+            elif valor and cabecera in IMPORTAR_COLUMNAS_EQUIPO:
+                equipo[IMPORTAR_COLUMNAS_EQUIPO[cabecera]] = valor
+
+        faltan = [campo for campo in CAMPOS_OBLIGATORIOS_LEAD if not lead[campo]]
+        if faltan:
+            errores[n] = f"Datos del lead inválidos: falta {', '.join(faltan)}"
+            continue
+        if any(equipo.values()):
+            faltan = [campo for campo in CAMPOS_OBLIGATORIOS_EQUIPO if campo != "cliente_id" and not equipo[campo]]
+            if faltan:
+                errores[n] = f"Datos del equipo inválidos: falta {', '.join(faltan)}"
+                continue
+            try:
+                for campo in IMPORTAR_FECHAS:
+                    if equipo[campo]:
+                        equipo[campo] = _fecha_importacion(equipo[campo])
+            except ValueError as exc:
+                errores[n] = f"Datos del equipo inválidos: {exc}"
+                continue
+        else:
+            equipo = None
+
+        clave = clave_direccion(lead["direccion"], lead["codigo_postal"])
+        if clave not in por_clave:
+            por_clave[clave] = len(grupos)
+            grupos.append({"clave": clave, "lead": lead, "filas": [], "equipos": []})
+        grupo = grupos[por_clave[clave]]
+        grupo["filas"].append(n)
+        if equipo is not None:
+            grupo["equipos"].append((n, equipo))
+    return grupos, errores
+
+
+def _insertar_por_lotes(tabla, registros, select=None):
+    """Inserta [(clave, registro)] en lotes; por cada lote da [(clave, fila devuelta o None, error o None)].
+
+    Un lote rechazado se repite registro a registro para atribuir el error a su fila.
+    """
+    ruta = f"{tabla}?select={select}" if select else tabla
+    headers = {"Prefer": "return=representation" if select else "return=minimal"}
+    for inicio in range(0, len(registros), IMPORTAR_LOTE):
+        lote = registros[inicio:inicio + IMPORTAR_LOTE]
+        response = supabase.post(ruta, json=[registro for _, registro in lote], headers=headers)
+        if response.status_code in (200, 201):
+            devueltas = response.json() if select else [None] * len(lote)
+            yield [(clave, fila, None) for (clave, _), fila in zip(lote, devueltas)]
+            continue
+        resultados = []
+        for clave, registro in lote:
+            response = supabase.post(ruta, json=[registro], headers=headers)
+            if response.status_code in (200, 201):
+                resultados.append((clave, response.json()[0] if select else None, None))
+            else:
+                resultados.append((clave, None, response.text))
+        yield resultados
+
+
+def ejecutar_importacion(trabajo_id):
+    """Ejecuta (o reanuda) una importación; sale sin hacer nada si otro proceso la está ejecutando."""
+    ruta_estado = _ruta_importacion(trabajo_id, "json")
+    with open(_ruta_importacion(trabajo_id, "lock"), "a") as bloqueo:
+        try:
+            fcntl.flock(bloqueo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return
+        estado = _leer_json(ruta_estado)
+        if estado is None or estado["fase"] == "terminada":
+            return
+
+        def guardar(**cambios):
+            estado.update(cambios, actualizado=datetime.datetime.now().isoformat(timespec="seconds"))
+            _escribir_json(ruta_estado, estado)
+
+        try:
+            filas = leer_filas_importacion(_ruta_importacion(trabajo_id, estado["formato"]), estado["formato"])
+            grupos, errores = preparar_importacion(filas)
+            estado["errores"].update({str(n): error for n, error in errores.items()})
+            guardar(filas=len(filas), leads_total=len(grupos),
+                    equipos_total=sum(len(grupo["equipos"]) for grupo in grupos))
+
+            # 1ª pasada: leads. Los que ya existen se reutilizan; al reanudar, el índice se pone al día
+            # antes para reconocer los que se insertaron justo antes de la interrupción
+            error = None
+            if not indice_leads.cargado:
+                error = cargar_indice_leads()
+            elif estado["fase"] != "pendiente":
+                creado = datetime.datetime.fromisoformat(estado["creado"]).astimezone(datetime.timezone.utc)
+                _, error = sincronizar_indice_leads(((creado - datetime.timedelta(minutes=5)).isoformat(), 0))
+                if error is not None:
+                    error = cargar_indice_leads()
+            if error is not None:
+                raise RuntimeError(error.text)
+            pendientes = []
+            for g, grupo in enumerate(grupos):
+                if str(g) in estado["leads"]:
+                    continue
+                existentes = indice_direcciones.buscar(grupo["clave"])
+                if existentes:
+                    estado["leads"][str(g)] = existentes[0]
+                    estado["reutilizados"] += 1
+                else:
+                    pendientes.append((g, grupo["lead"]))
+            guardar(fase="leads")
+            for lote in _insertar_por_lotes("clientes", pendientes, BUSQUEDA_COLUMNAS):
+                for g, lead, error in lote:
+                    if error is None:
+                        estado["leads"][str(g)] = lead["id"]
+                        indexar_lead(lead)
+                    else:
+                        estado["errores"].update({str(n): f"Error al registrar lead: {error}"
+                                                  for n in grupos[g]["filas"]})
+                cache.invalidar("clientes")
+                guardar()
+
+            # 2ª pasada: equipos de los leads que ya tienen id
+            hechos = set(estado["equipos_hechos"])
+            pendientes = [
+                (n, dict(equipo, cliente_id=estado["leads"][str(g)]))
+                for g, grupo in enumerate(grupos) if str(g) in estado["leads"]
+                for n, equipo in grupo["equipos"] if n not in hechos
+            ]
+            guardar(fase="equipos")
+            for lote in _insertar_por_lotes("equipos", pendientes):
+                for n, _, error in lote:
+                    if error is None:
+                        estado["equipos_hechos"].append(n)
+                    else:
+                        estado["errores"][str(n)] = f"Error al registrar equipo: {error}"
+                cache.invalidar("equipos")
+                guardar()
+            guardar(fase="terminada", mensaje=None)
+        except (OSError, ValueError, KeyError, RuntimeError, SupabaseNoDisponible, csv.Error,
+                zipfile.BadZipFile, InvalidFileException) as exc:
+            # Se conserva lo hecho; al reanudar se sigue desde aquí
+            app.logger.error("Importación %s interrumpida: %s", trabajo_id, exc)
+            guardar(mensaje=f"Interrumpida: {exc}")
+
+
+def importacion_en_curso(trabajo_id):
+    with open(_ruta_importacion(trabajo_id, "lock"), "a") as bloqueo:
+        try:
+            fcntl.flock(bloqueo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        fcntl.flock(bloqueo, fcntl.LOCK_UN)
+        return False
+
+
+def lanzar_importacion(trabajo_id):
+    threading.Thread(target=ejecutar_importacion, args=(trabajo_id,), name=f"importacion-{trabajo_id}",
+                     daemon=True).start()
+
+
+@app.route("/importar", methods=["GET", "POST"])
+def importar():
+    if "usuario" not in session:
+        return redirect("/")
+    if request.method == "POST":
+        fichero = request.files.get("fichero")
+        if fichero is None or not fichero.filename:
+            return "Selecciona un fichero CSV o XLSX", 400
+        formato = fichero.filename.rsplit(".", 1)[-1].lower()
+        if formato not in ("csv", "xlsx"):
+            return "Formato de importación no soportado", 400
+        if formato == "xlsx" and openpyxl is None:
+            return "Importación XLSX no disponible: falta el paquete openpyxl", 501
+        contenido = fichero.read()
+        # El mismo fichero da el mismo trabajo: volver a subirlo retoma la importación
+        trabajo_id = hashlib.sha1(contenido).hexdigest()[:16]
+        if _leer_json(_ruta_importacion(trabajo_id, "json")) is None:
+            with open(_ruta_importacion(trabajo_id, formato), "wb") as f:
+                f.write(contenido)
+            _escribir_json(_ruta_importacion(trabajo_id, "json"), {
+                "id": trabajo_id, "nombre": fichero.filename, "formato": formato, "fase": "pendiente",
+                "creado": datetime.datetime.now().isoformat(timespec="seconds"), "actualizado": None,
+                "filas": None, "leads_total": None, "equipos_total": None, "leads": {}, "reutilizados": 0,
+                "equipos_hechos": [], "errores": {}, "mensaje": None,
+            })
+        lanzar_importacion(trabajo_id)
+        return redirect(f"/importar/{trabajo_id}")
+
+    trabajos = [_leer_json(ruta) for ruta in glob.glob(os.path.join(IMPORTAR_DIR, "*.json"))]
+    trabajos = sorted(filter(None, trabajos), key=lambda t: t["creado"], reverse=True)
+    return render_template("importar.html", trabajos=trabajos)
+
+
+def _trabajo_importacion(trabajo_id):
+    if not re.fullmatch(r"[0-9a-f]{16}", trabajo_id):
+        return None
+    return _leer_json(_ruta_importacion(trabajo_id, "json"))
+
+
+@app.route("/importar/<trabajo_id>")
+def importacion(trabajo_id):
+    if "usuario" not in session:
+        return redirect("/")
+    trabajo = _trabajo_importacion(trabajo_id)
+    if trabajo is None:
+        return "Importación no encontrada", 404
+    errores = sorted(trabajo["errores"].items(), key=lambda e: int(e[0]))
+    return render_template(
+        "importacion.html", trabajo=trabajo, en_curso=importacion_en_curso(trabajo_id),
+        errores=errores[:IMPORTAR_MAX_ERRORES_MOSTRADOS], total_errores=len(errores)
+    )
+
+
+@app.route("/importar/<trabajo_id>/reanudar", methods=["POST"])
+def reanudar_importacion(trabajo_id):
+    if "usuario" not in session:
+        return redirect("/")
+    if _trabajo_importacion(trabajo_id) is None:
+        return "Importación no encontrada", 404
+    lanzar_importacion(trabajo_id)
+    return redirect(f"/importar/{trabajo_id}")
+
+
+@app.route("/importar/<trabajo_id>/errores.csv")
+def errores_importacion(trabajo_id):
+    if "usuario" not in session:
+        return redirect("/")
+    trabajo = _trabajo_importacion(trabajo_id)
+    if trabajo is None:
+        return "Importación no encontrada", 404
+    buffer = io.StringIO()
+    buffer.write("\ufeff")
+    writer = csv.writer(buffer, delimiter=";")
+    writer.writerow(["Fila", "Error"])
+    for n, error in sorted(trabajo["errores"].items(), key=lambda e: int(e[0])):
+        writer.writerow([n, error])
+    return Response(buffer.getvalue(), mimetype="text/csv",
+                    headers={"Content-Disposition": f"attachment; filename=errores_{trabajo_id}.csv"})
+
+
+# ⏰ Digest periódico de vencimientos
+# Un hilo por worker se despierta cada DIGEST_INTERVALO; el primero que coge el bloqueo de
+# fichero y ve que toca, calcula qué equipos han cruzado 90/60/30 días desde la última pasada
+# (marca de agua: última fecha procesada + último id de equipo visto + último updated_at visto) y
+# guarda el digest en disco. Los equipos editados desde la pasada anterior se revisan aparte: al
+# adelantar una fecha pueden cruzar umbrales sin que el calendario avance. Para no repetir avisos
+# por ediciones que no cambian el umbral, el estado recuerda el último umbral avisado por equipo.
+DIGEST_ACTIVO = os.environ.get("DIGEST_ACTIVO") == "1"
+DIGEST_INTERVALO = int(os.environ.get("DIGEST_INTERVALO", "3600"))
+DIGEST_DIR = os.environ.get("DIGEST_DIR", os.path.join(tempfile.gettempdir(), "ascensoralert"))
+DIGEST_UMBRALES = (90, 60, 30)
+DIGEST_POR_PAGINA = 1000
+DIGEST_SELECT = "id,tipo_equipo,empresa_mantenedora,{columna},clientes(id,direccion,localidad)"
+DIGEST_SELECT_EDITADOS = DIGEST_SELECT.format(columna=",".join(TIPOS_VENCIMIENTO))
+DIGEST_SOLAPE = datetime.timedelta(seconds=5)  # ediciones que confirmaron tarde; los avisos no se repiten
+
+os.makedirs(DIGEST_DIR, exist_ok=True)
+_digest_estado_path = os.path.join(DIGEST_DIR, "digest_estado.json")
+_digest_path = os.path.join(DIGEST_DIR, "digest.json")
+_digest_lock_path = os.path.join(DIGEST_DIR, "digest.lock")
+
+
+def _leer_json(path, defecto=None):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return defecto
+
+
+def _escribir_json(path, datos):
+    # Escritura atómica: los lectores nunca ven un fichero a medias
+    temporal = f"{path}.{os.getpid()}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(datos, f, ensure_ascii=False)
+    os.replace(temporal, path)
+
+
+def _equipos_paginados(params):
+    """Devuelve (equipos, error) recorriendo por id todas las páginas de la consulta."""
+    equipos, despues_id = [], None
+    while True:
+        pagina = params + [("order", "id.asc"), ("limit", DIGEST_POR_PAGINA)]
+        if despues_id is not None:
+            pagina.append(("id", f"gt.{despues_id}"))
+        response = supabase.get("equipos", params=pagina)
+        if response.status_code != 200:
+            return None, response
+        filas = response.json()
+        equipos.extend(filas)
+        if len(filas) < DIGEST_POR_PAGINA:
+            return equipos, None
+        despues_id = filas[-1]["id"]
+
+
+def calcular_digest(hoy, estado):
+    """Devuelve (avisos, marcas, error): los umbrales cruzados desde `estado` y las marcas para la siguiente pasada."""
+    # Primera ejecución: solo los cruces de hoy y ningún equipo se considera nuevo ni editado
+    ultima_fecha = datetime.date.fromisoformat(estado["ultima_fecha"]) if estado else hoy - datetime.timedelta(days=1)
+    response = supabase.get("equipos?select=id&order=id.desc&limit=1")
+    if response.status_code != 200:
+        return None, None, response
+    ultimo_id = response.json()[0]["id"] if response.json() else 0
+    visto_id = estado["ultimo_equipo_id"] if estado else ultimo_id
+    response = supabase.get("equipos?select=updated_at&updated_at=not.is.null&order=updated_at.desc&limit=1")
+    if response.status_code != 200:
+        return None, None, response
+    ultimo_cambio = response.json()[0]["updated_at"] if response.json() else None
+    visto_cambio = (estado or {}).get("ultimo_cambio")
+    # "id:columna" -> [fecha, umbral] de lo ya avisado que aún no ha vencido
+    if estado and "avisados" in estado:
+        avisados = {clave: aviso for clave, aviso in estado["avisados"].items() if aviso[0] >= hoy.isoformat()}
+    else:
+        # Sin historial: lo que ya está dentro de un umbral se da por avisado, o cualquier
+        # edición posterior de esos equipos (aunque no toque la fecha) saldría como aviso nuevo
+        avisados, error = _avisados_iniciales(hoy)
+        if error is not None:
+            return None, None, error
+
+    avisos = {}
+    for columna in TIPOS_VENCIMIENTO:
+        select = DIGEST_SELECT.format(columna=columna)
+        # Un equipo cruza el umbral U el día fecha-U: basta con el rango (ultima_fecha+U, hoy+U]
+        for umbral in DIGEST_UMBRALES:
+            desde = ultima_fecha + datetime.timedelta(days=umbral)
+            hasta = hoy + datetime.timedelta(days=umbral)
+            equipos, error = _equipos_paginados([
+                ("select", select), (columna, f"gt.{desde.isoformat()}"), (columna, f"lte.{hasta.isoformat()}"),
+            ])
+            if error is not None:
+                return None, None, error
+            for equipo in equipos:
+                _anadir_aviso(avisos, equipo, columna, hoy)
+        # Equipos dados de alta desde la última pasada que ya están dentro de algún umbral
+        equipos, error = _equipos_paginados([
+            ("select", select), ("id", f"gt.{visto_id}"), ("id", f"lte.{ultimo_id}"),
+            (columna, f"gte.{hoy.isoformat()}"),
+            (columna, f"lte.{(hoy + datetime.timedelta(days=max(DIGEST_UMBRALES))).isoformat()}"),
+        ])
+        if error is not None:
+            return None, None, error
+        for equipo in equipos:
+            _anadir_aviso(avisos, equipo, columna, hoy)
+
+    if visto_cambio:
+        desde = datetime.datetime.fromisoformat(visto_cambio) - DIGEST_SOLAPE
+        equipos, error = _equipos_paginados([
+            ("select", DIGEST_SELECT_EDITADOS), ("updated_at", f"gt.{desde.isoformat()}"),
+        ])
+        if error is not None:
+            return None, None, error
+        for equipo in equipos:
+            for columna in TIPOS_VENCIMIENTO:
+                _revisar_editado(avisos, avisados, equipo, columna, hoy)
+
+    for (equipo_id, columna), aviso in avisos.items():
+        avisados[f"{equipo_id}:{columna}"] = [aviso["fecha"], aviso["umbral"]]
+    marcas = {"ultimo_equipo_id": ultimo_id, "ultimo_cambio": ultimo_cambio or visto_cambio, "avisados": avisados}
+    return sorted(avisos.values(), key=lambda a: (a["fecha"], a["equipo_id"])), marcas, None
+
+
+def _avisados_iniciales(hoy):
+    """Devuelve (avisados, error) con todos los equipos que hoy ya están dentro de algún umbral."""
+    avisados = {}
+    hasta = hoy + datetime.timedelta(days=max(DIGEST_UMBRALES))
+    for columna in TIPOS_VENCIMIENTO:
+        equipos, error = _equipos_paginados([
+            ("select", f"id,{columna}"), (columna, f"gte.{hoy.isoformat()}"), (columna, f"lte.{hasta.isoformat()}"),
+        ])
+        if error is not None:
+            return None, error
+        for equipo in equipos:
+            dias = (datetime.date.fromisoformat(equipo[columna]) - hoy).days
+            avisados[f"{equipo['id']}:{columna}"] = [equipo[columna], _umbral(dias)]
+    return avisados, None
+
+
+def _umbral(dias):
+    return min(u for u in DIGEST_UMBRALES if dias <= u)
+
+
+def _revisar_editado(avisos, avisados, equipo, columna, hoy):
+    # Se avisa si el equipo está ahora en un umbral más cercano que el último avisado (o en ninguno)
+    clave = f"{equipo['id']}:{columna}"
+    fecha = equipo.get(columna)
+    dias = (datetime.date.fromisoformat(fecha) - hoy).days if fecha else -1
+    if not 0 <= dias <= max(DIGEST_UMBRALES):
+        avisados.pop(clave, None)
+        return
+    if (equipo["id"], columna) in avisos:
+        return
+    umbral = _umbral(dias)
+    if clave not in avisados or umbral < avisados[clave][1]:
+        _anadir_aviso(avisos, equipo, columna, hoy)
+    else:
+        avisados[clave] = [fecha, umbral]
+
+
+def _anadir_aviso(avisos, equipo, columna, hoy):
+    aviso = _alerta(equipo, columna, hoy)
+    aviso["umbral"] = _umbral(aviso["dias"])
+    avisos[(aviso["equipo_id"], columna)] = aviso
+
+
+def ejecutar_digest(forzar=False):
+    """Genera el digest si toca. Devuelve el digest, o None si no tocaba o lo está generando otro proceso."""
+    with open(_digest_lock_path, "a") as bloqueo:
+        try:
+            fcntl.flock(bloqueo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        try:
+            estado = _leer_json(_digest_estado_path)
+            if not forzar and estado and time.time() - estado.get("ultima_ejecucion", 0) < DIGEST_INTERVALO:
+                return None
+            hoy = datetime.date.today()
+            avisos, marcas, error = calcular_digest(hoy, estado)
+            if error is not None:
+                app.logger.error("Digest de vencimientos fallido: %s", error.text)
+                return None
+
+            # Las pasadas del mismo día se acumulan en el digest de ese día
+            anterior = _leer_json(_digest_path)
+            if anterior and anterior.get("fecha") == hoy.isoformat():
+                previos = {(a["equipo_id"], a["tipo"]): a for a in anterior["avisos"]}
+                previos.update({(a["equipo_id"], a["tipo"]): a for a in avisos})
+                avisos = sorted(previos.values(), key=lambda a: (a["fecha"], a["equipo_id"]))
+            digest = {
+                "fecha": hoy.isoformat(),
+                "generado": datetime.datetime.now().isoformat(timespec="seconds"),
+                "avisos": avisos,
+                "resumen_html": app.jinja_env.get_template("_digest.html").render(
+                    avisos=avisos, umbrales=DIGEST_UMBRALES
+                ),
+            }
+            _escribir_json(_digest_path, digest)
+            _escribir_json(_digest_estado_path, dict(
+                marcas, ultima_fecha=hoy.isoformat(), ultima_ejecucion=time.time()
+            ))
+            return digest
+        except SupabaseNoDisponible as exc:
+            app.logger.error("Digest de vencimientos fallido: %s", exc)
+            return None
+        finally:
+            fcntl.flock(bloqueo, fcntl.LOCK_UN)
+
+
+_digest_cache = {"mtime": None, "html": None}
+
+
+def resumen_digest():
+    # La home solo mira el fichero en disco; se relee cuando cambia su mtime
+    try:
+        mtime = os.stat(_digest_path).st_mtime
+    except OSError:
+        return None
+    if mtime != _digest_cache["mtime"]:
+        digest = _leer_json(_digest_path) or {}
+        _digest_cache["html"] = Markup(digest.get("resumen_html", "")) if digest else None
+        _digest_cache["mtime"] = mtime
+    return _digest_cache["html"]
+
+
+_programador = {"iniciado": False, "lock": threading.Lock()}
+
+
+def _bucle_digest():
+    while True:
+        try:
+            ejecutar_digest()
+        except Exception:
+            app.logger.exception("Error inesperado en el digest de vencimientos")
+        # Un poco de jitter para que los workers no se despierten a la vez
+        time.sleep(min(DIGEST_INTERVALO, 300) * random.uniform(0.8, 1.2))
+
+
+@app.before_request
+def iniciar_programador():
+    # Se arranca en el primer request de cada worker (los hilos no sobreviven al fork de gunicorn)
+    if not DIGEST_ACTIVO or _programador["iniciado"]:
+        return
+    with _programador["lock"]:
+        if not _programador["iniciado"]:
+            threading.Thread(target=_bucle_digest, name="digest-vencimientos", daemon=True).start()
+            _programador["iniciado"] = True
+
+
+@app.cli.command("digest")
+def digest_command():
+    """Genera ahora el digest de vencimientos."""
+    digest = ejecutar_digest(forzar=True)
+    if digest is None:
+        print("No se generó el digest (otro proceso lo está generando o Supabase falló)")
+    else:
+        print(f"Digest del {digest['fecha']}: {len(digest['avisos'])} avisos")
 
-    leads_data = response.json()
-    rows = []
 
-    # Recorrer leads y traer sus equipos
-    for lead in leads_data:
-        lead_id = lead["id"]
-        equipos_response = requests.get(f"{SUPABASE_URL}/rest/v1/equipos?cliente_id=eq.{lead_id}", headers=HEADERS)
-        if equipos_response.status_code == 200:
-            equipos = equipos_response.json()
-            total_equipos = len(equipos)
-            if equipos:
-                for equipo in equipos:
-                    # Formatear fechas a dd/mm/yyyy
-for equipo in equipos:
-    fecha_vencimiento = equipo.get("fecha_vencimiento_contrato", "-")
-    if fecha_vencimiento and fecha_vencimiento != "-":
-        partes = fecha_vencimiento.split("-")
-        if len(partes) == 3:
-            fecha_vencimiento = f"{partes[2]}/{partes[1]}/{partes[0]}"
-    ipo_proxima = equipo.get("ipo_proxima", "-")
-    if ipo_proxima and ipo_proxima != "-":
-        ipo_proxima = "-".join(reversed(ipo_proxima.split("-")))
-    rows.append({
-        "lead_id": lead_id,
-        "direccion": lead.get("direccion", "-"),
-        "localidad": lead.get("localidad", "-"),
-        "codigo_postal": lead.get("codigo_postal", "-"),
-        "total_equipos": total_equipos,
-        "empresa_mantenedora": equipo.get("empresa_mantenedora", "-"),
-        "fecha_vencimiento_contrato": fecha_vencimiento,
-        "ipo_proxima": ipo_proxima
-    })
-        return render_template_string(DASHBOARD_TEMPLATE, rows=rows)
 @app.route("/editar_lead/<int:lead_id>", methods=["GET", "POST"])
+@condicional
 def editar_lead(lead_id):
     if "usuario" not in session:
         return redirect("/")
@@ -618,40 +3388,30 @@ def editar_lead(lead_id):
             "zona": request.form.get("zona"),
             "persona_contacto": request.form.get("persona_contacto"),
                     }
-        res = requests.patch(
-            f"{SUPABASE_URL}/rest/v1/clientes?id=eq.{lead_id}",
-            json=data,
-            headers=HEADERS
-        )
-        if res.status_code in [200, 204]:
-            return redirect("/leads_dashboard")
-        else:
-            return f"<h3 style='color:red;'>❌ Error al actualizar Lead</h3><pre>{res.text}</pre><a href='/leads_dashboard'>Volver</a>"
+        conflicto, error = actualizar_registro("clientes", lead_id, data, request.form.get("updated_at"))
+        if error is not None:
+            return f"<h3 style='color:red;'>❌ Error al actualizar Lead</h3><pre>{escape(error.text)}</pre><a href='/leads_dashboard'>Volver</a>"
+        if conflicto:
+            lead, cambios, error = conflicto_edicion("clientes", lead_id, data)
+            if error is not None:
+                return f"<h3 style='color:red;'>❌ Error al obtener Lead</h3><pre>{escape(error.text)}</pre><a href='/leads_dashboard'>Volver</a>"
+            return render_template("editar_lead.html", lead=lead, cambios_ajenos=cambios), 409
+        indexar_lead(dict(data, id=lead_id))
+        return redirect("/leads_dashboard")
 
     # GET: Consultar el lead
-    response = requests.get(
-        f"{SUPABASE_URL}/rest/v1/clientes?id=eq.{lead_id}",
-        headers=HEADERS
-    )
-    if response.status_code == 200 and response.json():
-        lead = response.json()[0]
-    else:
-        return f"<h3 style='color:red;'>❌ Error al obtener Lead</h3><pre>{response.text}</pre><a href='/leads_dashboard'>Volver</a>"
+    lead, error = obtener_registro("clientes", lead_id, instantanea=True)
+    if error is not None:
+        return f"<h3 style='color:red;'>❌ Error al obtener Lead</h3><pre>{escape(error.text)}</pre><a href='/leads_dashboard'>Volver</a>"
 
-    return render_template_string(EDIT_LEAD_TEMPLATE, lead=lead)
+    return render_template("editar_lead.html", lead=lead, cambios_ajenos=None)
 
 @app.route("/editar_equipo/<int:equipo_id>", methods=["GET", "POST"])
+@condicional
 def editar_equipo(equipo_id):
     if "usuario" not in session:
         return redirect("/")
 
-    # Obtener datos del equipo desde Supabase
-    response = requests.get(f"{SUPABASE_URL}/rest/v1/equipos?id=eq.{equipo_id}", headers=HEADERS)
-    if response.status_code != 200 or not response.json():
-        return f"<h3 style='color:red;'>❌ Error al obtener equipo</h3><pre>{response.text}</pre><a href='/home'>Volver</a>"
-
-    equipo = response.json()[0]
-
     if request.method == "POST":
         # Actualizar equipo con los datos enviados
         data = {
@@ -664,132 +3424,139 @@ def editar_equipo(equipo_id):
             "ipo_proxima": request.form.get("ipo_proxima")
         }
 
-        update_url = f"{SUPABASE_URL}/rest/v1/equipos?id=eq.{equipo_id}"
-        res = requests.patch(update_url, json=data, headers=HEADERS)
-        if res.status_code in [200, 204]:
-            return redirect("/leads_dashboard")
-        else:
-            return f"<h3 style='color:red;'>❌ Error al actualizar equipo</h3><pre>{res.text}</pre><a href='/home'>Volver</a>"
-
-    return render_template_string(EQUIPO_EDIT_TEMPLATE, equipo=equipo)
-
-DASHBOARD_TEMPLATE = """
-<!DOCTYPE html>
-<html lang='es'>
-<head>
-    <meta charset='UTF-8'>
-    <title>Leads Dashboard</title>
-    <link rel='stylesheet' href='/static/styles.css'>
-    <style>
-        table { border-collapse: collapse; width: 100%; }
-        th, td { border: 1px solid #ccc; padding: 8px; text-align: left; }
-        th { background-color: #f2f2f2; }
-        tr:hover { background-color: #f5f5f5; }
-        a { text-decoration: none; color: #0065a3; }
-    </style>
-</head>
-<body>
-    <header>
-    <div class="header-container">
-        <div class="logo-container">
-            <a href="/home">
-                <img src="/static/logo-fedes-ascensores.png" alt="Logo Fedes Ascensores" class="logo">
-            </a>
-        </div>
-        <div class="title-container">
-            <h1>AscensorAlert</h1>
-        </div>
-    </div>
-</header>
-    <main>
-        <div class='menu'>
-            <table>
-                <thead>
-                    <tr>
-                        <th>Dirección</th>
-                        <th>Localidad</th>
-                        <th>Código Postal</th>
-                        <th>Total Equipos</th>
-                        <th>Empresa Mantenedora</th>
-                        <th>Vencimiento Contrato</th>
-                        <th>IPO Próxima</th>
-                    </tr>
-                </thead>
-                <tbody>
-                    {% for row in rows %}
-                    <tr>
-                        <td><a href='/editar_lead/{{ row.lead_id }}'>{{ row.direccion }}</a></td>
-                        <td>{{ row.localidad }}</td>
-                        <td>{{ row.codigo_postal }}</td>
-                        <td><a href='/nuevo_equipo?cliente_id={{ row.lead_id }}'>{{ row.total_equipos }}</a></td>
-                        <td>{{ row.empresa_mantenedora }}</td>
-                        <td>{{ row.fecha_vencimiento_contrato }}</td>
-                        <td>{{ row.ipo_proxima }}</td>
-                        <td><a href="/editar_equipo/{{ row.equipo_id }}" class="button-small">✏️ Editar Equipo</a></td>
-                    </tr>
-                    {% endfor %}
-                </tbody>
-            </table>
-            <a href='/home' class='button'>🏠 Volver al inicio</a>
-        </div>
-    </main>
-</body>
-</html>
-"""
-EQUIPO_EDIT_TEMPLATE = """
-<!DOCTYPE html>
-<html lang="es">
-<head>
-    <meta charset="UTF-8">
-    <title>Editar Equipo</title>
-    <link rel="stylesheet" href="/static/styles.css">
-</head>
-<body>
-    <header>
-        <div class="header-container">
-            <div class="logo-container">
-                <a href="/home">
-                    <img src="/static/logo-fedes-ascensores.png" alt="Logo Fedes Ascensores" class="logo">
-                </a>
-            </div>
-            <div class="title-container">
-                <h1>Editar Equipo</h1>
-            </div>
-        </div>
-    </header>
-    <main>
-        <div class="menu">
-            <form method="POST">
-                <label>Tipo de Equipo:</label><br>
-                <input type="text" name="tipo_equipo" value="{{ equipo.tipo_equipo }}" required><br><br>
-
-                <label>Empresa Mantenedora:</label><br>
-                <input type="text" name="empresa_mantenedora" value="{{ equipo.empresa_mantenedora }}"><br><br>
-
-                <label>Ubicación:</label><br>
-                <input type="text" name="ubicacion" value="{{ equipo.ubicacion }}"><br><br>
-
-                <label>Descripción:</label><br>
-                <input type="text" name="descripcion" value="{{ equipo.descripcion }}"><br><br>
-
-                <label>Fecha Vencimiento Contrato:</label><br>
-                <input type="date" name="fecha_vencimiento_contrato" value="{{ equipo.fecha_vencimiento_contrato }}"><br><br>
-
-                <label>RAE:</label><br>
-                <input type="text" name="rae" value="{{ equipo.rae }}"><br><br>
-
-                <label>IPO Próxima:</label><br>
-                <input type="date" name="ipo_proxima" value="{{ equipo.ipo_proxima }}"><br><br>
-
-                <button type="submit" class="button">Actualizar Equipo</button>
-            </form>
-            <br>
-            <a href="/home" class="button">🏠 Volver al inicio</a>
-        </div>
-    </main>
-</body>
-</html>
-"""
+        conflicto, error = actualizar_registro("equipos", equipo_id, data, request.form.get("updated_at"))
+        if error is not None:
+            return f"<h3 style='color:red;'>❌ Error al actualizar equipo</h3><pre>{escape(error.text)}</pre><a href='/home'>Volver</a>"
+        if conflicto:
+            equipo, cambios, error = conflicto_edicion("equipos", equipo_id, data)
+            if error is not None:
+                return f"<h3 style='color:red;'>❌ Error al obtener equipo</h3><pre>{escape(error.text)}</pre><a href='/home'>Volver</a>"
+            return render_template("editar_equipo.html", equipo=equipo, cambios_ajenos=cambios), 409
+        return redirect("/leads_dashboard")
+
+    # Obtener datos del equipo desde Supabase
+    equipo, error = obtener_registro("equipos", equipo_id, instantanea=True)
+    if error is not None:
+        return f"<h3 style='color:red;'>❌ Error al obtener equipo</h3><pre>{escape(error.text)}</pre><a href='/home'>Volver</a>"
+
+    return render_template("editar_equipo.html", equipo=equipo, cambios_ajenos=None)
+
+# 🚀 Modo ASGI: uvicorn "app(16):asgi_app" --workers 2 (o cualquier servidor ASGI; requiere a2wsgi)
+# Las mismas rutas y plantillas, servidas por a2wsgi.WSGIMiddleware: cada petición sigue ocupando un
+# hilo de un pool de ASGI_HILOS mientras espera a Supabase (Flask es síncrono), pero un hilo es barato
+# (la E/S suelta el GIL) y no uno de los pocos workers de gunicorn, así que un proceso aguanta cientos
+# de peticiones en vuelo y /home no hace cola detrás de los dashboards lentos. Los servidores ASGI
+# descartan en silencio lo que se envía tras desconectarse el cliente: asgi_app vigila la desconexión
+# y las respuestas en streaming dejan de recorrerse (y de pedir páginas a Supabase) en el siguiente
+# trozo. El pool de conexiones de `supabase` se amplía a un hueco por hilo en el arranque (lifespan).
+ASGI_HILOS = int(os.environ.get("ASGI_HILOS", "200"))
+ASGI_CUERPO_EN_MEMORIA = 1024 * 1024  # los cuerpos mayores (importaciones) pasan a un fichero temporal
+ASGI_TROZO_CUERPO = 64 * 1024
+ASGI_DESCONECTADO = "ascensoralert.desconectado"  # clave del scope con el threading.Event de la petición
+
+
+def preparar_asgi():
+    # Hilos de petición + refrescos de instantáneas llamando a la vez: sin hueco, urllib3 cierra la
+    # conexión al devolverla y la siguiente petición paga otra vez TCP+TLS
+    tamano = ASGI_HILOS + SWR_HILOS
+    if supabase.pool_size < tamano:
+        supabase.montar_pool(tamano)
+
+
+class _HastaDesconexion:
+    """Iterable WSGI que deja de recorrer la respuesta en cuanto el cliente se ha ido."""
+
+    def __init__(self, resultado, desconectado, ruta):
+        self._resultado = resultado
+        self._desconectado = desconectado
+        self._ruta = ruta
+
+    def __iter__(self):
+        for trozo in self._resultado:
+            if self._desconectado.is_set():
+                app.logger.info("Cliente desconectado a mitad de %s: se deja de generar la respuesta", self._ruta)
+                return
+            yield trozo
+
+    def close(self):
+        # Cierra los generadores de la respuesta: FilasEnStreaming no pide más páginas
+        if hasattr(self._resultado, "close"):
+            self._resultado.close()
+
+
+def _wsgi_con_desconexion(environ, start_response):
+    resultado = app(environ, start_response)
+    desconectado = environ.get("asgi.scope", {}).get(ASGI_DESCONECTADO)
+    if desconectado is None:
+        return resultado
+    return _HastaDesconexion(resultado, desconectado, environ.get("PATH_INFO"))
+
+
+_asgi_wsgi = a2wsgi.WSGIMiddleware(_wsgi_con_desconexion, workers=ASGI_HILOS) if a2wsgi is not None else None
+
+
+async def _lifespan_asgi(receive, send):
+    while True:
+        mensaje = await receive()
+        if mensaje["type"] == "lifespan.startup":
+            if _asgi_wsgi is None:
+                await send({"type": "lifespan.startup.failed", "message": "Modo ASGI no disponible: falta el paquete a2wsgi"})
+                return
+            # En el hilo del bucle, antes de que ningún hilo de petición use la sesión
+            preparar_asgi()
+            await send({"type": "lifespan.startup.complete"})
+        elif mensaje["type"] == "lifespan.shutdown":
+            if supabase_async is not None:
+                await asyncio.get_running_loop().run_in_executor(None, supabase_async.cerrar)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def asgi_app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan_asgi(receive, send)
+    if scope["type"] != "http":
+        return
+    if _asgi_wsgi is None:
+        raise RuntimeError("Modo ASGI no disponible: falta el paquete a2wsgi")
+
+    # El cuerpo se lee entero antes de atender la petición: así `receive` queda libre para vigilar
+    # la desconexión mientras corre la vista, y a2wsgi lo recibe de nuevo por trozos
+    cuerpo = tempfile.SpooledTemporaryFile(ASGI_CUERPO_EN_MEMORIA)
+    mas = True
+    while mas:
+        mensaje = await receive()
+        if mensaje["type"] == "http.disconnect":
+            cuerpo.close()
+            return
+        cuerpo.write(mensaje.get("body", b""))
+        mas = mensaje.get("more_body", False)
+    tamano = cuerpo.tell()
+    cuerpo.seek(0)
+    desconectado = threading.Event()
+    desconexion = asyncio.get_running_loop().create_future()
+
+    async def recibir():
+        if not cuerpo.closed:
+            trozo = cuerpo.read(ASGI_TROZO_CUERPO)
+            mas = cuerpo.tell() < tamano
+            if not mas:
+                cuerpo.close()
+            return {"type": "http.request", "body": trozo, "more_body": mas}
+        return await desconexion
+
+    async def vigilar_desconexion():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        desconectado.set()
+        desconexion.set_result({"type": "http.disconnect"})
+
+    vigilancia = asyncio.ensure_future(vigilar_desconexion())
+    try:
+        await _asgi_wsgi(dict(scope, **{ASGI_DESCONECTADO: desconectado}), recibir, send)
+    finally:
+        vigilancia.cancel()
+        cuerpo.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,573 @@
+"""Servidor PostgREST de pruebas: clientes, equipos y usuarios en memoria.
+
+Implementa el subconjunto de la API que usa la aplicación: select con recursos
+embebidos, filtros eq/neq/gt/gte/lt/lte/in/is/like/ilike (también not., or=() y
+and=()), order, limit/offset, cabeceras Range/Content-Range y Prefer
+(return=, count=), POST individual o en array, PATCH, DELETE y funciones rpc.
+
+    python benchmarks/fake_postgrest.py --puerto 54321 --clientes 10000 --equipos 50000 --latencia-ms 20
+"""
+import argparse
+import datetime
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from werkzeug.security import generate_password_hash
+
+LOCALIDADES = ["Agaete", "Agüimes", "Arucas", "Gáldar", "Ingenio", "Jinámar", "Las Palmas de Gran Canaria",
+               "Maspalomas", "Mogán", "Santa Brígida", "Telde", "Teror", "Vecindario"]
+EMPRESAS = ["FAIN Ascensores", "KONE", "Otis", "Schindler", "TKE", "Orona", "Fedes Ascensores"]
+TIPOS_EQUIPO = ["Ascensor", "Elevador", "Montaplatos", "Montacargas", "Plataforma Salvaescaleras"]
+TIPOS_CLIENTE = ["Comunidad", "Hotel/Apartamentos", "Empresa", "Otro"]
+CALLES = ["Calle Mayor", "Avenida Marítima", "Calle León y Castillo", "Paseo de Chil", "Calle Triana"]
+
+# Relaciones: (tabla, recurso embebido) -> (columna local, tabla destino, columna destino, muchos)
+RELACIONES = {
+    ("clientes", "equipos"): ("id", "equipos", "cliente_id", True),
+    ("equipos", "clientes"): ("cliente_id", "clientes", "id", False),
+}
+
+
+def _ahora():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+class Base:
+    def __init__(self):
+        self.tablas = {"clientes": [], "equipos": [], "usuarios": []}
+        self.secuencias = {nombre: 0 for nombre in self.tablas}
+        self.versiones = {}  # tabla -> [modificado, version], como versiones_datos en sql/version_datos.sql
+        self.rpc = dict(RPC)
+        self.lock = threading.RLock()
+        self.peticiones = 0
+
+    def insertar(self, tabla, fila):
+        with self.lock:
+            self.tablas.setdefault(tabla, [])
+            self.secuencias.setdefault(tabla, 0)
+            fila = dict(fila)
+            if fila.get("id") is None:
+                self.secuencias[tabla] += 1
+                fila["id"] = self.secuencias[tabla]
+            else:
+                self.secuencias[tabla] = max(self.secuencias[tabla], int(fila["id"]))
+            marca = _ahora()
+            fila.setdefault("created_at", marca)
+            fila["updated_at"] = marca
+            self.tablas[tabla].append(fila)
+            self.contar_cambio(tabla)
+            return fila
+
+    def contar_cambio(self, tabla):
+        # El trigger de Postgres cuenta una vez por sentencia; aquí basta con que la versión cambie
+        with self.lock:
+            version = self.versiones.get(tabla, [None, 0])[1]
+            self.versiones[tabla] = [_ahora(), version + 1]
+
+    def sembrar(self, clientes, equipos, semilla=1):
+        rnd = random.Random(semilla)
+        hoy = datetime.date.today()
+        for i in range(clientes):
+            self.insertar("clientes", {
+                "tipo_cliente": rnd.choice(TIPOS_CLIENTE),
+                "direccion": f"{rnd.choice(CALLES)} {i % 300 + 1}",
+                "nombre_cliente": f"Comunidad {i + 1}",
+                "codigo_postal": f"35{rnd.randint(0, 999):03d}",
+                "localidad": rnd.choice(LOCALIDADES),
+                "zona": rnd.choice(["Norte", "Sur", "Centro"]),
+                "persona_contacto": f"Contacto {i + 1}",
+                "telefono": f"928{rnd.randint(0, 999999):06d}",
+                "email": f"lead{i + 1}@example.com",
+                "observaciones": "",
+            })
+        for _ in range(equipos if clientes else 0):
+            self.insertar("equipos", {
+                "cliente_id": rnd.randint(1, clientes),
+                "tipo_equipo": rnd.choice(TIPOS_EQUIPO),
+                "empresa_mantenedora": rnd.choice(EMPRESAS),
+                "ubicacion": "",
+                "descripcion": "",
+                "fecha_vencimiento_contrato": (hoy + datetime.timedelta(days=rnd.randint(-60, 900))).isoformat(),
+                "rae": "",
+                "ipo_proxima": (hoy + datetime.timedelta(days=rnd.randint(-30, 720))).isoformat(),
+            })
+        self.insertar("usuarios", {
+            "nombre_usuario": "admin",
+            "contrasena": generate_password_hash("admin"),
+        })
+
+
+# --- Funciones rpc (equivalentes a las de sql/) ----------------------------------
+
+def rpc_version_datos(base, argumentos):
+    return {tabla: base.versiones.get(tabla, [None, 0]) for tabla in ("clientes", "equipos")}
+
+
+def rpc_crear_lead_con_equipos(base, argumentos):
+    # Todo o nada, como la transacción de la función en Postgres
+    lead, equipos = argumentos.get("lead") or {}, argumentos.get("equipos") or []
+    for campo in ("tipo_cliente", "direccion", "nombre_cliente", "localidad"):
+        if not lead.get(campo):
+            raise ValueError(f'null value in column "{campo}" of relation "clientes"')
+    if any(not equipo.get("tipo_equipo") for equipo in equipos):
+        raise ValueError('null value in column "tipo_equipo" of relation "equipos"')
+    nuevo = base.insertar("clientes", {k: v for k, v in lead.items() if k != "id"})
+    for equipo in equipos:
+        base.insertar("equipos", dict({k: v for k, v in equipo.items() if k != "id"}, cliente_id=nuevo["id"]))
+    return nuevo
+
+
+def rpc_resumen_dashboard(base, argumentos):
+    hoy = datetime.date.today()
+    desde = hoy.replace(day=1).isoformat()
+    meses = int(argumentos.get("meses", 24))
+    fin = hoy.year * 12 + hoy.month - 1 + meses
+    hasta = datetime.date(fin // 12, fin % 12 + 1, 1).isoformat()
+    equipos_por_cliente, empresas, por_mes = {}, {}, {}
+    vencidos = {"fecha_vencimiento_contrato": 0, "ipo_proxima": 0}
+    for equipo in base.tablas["equipos"]:
+        equipos_por_cliente[equipo.get("cliente_id")] = equipos_por_cliente.get(equipo.get("cliente_id"), 0) + 1
+        empresas[equipo.get("empresa_mantenedora")] = empresas.get(equipo.get("empresa_mantenedora"), 0) + 1
+        for columna, campo in (("fecha_vencimiento_contrato", "contratos"), ("ipo_proxima", "ipos")):
+            fecha = equipo.get(columna)
+            if not fecha:
+                continue
+            if fecha < desde:
+                vencidos[columna] += 1
+            elif fecha < hasta:
+                mes = por_mes.setdefault(fecha[:7] + "-01", {"contratos": 0, "ipos": 0})
+                mes[campo] += 1
+    grupos = {"localidad": {}, "zona": {}}
+    for cliente in base.tablas["clientes"]:
+        for campo, grupo in grupos.items():
+            cuenta = grupo.setdefault(cliente.get(campo), [0, 0])
+            cuenta[0] += 1
+            cuenta[1] += equipos_por_cliente.get(cliente["id"], 0)
+    empresas = sorted(empresas.items(), key=lambda kv: (-kv[1], kv[0] or ""))
+    localidades, zonas = (sorted(grupos[campo].items(), key=lambda kv: (-kv[1][0], kv[0] or "")) for campo in grupos)
+    return {
+        "totales": {
+            "leads": len(base.tablas["clientes"]), "equipos": len(base.tablas["equipos"]),
+            "contratos_vencidos": vencidos["fecha_vencimiento_contrato"], "ipos_vencidas": vencidos["ipo_proxima"],
+        },
+        "empresas": [{"empresa_mantenedora": k, "equipos": v} for k, v in empresas],
+        "localidades": [{"localidad": k, "leads": v[0], "equipos": v[1]} for k, v in localidades],
+        "zonas": [{"zona": k, "leads": v[0], "equipos": v[1]} for k, v in zonas],
+        "meses": [dict(v, mes=k) for k, v in sorted(por_mes.items())],
+    }
+
+
+RPC = {
+    "version_datos": rpc_version_datos,
+    "crear_lead_con_equipos": rpc_crear_lead_con_equipos,
+    "resumen_dashboard": rpc_resumen_dashboard,
+}
+
+
+# --- Parseo de la query PostgREST ---------------------------------------------
+
+def _dividir(texto, sep=","):
+    # Divide respetando paréntesis y comillas
+    partes, nivel, actual, comillas = [], 0, "", False
+    for c in texto:
+        if c == '"':
+            comillas = not comillas
+        if not comillas and c == "(":
+            nivel += 1
+        elif not comillas and c == ")":
+            nivel -= 1
+        if c == sep and nivel == 0 and not comillas:
+            partes.append(actual)
+            actual = ""
+        else:
+            actual += c
+    if actual:
+        partes.append(actual)
+    return partes
+
+
+def parsear_select(texto):
+    campos = []
+    for parte in _dividir(texto or "*"):
+        parte = parte.strip()
+        m = re.match(r"^(\w+)(!inner)?\((.*)\)$", parte)
+        if m:
+            campos.append(("embed", m.group(1), bool(m.group(2)), parsear_select(m.group(3))))
+        elif parte == "count()" or parte == "count":
+            campos.append(("count",))
+        else:
+            campos.append(("col", parte.split("::")[0]))
+    return campos
+
+
+def _valor(texto):
+    texto = texto.strip()
+    if len(texto) >= 2 and texto[0] == '"' and texto[-1] == '"':
+        return texto[1:-1]
+    return texto
+
+
+def _comparable(a, b):
+    # Compara números como números y el resto como texto
+    try:
+        return float(a), float(b)
+    except (TypeError, ValueError):
+        return str(a), str(b)
+
+
+def _evaluar(op, negado, arg, valor):
+    if op == "is":
+        r = (valor is None) if arg in ("null", "NULL") else (
+            valor is True if arg == "true" else valor is False if arg == "false" else False)
+    elif op == "in":
+        opciones = [_valor(x) for x in _dividir(arg.strip("()"))]
+        r = valor is not None and str(valor) in opciones
+    elif valor is None:
+        r = False
+    elif op in ("like", "ilike"):
+        patron = "^" + re.escape(_valor(arg)).replace(r"\*", ".*").replace("%", ".*") + "$"
+        r = re.match(patron, str(valor), re.IGNORECASE if op == "ilike" else 0) is not None
+    else:
+        a, b = _comparable(valor, _valor(arg))
+        r = {"eq": a == b, "neq": a != b, "gt": a > b, "gte": a >= b, "lt": a < b, "lte": a <= b}[op]
+    return not r if negado else r
+
+
+def parsear_condicion(columna, expresion):
+    negado = False
+    if expresion.startswith("not."):
+        negado, expresion = True, expresion[4:]
+    op, _, arg = expresion.partition(".")
+    return ("cond", columna, op, negado, arg)
+
+
+def parsear_logica(tipo, texto, negado=False):
+    hijos = []
+    for parte in _dividir(texto.strip()[1:-1]):
+        parte = parte.strip()
+        m = re.match(r"^(not\.)?(or|and)(\(.*\))$", parte)
+        if m:
+            hijos.append(parsear_logica(m.group(2), m.group(3), bool(m.group(1))))
+        else:
+            columna, _, expresion = parte.partition(".")
+            hijos.append(parsear_condicion(columna, expresion))
+    return (tipo, hijos, negado)
+
+
+def cumple(nodo, fila):
+    if nodo[0] == "cond":
+        _, columna, op, negado, arg = nodo
+        return _evaluar(op, negado, arg, _resolver(fila, columna))
+    tipo, hijos, negado = nodo
+    r = any(cumple(h, fila) for h in hijos) if tipo == "or" else all(cumple(h, fila) for h in hijos)
+    return not r if negado else r
+
+
+def _resolver(fila, columna):
+    # Admite rutas "clientes.localidad" sobre recursos embebidos a uno
+    valor = fila
+    for parte in columna.split("."):
+        if not isinstance(valor, dict):
+            return None
+        valor = valor.get(parte)
+    return valor
+
+
+def parsear_order(texto):
+    orden = []
+    for parte in _dividir(texto):
+        trozos = parte.split(".")
+        columna, desc, nulls_first = trozos[0], False, None
+        for t in trozos[1:]:
+            if t == "desc":
+                desc = True
+            elif t == "nullsfirst":
+                nulls_first = True
+            elif t == "nullslast":
+                nulls_first = False
+        if nulls_first is None:
+            nulls_first = desc  # por defecto en Postgres: NULL es el mayor
+        orden.append((columna, desc, nulls_first))
+    return orden
+
+
+def ordenar(filas, orden):
+    for columna, desc, nulls_first in reversed(orden):
+        con = [f for f in filas if f.get(columna) is not None]
+        sin = [f for f in filas if f.get(columna) is None]
+        con.sort(key=lambda f: _comparable(f[columna], f[columna])[0], reverse=desc)
+        filas = sin + con if nulls_first else con + sin
+    return filas
+
+
+class Consulta:
+    def __init__(self, tabla, params):
+        self.tabla = tabla
+        self.select = parsear_select(None)
+        self.filtros = []          # filtros sobre la tabla principal
+        self.filtros_embed = {}    # recurso -> [filtros]
+        self.orden = []
+        self.limit = None
+        self.offset = 0
+        for clave, valor in params:
+            if clave == "select":
+                self.select = parsear_select(valor)
+            elif clave == "order":
+                self.orden = parsear_order(valor)
+            elif clave == "limit":
+                self.limit = int(valor)
+            elif clave == "offset":
+                self.offset = int(valor)
+            elif clave in ("or", "and", "not.or", "not.and"):
+                self.filtros.append(parsear_logica(clave.split(".")[-1], valor, clave.startswith("not.")))
+            elif clave.endswith(".or") or clave.endswith(".and"):
+                recurso, _, tipo = clave.rpartition(".")
+                self.filtros_embed.setdefault(recurso, []).append(parsear_logica(tipo, valor))
+            elif "." in clave:
+                recurso, _, columna = clave.partition(".")
+                self.filtros_embed.setdefault(recurso, []).append(parsear_condicion(columna, valor))
+            else:
+                self.filtros.append(parsear_condicion(clave, valor))
+
+
+def _relacionadas(base, indices, destino, remota, valor):
+    # Índice por clave foránea construido una vez por consulta
+    clave = (destino, remota)
+    if clave not in indices:
+        indice = {}
+        for fila in base.tablas[destino]:
+            indice.setdefault(fila.get(remota), []).append(fila)
+        indices[clave] = indice
+    return indices[clave].get(valor, [])
+
+
+def proyectar(base, tabla, fila, select, filtros_embed, indices):
+    """Devuelve la fila proyectada o None si un embebido !inner la descarta."""
+    salida = {}
+    for campo in select:
+        if campo[0] == "col":
+            if campo[1] == "*":
+                salida.update(fila)
+            else:
+                salida[campo[1]] = fila.get(campo[1])
+        elif campo[0] == "embed":
+            _, recurso, inner, sub = campo
+            local, destino, remota, muchos = RELACIONES[(tabla, recurso)]
+            filtros = filtros_embed.get(recurso, [])
+            relacionadas = _relacionadas(base, indices, destino, remota, fila.get(local))
+            relacionadas = [f for f in relacionadas if all(cumple(c, f) for c in filtros)]
+            if sub == [("count",)]:
+                salida[recurso] = [{"count": len(relacionadas)}]
+                continue
+            proyectadas = [proyectar(base, destino, f, sub, {}, indices) for f in relacionadas]
+            if inner and not proyectadas:
+                return None
+            if muchos:
+                salida[recurso] = sorted(proyectadas, key=lambda f: f.get("id") or 0)
+            else:
+                if filtros and not proyectadas:
+                    if inner:
+                        return None
+                salida[recurso] = proyectadas[0] if proyectadas else None
+    return salida
+
+
+def _ejecutar_select(base, consulta, rango, contar):
+    """Devuelve (filas, inicio, total); total es None si no se pidió contar."""
+    filas = [f for f in base.tablas[consulta.tabla]
+             if all(cumple(c, f) for c in consulta.filtros if not _filtro_embebido(c))]
+    if consulta.orden:
+        filas = ordenar(filas, consulta.orden)
+    inicio = consulta.offset
+    fin = None if consulta.limit is None else inicio + consulta.limit
+    if rango:
+        inicio = max(inicio, rango[0])
+        fin = rango[1] + 1 if fin is None else min(fin, rango[1] + 1)
+    # Sin conteo solo se proyectan las filas hasta el final de la ventana pedida
+    indices, proyectadas = {}, []
+    for fila in filas:
+        p = proyectar(base, consulta.tabla, fila, consulta.select, consulta.filtros_embed, indices)
+        if p is None:
+            continue
+        completa = dict(fila)
+        completa.update({k: v for k, v in p.items() if isinstance(v, (dict, list))})
+        if not all(cumple(c, completa) for c in consulta.filtros if _filtro_embebido(c)):
+            continue
+        proyectadas.append(p)
+        if not contar and fin is not None and len(proyectadas) >= fin:
+            break
+    return proyectadas[inicio:fin], inicio, len(proyectadas) if contar else None
+
+
+def _filtro_embebido(nodo):
+    if nodo[0] == "cond":
+        return "." in nodo[1]
+    return any(_filtro_embebido(h) for h in nodo[1])
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    base = None
+    latencia = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, estado, cuerpo=None, cabeceras=None):
+        datos = b"" if cuerpo is None else json.dumps(cuerpo, default=str).encode()
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        for clave, valor in (cabeceras or {}).items():
+            self.send_header(clave, valor)
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(datos)
+
+    def _preparar(self):
+        if self.latencia:
+            time.sleep(self.latencia)
+        with self.base.lock:
+            self.base.peticiones += 1
+        url = urllib.parse.urlsplit(self.path)
+        params = urllib.parse.parse_qsl(url.query, keep_blank_values=True)
+        prefer = {}
+        for parte in self.headers.get("Prefer", "").split(","):
+            clave, _, valor = parte.strip().partition("=")
+            if clave:
+                prefer[clave] = valor
+        return url.path, params, prefer
+
+    def _leer_json(self):
+        longitud = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(longitud) or b"null")
+
+    def _tabla(self, ruta):
+        m = re.match(r"^/rest/v1/(\w+)$", ruta)
+        if not m:
+            return None
+        if m.group(1) not in self.base.tablas:
+            self._responder(404, {"code": "42P01", "message": f"relation {m.group(1)} does not exist"})
+            return False
+        return m.group(1)
+
+    def do_GET(self):
+        ruta, params, prefer = self._preparar()
+        if ruta == "/__stats":
+            return self._responder(200, {"peticiones": self.base.peticiones})
+        m = re.match(r"^/rest/v1/rpc/(\w+)$", ruta)
+        if m:
+            return self._rpc(m.group(1), dict(params))
+        tabla = self._tabla(ruta)
+        if not tabla:
+            return None if tabla is False else self._responder(404, {"message": "not found"})
+        rango = None
+        if self.headers.get("Range"):
+            a, _, b = self.headers["Range"].partition("-")
+            rango = (int(a), int(b))
+        try:
+            with self.base.lock:
+                consulta = Consulta(tabla, params)
+                filas, inicio, total = _ejecutar_select(self.base, consulta, rango, bool(prefer.get("count")))
+        except KeyError as exc:
+            return self._responder(400, {"code": "PGRST200", "message": f"Could not find relationship {exc}"})
+        fin = inicio + len(filas) - 1
+        total_txt = "*" if total is None else str(total)
+        contenido = f"{inicio}-{fin}/{total_txt}" if filas else f"*/{total_txt}"
+        estado = 206 if rango and total is not None and len(filas) < total else 200
+        self._responder(estado, filas, {"Content-Range": contenido})
+
+    do_HEAD = do_GET
+
+    def _rpc(self, nombre, argumentos):
+        funcion = self.base.rpc.get(nombre)
+        if funcion is None:
+            return self._responder(404, {"code": "PGRST202", "message": "function not found"})
+        try:
+            with self.base.lock:
+                return self._responder(200, funcion(self.base, argumentos))
+        except ValueError as exc:
+            return self._responder(400, {"message": str(exc)})
+
+    def do_POST(self):
+        ruta, params, prefer = self._preparar()
+        m = re.match(r"^/rest/v1/rpc/(\w+)$", ruta)
+        if m:
+            return self._rpc(m.group(1), self._leer_json() or {})
+        tabla = self._tabla(ruta)
+        if not tabla:
+            return None if tabla is False else self._responder(404, {"message": "not found"})
+        cuerpo = self._leer_json()
+        filas = cuerpo if isinstance(cuerpo, list) else [cuerpo]
+        with self.base.lock:
+            creadas = [self.base.insertar(tabla, f) for f in filas]
+            self._devolver_mutacion(201, tabla, creadas, params, prefer)
+
+    def do_PATCH(self):
+        ruta, params, prefer = self._preparar()
+        tabla = self._tabla(ruta)
+        if not tabla:
+            return None if tabla is False else self._responder(404, {"message": "not found"})
+        cambios = self._leer_json() or {}
+        with self.base.lock:
+            consulta = Consulta(tabla, [p for p in params if p[0] != "select"])
+            afectadas = [f for f in self.base.tablas[tabla] if all(cumple(c, f) for c in consulta.filtros)]
+            for fila in afectadas:
+                fila.update(cambios)
+                fila["updated_at"] = _ahora()
+            self.base.contar_cambio(tabla)
+            self._devolver_mutacion(200, tabla, afectadas, params, prefer)
+
+    def do_DELETE(self):
+        ruta, params, prefer = self._preparar()
+        tabla = self._tabla(ruta)
+        if not tabla:
+            return None if tabla is False else self._responder(404, {"message": "not found"})
+        with self.base.lock:
+            consulta = Consulta(tabla, [p for p in params if p[0] != "select"])
+            afectadas = [f for f in self.base.tablas[tabla] if all(cumple(c, f) for c in consulta.filtros)]
+            self.base.tablas[tabla] = [f for f in self.base.tablas[tabla] if f not in afectadas]
+            self.base.contar_cambio(tabla)
+            self._devolver_mutacion(200, tabla, afectadas, params, prefer)
+
+    def _devolver_mutacion(self, estado, tabla, filas, params, prefer):
+        cabeceras = {"Content-Range": f"0-{len(filas) - 1}/{len(filas)}" if filas else "*/0"}
+        if prefer.get("return") == "representation":
+            select = parsear_select(dict(params).get("select"))
+            cuerpo = [proyectar(self.base, tabla, f, select, {}, {}) for f in filas]
+            return self._responder(estado, cuerpo, cabeceras)
+        self._responder(201 if estado == 201 else 204, None, cabeceras)
+
+
+def crear_servidor(puerto=0, clientes=0, equipos=0, latencia_ms=0, semilla=1):
+    base = Base()
+    base.sembrar(clientes, equipos, semilla)
+    handler = type("HandlerConfigurado", (Handler,), {"base": base, "latencia": latencia_ms / 1000})
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), handler)
+    servidor.daemon_threads = True
+    servidor.base = base
+    return servidor
+
+
+def arrancar_en_segundo_plano(**kwargs):
+    servidor = crear_servidor(**kwargs)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--puerto", type=int, default=54321)
+    parser.add_argument("--clientes", type=int, default=10000)
+    parser.add_argument("--equipos", type=int, default=50000)
+    parser.add_argument("--latencia-ms", type=float, default=0)
+    parser.add_argument("--semilla", type=int, default=1)
+    args = parser.parse_args()
+    servidor = crear_servidor(args.puerto, args.clientes, args.equipos, args.latencia_ms, args.semilla)
+    print(f"PostgREST de pruebas en http://127.0.0.1:{servidor.server_address[1]}")
+    servidor.serve_forever()
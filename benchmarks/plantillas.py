@@ -0,0 +1,84 @@
+"""Coste de renderizado por petición: compilar el fuente en cada petición (antes) frente a plantilla precompilada (ahora).
+
+    python benchmarks/plantillas.py [--repeticiones 500]
+
+"Antes" reproduce el render_template_string(PLANTILLA) que hacía cada ruta;
+"ahora" es render_template(nombre) sobre el entorno ya compilado al arrancar.
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def cargar_app():
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.environ.setdefault("SUPABASE_KEY", "benchmark")
+    spec = importlib.util.spec_from_file_location("ascensoralert_app", os.path.join(RAIZ, "app(16).py"))
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = modulo
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+def contextos():
+    lead = {
+        "id": 1, "tipo_cliente": "Comunidad", "direccion": "Calle Mayor 1", "nombre_cliente": "Comunidad Mayor 1",
+        "codigo_postal": "35001", "localidad": "Vecindario", "zona": "Sur", "persona_contacto": "Ana",
+        "telefono": "928000000", "email": "ana@example.com", "observaciones": "",
+    }
+    equipo = {
+        "id": 1, "tipo_equipo": "Ascensor", "empresa_mantenedora": "Otis", "ubicacion": "", "descripcion": "",
+        "fecha_vencimiento_contrato": "2027-01-31", "rae": "", "ipo_proxima": "2026-12-01",
+    }
+    fila = {
+        "lead_id": 1, "direccion": "Calle Mayor 1", "localidad": "Vecindario", "codigo_postal": "35001",
+        "total_equipos": 2, "equipo_id": 1, "empresa_mantenedora": "Otis",
+        "fecha_vencimiento_contrato": "31/01/2027", "ipo_proxima": "01/12/2026",
+    }
+    return {
+        "login.html": {"error": None},
+        "home.html": {"usuario": "admin"},
+        "formulario_lead.html": {"lead": {}, "equipos": [], "duplicados": []},
+        "nuevo_equipo.html": {"cliente": lead},
+        "editar_lead.html": {"lead": lead, "cambios_ajenos": None},
+        "editar_equipo.html": {"equipo": equipo, "cambios_ajenos": None},
+        "leads.html": {"leads": [dict(lead, equipos=[equipo, equipo])] * 50},
+        "leads_dashboard.html": {
+            "rows": [fila] * 50, "total": 50, "orden": "id", "direccion": "asc", "unidad": "leads",
+            "enlaces_orden": {}, "siguiente_url": None, "primera_url": None,
+            "filtros": {}, "exportar_url": "/leads_dashboard/exportar?orden=id&dir=asc",
+        },
+    }
+
+
+def medir(funcion, repeticiones):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        funcion()
+    return (time.perf_counter() - inicio) / repeticiones * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeticiones", type=int, default=500)
+    args = parser.parse_args()
+
+    modulo = cargar_app()
+    from flask import render_template, render_template_string
+
+    app = modulo.app
+    print(f"{'plantilla':<24}{'antes (µs)':>14}{'ahora (µs)':>14}{'x':>8}")
+    with app.test_request_context("/"):
+        for nombre, contexto in contextos().items():
+            fuente = app.jinja_env.loader.get_source(app.jinja_env, nombre)[0]
+            antes = medir(lambda: render_template_string(fuente, **contexto), args.repeticiones)
+            ahora = medir(lambda: render_template(nombre, **contexto), args.repeticiones)
+            print(f"{nombre:<24}{antes:>14.1f}{ahora:>14.1f}{antes / ahora:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
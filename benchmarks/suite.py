@@ -0,0 +1,182 @@
+"""Benchmarks del dashboard, el listado, el login y los flujos de alta/edición contra el PostgREST de pruebas.
+
+    python benchmarks/suite.py [--clientes 10000] [--equipos 50000] [--latencia-ms 20] [--repeticiones 5]
+
+Por escenario mide latencia (mediana y p95), tiempo hasta el primer byte, llamadas
+a Supabase por petición y pico de memoria Python (tracemalloc). Cada ejecución se
+guarda en benchmarks/resultados/ y se compara con la anterior: las regresiones
+por encima de --tolerancia se marcan con ⚠️.
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+import requests
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTADOS = os.path.join(RAIZ, "benchmarks", "resultados")
+sys.path.insert(0, os.path.join(RAIZ, "benchmarks"))
+
+import fake_postgrest  # noqa: E402
+from plantillas import cargar_app  # noqa: E402
+
+
+class Contador:
+    # Peticiones recibidas por el PostgREST de pruebas (en proceso o externo)
+    def __init__(self, servidor, url):
+        self.servidor = servidor
+        self.url = url
+
+    def __call__(self):
+        if self.servidor is not None:
+            return self.servidor.base.peticiones
+        return requests.get(f"{self.url}/__stats").json()["peticiones"]
+
+
+def escenarios(modulo):
+    """(nombre, método, ruta, datos) de cada escenario; las rutas con {id} usan registros sembrados."""
+    hoy = datetime.date.today()
+    lead = {
+        "tipo_lead": "Comunidad", "direccion": "Calle Benchmark 1", "nombre_lead": "Comunidad Benchmark",
+        "codigo_postal": "35001", "localidad": "Vecindario", "zona": "Sur",
+    }
+    equipo = {
+        "cliente_id": "1", "tipo_equipo": "Ascensor", "empresa_mantenedora": "Otis",
+        "fecha_vencimiento_contrato": (hoy + datetime.timedelta(days=200)).isoformat(),
+        "ipo_proxima": (hoy + datetime.timedelta(days=100)).isoformat(),
+    }
+    return [
+        ("dashboard_pagina_1", "GET", "/leads_dashboard", None),
+        ("dashboard_orden_ipo", "GET", "/leads_dashboard?orden=ipo_proxima", None),
+        ("dashboard_completo", "GET", "/leads_dashboard?todo=1", None),
+        ("dashboard_filtrado", "GET", "/leads_dashboard?localidad=Vecindario&empresa_mantenedora=Otis"
+                                      f"&ipo_hasta={(hoy + datetime.timedelta(days=180)).isoformat()}", None),
+        ("leads", "GET", "/leads", None),
+        ("alertas", "GET", "/alertas", None),
+        ("resumen", "GET", "/resumen", None),
+        ("login", "POST", "/", {"usuario": "admin", "contrasena": "admin"}),
+        ("alta_lead", "POST", "/formulario_lead", lead),
+        ("alta_equipo_form", "GET", "/nuevo_equipo?cliente_id=1", None),
+        ("alta_equipo", "POST", "/nuevo_equipo?cliente_id=1", equipo),
+        ("editar_lead_form", "GET", "/editar_lead/1", None),
+        ("editar_lead", "POST", "/editar_lead/1", lead),
+        ("editar_equipo_form", "GET", "/editar_equipo/1", None),
+        ("editar_equipo", "POST", "/editar_equipo/1", equipo),
+    ]
+
+
+def peticion(cliente, metodo, ruta, datos):
+    # Devuelve (segundos hasta el primer byte, segundos totales, bytes, estado)
+    inicio = time.perf_counter()
+    response = cliente.open(ruta, method=metodo, data=datos, buffered=False)
+    primer_byte, tamano = None, 0
+    for trozo in response.response:
+        if primer_byte is None and trozo:
+            primer_byte = time.perf_counter() - inicio
+        tamano += len(trozo)
+    response.close()
+    total = time.perf_counter() - inicio
+    return primer_byte if primer_byte is not None else total, total, tamano, response.status_code
+
+
+def medir(modulo, cliente, contador, nombre, metodo, ruta, datos, repeticiones):
+    latencias, ttfbs, llamadas = [], [], []
+    for _ in range(repeticiones):
+        # Cada repetición en frío: sin caché de lectura ni de login
+        modulo.cache.backend = modulo.CacheLocal()
+        antes = contador()
+        ttfb, total, tamano, estado = peticion(cliente, metodo, ruta, datos)
+        llamadas.append(contador() - antes)
+        latencias.append(total)
+        ttfbs.append(ttfb)
+
+    modulo.cache.backend = modulo.CacheLocal()
+    tracemalloc.start()
+    peticion(cliente, metodo, ruta, datos)
+    pico = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencias.sort()
+    return {
+        "estado": estado,
+        "latencia_mediana_ms": round(statistics.median(latencias) * 1000, 2),
+        "latencia_p95_ms": round(latencias[min(len(latencias) - 1, int(len(latencias) * 0.95))] * 1000, 2),
+        "ttfb_mediana_ms": round(statistics.median(ttfbs) * 1000, 2),
+        "llamadas_supabase": max(llamadas),
+        "pico_memoria_kib": round(pico / 1024, 1),
+        "bytes": tamano,
+    }
+
+
+def comparar(actual, anterior, tolerancia):
+    print(f"\n{'escenario':<22}{'mediana ms':>12}{'p95 ms':>10}{'ttfb ms':>10}{'llamadas':>10}{'pico KiB':>11}")
+    for nombre, r in actual["escenarios"].items():
+        previo = (anterior or {}).get("escenarios", {}).get(nombre)
+        marcas = []
+        if previo:
+            for campo in ("latencia_mediana_ms", "llamadas_supabase", "pico_memoria_kib"):
+                if previo[campo] and r[campo] > previo[campo] * (1 + tolerancia):
+                    marcas.append(f"⚠️ {campo} {previo[campo]} → {r[campo]}")
+        print(f"{nombre:<22}{r['latencia_mediana_ms']:>12}{r['latencia_p95_ms']:>10}{r['ttfb_mediana_ms']:>10}"
+              f"{r['llamadas_supabase']:>10}{r['pico_memoria_kib']:>11}  {' '.join(marcas)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="PostgREST de pruebas ya arrancado (por defecto se arranca uno en proceso)")
+    parser.add_argument("--clientes", type=int, default=10000)
+    parser.add_argument("--equipos", type=int, default=50000)
+    parser.add_argument("--latencia-ms", type=float, default=0)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--solo", nargs="*", help="escenarios a ejecutar")
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="margen antes de marcar una regresión")
+    args = parser.parse_args()
+
+    servidor = None
+    url = args.url
+    if url is None:
+        print(f"Sembrando {args.clientes} clientes y {args.equipos} equipos…")
+        servidor, url = fake_postgrest.arrancar_en_segundo_plano(
+            clientes=args.clientes, equipos=args.equipos, latencia_ms=args.latencia_ms
+        )
+    os.environ["SUPABASE_URL"] = url
+    modulo = cargar_app()
+    modulo.LOGIN_MAX_INTENTOS_IP = modulo.LOGIN_MAX_INTENTOS_USUARIO = 10 ** 9
+    cliente = modulo.app.test_client()
+    with cliente.session_transaction() as sesion:
+        sesion["usuario"] = "admin"
+    contador = Contador(servidor, url)
+
+    resultado = {
+        "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+        "parametros": {k: v for k, v in vars(args).items() if k not in ("solo", "url")},
+        "escenarios": {},
+    }
+    for nombre, metodo, ruta, datos in escenarios(modulo):
+        if args.solo and nombre not in args.solo:
+            continue
+        resultado["escenarios"][nombre] = medir(modulo, cliente, contador, nombre, metodo, ruta, datos,
+                                                args.repeticiones)
+
+    os.makedirs(RESULTADOS, exist_ok=True)
+    previos = sorted(glob.glob(os.path.join(RESULTADOS, "*.json")))
+    anterior = None
+    if previos:
+        with open(previos[-1], encoding="utf-8") as f:
+            anterior = json.load(f)
+        print(f"Comparando con {os.path.basename(previos[-1])}")
+    comparar(resultado, anterior, args.tolerancia)
+    destino = os.path.join(RESULTADOS, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(destino, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados guardados en {destino}")
+
+
+if __name__ == "__main__":
+    main()
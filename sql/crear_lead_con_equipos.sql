@@ -0,0 +1,24 @@
+-- Alta combinada de un lead y sus equipos en una sola transacción (formulario_lead).
+-- POST /rest/v1/rpc/crear_lead_con_equipos {"lead": {...}, "equipos": [{...}, ...]} -> el cliente creado
+
+create or replace function crear_lead_con_equipos(lead json, equipos json default '[]')
+returns json language plpgsql as $$
+declare
+    nuevo clientes;
+begin
+    insert into clientes (tipo_cliente, direccion, nombre_cliente, codigo_postal, localidad, zona,
+                          persona_contacto, telefono, email, observaciones)
+    select tipo_cliente, direccion, nombre_cliente, codigo_postal, localidad, zona,
+           persona_contacto, telefono, email, observaciones
+    from json_populate_record(null::clientes, lead)
+    returning * into nuevo;
+
+    insert into equipos (cliente_id, tipo_equipo, empresa_mantenedora, ubicacion, descripcion,
+                         fecha_vencimiento_contrato, rae, ipo_proxima)
+    select nuevo.id, tipo_equipo, empresa_mantenedora, ubicacion, descripcion,
+           fecha_vencimiento_contrato, rae, ipo_proxima
+    from json_populate_recordset(null::equipos, coalesce(equipos, '[]'));
+
+    return row_to_json(nuevo);
+end;
+$$;
@@ -0,0 +1,13 @@
+-- Índices que usan las consultas de la aplicación. Ejecutar en el editor SQL de Supabase.
+
+-- Recurso embebido clientes→equipos y filtros cliente_id=in.(...)
+create index if not exists equipos_cliente_id_idx on equipos (cliente_id);
+
+-- /alertas y el dashboard ordenado por fecha: rango + orden (fecha, id) sin recorrer la tabla
+create index if not exists equipos_ipo_proxima_idx on equipos (ipo_proxima, id);
+create index if not exists equipos_fecha_vencimiento_contrato_idx on equipos (fecha_vencimiento_contrato, id);
+
+-- Filtros del dashboard por igualdad (los rangos de fechas usan los índices anteriores)
+create index if not exists clientes_localidad_idx on clientes (localidad);
+create index if not exists clientes_codigo_postal_idx on clientes (codigo_postal);
+create index if not exists equipos_empresa_mantenedora_idx on equipos (empresa_mantenedora, cliente_id);
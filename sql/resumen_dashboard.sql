@@ -0,0 +1,54 @@
+-- Resumen agregado para /resumen: la base agrupa y la aplicación recibe unas decenas de filas,
+-- sea cual sea el tamaño de clientes y equipos. Los meses usan los índices de fechas de sql/indices.sql.
+-- GET /rest/v1/rpc/resumen_dashboard?meses=24 ->
+--   {"totales": {...}, "empresas": [...], "localidades": [...], "zonas": [...], "meses": [...]}
+
+create or replace function resumen_dashboard(meses int default 24) returns json language sql stable as $$
+    with limites as (
+        select date_trunc('month', current_date)::date as desde,
+               (date_trunc('month', current_date) + make_interval(months => meses))::date as hasta
+    ),
+    por_cliente as (
+        select c.localidad, c.zona, count(e.id) as equipos
+        from clientes c left join equipos e on e.cliente_id = c.id
+        group by c.id
+    ),
+    vencimientos as (
+        select date_trunc('month', fecha_vencimiento_contrato)::date as mes, count(*) as contratos, 0 as ipos
+        from equipos, limites
+        where fecha_vencimiento_contrato >= limites.desde and fecha_vencimiento_contrato < limites.hasta
+        group by 1
+        union all
+        select date_trunc('month', ipo_proxima)::date, 0, count(*)
+        from equipos, limites
+        where ipo_proxima >= limites.desde and ipo_proxima < limites.hasta
+        group by 1
+    )
+    select json_build_object(
+        'totales', json_build_object(
+            'leads', (select count(*) from clientes),
+            'equipos', (select count(*) from equipos),
+            'contratos_vencidos', (select count(*) from equipos, limites where fecha_vencimiento_contrato < limites.desde),
+            'ipos_vencidas', (select count(*) from equipos, limites where ipo_proxima < limites.desde)
+        ),
+        'empresas', coalesce((
+            select json_agg(json_build_object('empresa_mantenedora', empresa_mantenedora, 'equipos', n)
+                            order by n desc, empresa_mantenedora)
+            from (select empresa_mantenedora, count(*) as n from equipos group by 1) t
+        ), '[]'),
+        'localidades', coalesce((
+            select json_agg(json_build_object('localidad', localidad, 'leads', leads, 'equipos', equipos)
+                            order by leads desc, localidad)
+            from (select localidad, count(*) as leads, sum(equipos) as equipos from por_cliente group by 1) t
+        ), '[]'),
+        'zonas', coalesce((
+            select json_agg(json_build_object('zona', zona, 'leads', leads, 'equipos', equipos)
+                            order by leads desc, zona)
+            from (select zona, count(*) as leads, sum(equipos) as equipos from por_cliente group by 1) t
+        ), '[]'),
+        'meses', coalesce((
+            select json_agg(json_build_object('mes', mes, 'contratos', contratos, 'ipos', ipos) order by mes)
+            from (select mes, sum(contratos) as contratos, sum(ipos) as ipos from vencimientos group by mes) t
+        ), '[]')
+    );
+$$;
@@ -0,0 +1,23 @@
+-- Marca de última modificación en clientes y equipos. La usan las sincronizaciones incrementales
+-- por updated_at: réplica local, índice de búsqueda y digest de vencimientos.
+
+alter table clientes add column if not exists updated_at timestamptz not null default now();
+alter table equipos add column if not exists updated_at timestamptz not null default now();
+
+create or replace function tocar_updated_at() returns trigger language plpgsql as $$
+begin
+    new.updated_at := now();
+    return new;
+end;
+$$;
+
+drop trigger if exists clientes_updated_at on clientes;
+create trigger clientes_updated_at before update on clientes
+    for each row execute function tocar_updated_at();
+
+drop trigger if exists equipos_updated_at on equipos;
+create trigger equipos_updated_at before update on equipos
+    for each row execute function tocar_updated_at();
+
+create index if not exists clientes_updated_at_idx on clientes (updated_at);
+create index if not exists equipos_updated_at_idx on equipos (updated_at);
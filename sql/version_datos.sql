@@ -0,0 +1,40 @@
+-- Versión barata de los datos para los ETag: contador de cambios y última modificación por tabla.
+-- Un trigger por sentencia (no por fila) suma 1 al contador en cada insert/update/delete/truncate de
+-- clientes o equipos: leer la versión son dos filas, sin recorrer las tablas, y los borrados también
+-- la cambian. Las escrituras concurrentes en la misma tabla esperan entre sí a actualizar su fila de
+-- versiones_datos hasta el commit; con el ritmo de altas y ediciones de la aplicación no se nota.
+-- GET /rest/v1/rpc/version_datos -> {"clientes": [modificado, version], "equipos": [...]}
+
+create table if not exists versiones_datos (
+    tabla text primary key,
+    version bigint not null default 0,
+    modificado timestamptz
+);
+
+insert into versiones_datos (tabla, modificado)
+select 'clientes', max(updated_at) from clientes
+on conflict (tabla) do nothing;
+insert into versiones_datos (tabla, modificado)
+select 'equipos', max(updated_at) from equipos
+on conflict (tabla) do nothing;
+
+-- security definer: quien escribe en clientes/equipos no necesita permisos sobre versiones_datos
+create or replace function contar_cambio() returns trigger language plpgsql security definer
+set search_path = public as $$
+begin
+    update versiones_datos set version = version + 1, modificado = now() where tabla = tg_table_name;
+    return null;
+end;
+$$;
+
+drop trigger if exists clientes_version on clientes;
+create trigger clientes_version after insert or update or delete or truncate on clientes
+    for each statement execute function contar_cambio();
+
+drop trigger if exists equipos_version on equipos;
+create trigger equipos_version after insert or update or delete or truncate on equipos
+    for each statement execute function contar_cambio();
+
+create or replace function version_datos() returns json language sql stable as $$
+    select json_object_agg(tabla, json_build_array(modificado, version)) from versiones_datos;
+$$;
@@ -0,0 +1,49 @@
+"""Fixtures comunes: la aplicación cargada contra el PostgREST de pruebas de benchmarks/.
+
+    python -m pytest -q
+"""
+import os
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(RAIZ, "benchmarks"))
+
+import fake_postgrest  # noqa: E402
+from plantillas import cargar_app  # noqa: E402
+
+CLIENTES = 120
+EQUIPOS = 300
+
+
+@pytest.fixture(scope="session")
+def servidor():
+    servidor, url = fake_postgrest.arrancar_en_segundo_plano(clientes=CLIENTES, equipos=EQUIPOS)
+    servidor.url = url
+    yield servidor
+    servidor.shutdown()
+
+
+@pytest.fixture(scope="session")
+def modulo(servidor, tmp_path_factory):
+    # La configuración se lee al importar: ficheros de estado en un directorio temporal y sin el
+    # hilo del índice de búsqueda (las pruebas que lo necesitan lo cargan a mano)
+    os.environ.update({
+        "SUPABASE_URL": servidor.url,
+        "DIGEST_DIR": str(tmp_path_factory.mktemp("digest")),
+        "IMPORTAR_DIR": str(tmp_path_factory.mktemp("importaciones")),
+        "BUSQUEDA_ACTIVA": "0",
+        "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1000",
+    })
+    modulo = cargar_app()
+    modulo.app.config["TESTING"] = True
+    return modulo
+
+
+@pytest.fixture
+def cliente(modulo):
+    cliente = modulo.app.test_client()
+    with cliente.session_transaction() as sesion:
+        sesion["usuario"] = "admin"
+    return cliente
@@ -0,0 +1,97 @@
+import html
+import re
+
+import pytest
+
+ORDENES = ("id", "direccion", "localidad", "codigo_postal", "fecha_vencimiento_contrato", "ipo_proxima")
+
+
+def recorrer_dashboard(cliente, orden, direccion, por_pagina=37):
+    """Sigue los enlaces «Siguiente» del dashboard; devuelve los ids de lead y de equipo de cada página."""
+    paginas = []
+    url = f"/leads_dashboard?orden={orden}&dir={direccion}&por_pagina={por_pagina}"
+    while url:
+        response = cliente.get(url)
+        assert response.status_code == 200
+        texto = response.get_data(as_text=True)
+        paginas.append((
+            [int(i) for i in re.findall(r"/editar_lead/(\d+)", texto)],
+            [int(i) for i in re.findall(r"/editar_equipo/(\d+)", texto)],
+        ))
+        siguiente = re.search(r"href='(\?[^']*)' class='button'>Siguiente", texto)
+        url = "/leads_dashboard" + html.unescape(siguiente.group(1)) if siguiente else None
+        assert len(paginas) < 100, "el cursor no avanza"
+    return paginas
+
+
+@pytest.mark.parametrize("direccion", ("asc", "desc"))
+@pytest.mark.parametrize("orden", ORDENES)
+def test_paginacion_por_cursor_recorre_todo_sin_repetir(modulo, servidor, cliente, orden, direccion):
+    paginas = recorrer_dashboard(cliente, orden, direccion)
+    if orden in modulo.DASHBOARD_ORDEN_EQUIPO:
+        # Una fila por equipo
+        vistos = [equipo_id for _, equipos in paginas for equipo_id in equipos]
+        esperados = {equipo["id"] for equipo in servidor.base.tablas["equipos"]}
+    else:
+        # Una fila por equipo de cada lead, pero cada lead en una sola página
+        vistos = [lead_id for leads, _ in paginas for lead_id in dict.fromkeys(leads)]
+        esperados = {lead["id"] for lead in servidor.base.tablas["clientes"]}
+    assert len(vistos) == len(set(vistos))
+    assert set(vistos) == esperados
+
+
+def test_cursor_manipulado_vuelve_a_la_primera_pagina(cliente):
+    response = cliente.get("/leads_dashboard?orden=ipo_proxima&despues=PHNjcmlwdD4")
+    assert response.status_code == 200
+    assert b"<script>" not in response.data
+
+
+def test_get_condicional_responde_304_hasta_que_cambian_los_datos(modulo, servidor, cliente):
+    lead_id = servidor.base.tablas["clientes"][0]["id"]
+    response = cliente.get("/leads_dashboard")
+    etag = response.headers["ETag"]
+    assert cliente.get("/leads_dashboard", headers={"If-None-Match": etag}).status_code == 304
+
+    # Escritura por fuera de la aplicación: cambia la versión de rpc/version_datos. La página aún
+    # puede salir de la caché con los datos de antes, pero nunca con un 304 ni con el ETag nuevo
+    modulo.supabase.patch(f"clientes?id=eq.{lead_id}", json={"observaciones": "otra versión"},
+                          headers={"Prefer": "return=minimal"})
+    response = cliente.get("/leads_dashboard", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers.get("ETag") != etag
+
+    # Escritura desde la aplicación: invalida la caché y la página sale con la versión nueva
+    assert cliente.post(f"/editar_lead/{lead_id}", data={
+        "tipo_lead": "Comunidad", "direccion": "Calle Mayor 1", "nombre_lead": "Comunidad Mayor",
+        "codigo_postal": "35001", "localidad": "Telde",
+    }).status_code == 302
+    response = cliente.get("/leads_dashboard", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    nuevo = response.headers["ETag"]
+    assert nuevo != etag
+    assert cliente.get("/leads_dashboard", headers={"If-None-Match": nuevo}).status_code == 304
+
+
+def test_edicion_con_version_antigua_da_conflicto(modulo, servidor, cliente):
+    lead_id = servidor.base.tablas["clientes"][1]["id"]
+    texto = cliente.get(f"/editar_lead/{lead_id}").get_data(as_text=True)
+    version = html.unescape(re.search(r'name="updated_at" value="([^"]*)"', texto).group(1))
+    formulario = {
+        "tipo_lead": "Comunidad", "direccion": "Calle Conflicto 1", "nombre_lead": "Comunidad Conflicto",
+        "codigo_postal": "35001", "localidad": "Telde", "zona": "", "persona_contacto": "Mía",
+        "updated_at": version,
+    }
+
+    # Otra persona guarda antes
+    modulo.supabase.patch(f"clientes?id=eq.{lead_id}", json={"persona_contacto": "Suya"},
+                          headers={"Prefer": "return=minimal"})
+    response = cliente.post(f"/editar_lead/{lead_id}", data=formulario)
+    assert response.status_code == 409
+    assert "Suya" in response.get_data(as_text=True)
+
+    # Reenviado con la versión actual, se guarda
+    texto = response.get_data(as_text=True)
+    formulario["updated_at"] = html.unescape(re.search(r'name="updated_at" value="([^"]*)"', texto).group(1))
+    response = cliente.post(f"/editar_lead/{lead_id}", data=formulario)
+    assert response.status_code == 302
+    assert modulo.supabase.get(f"clientes?id=eq.{lead_id}").json()[0]["persona_contacto"] == "Mía"
@@ -0,0 +1,70 @@
+import datetime
+
+import pytest
+
+
+@pytest.fixture
+def digest(modulo, monkeypatch, tmp_path):
+    # Estado y digest propios de cada prueba
+    monkeypatch.setattr(modulo, "_digest_estado_path", str(tmp_path / "digest_estado.json"))
+    monkeypatch.setattr(modulo, "_digest_path", str(tmp_path / "digest.json"))
+    monkeypatch.setattr(modulo, "_digest_lock_path", str(tmp_path / "digest.lock"))
+    return modulo
+
+
+def pasada(modulo):
+    """calcular_digest sobre el estado guardado, guardando las marcas como ejecutar_digest."""
+    hoy = datetime.date.today()
+    avisos, marcas, error = modulo.calcular_digest(hoy, modulo._leer_json(modulo._digest_estado_path))
+    assert error is None
+    modulo._escribir_json(modulo._digest_estado_path, dict(marcas, ultima_fecha=hoy.isoformat(), ultima_ejecucion=0))
+    return {(aviso["equipo_id"], aviso["tipo"]): aviso["umbral"] for aviso in avisos}
+
+
+def fuera_de_umbral(servidor):
+    limite = (datetime.date.today() + datetime.timedelta(days=200)).isoformat()
+    return next(equipo["id"] for equipo in servidor.base.tablas["equipos"]
+                if equipo["ipo_proxima"] > limite and equipo["fecha_vencimiento_contrato"] > limite)
+
+
+def editar_ipo(cliente, equipo_id, dias):
+    fecha = (datetime.date.today() + datetime.timedelta(days=dias)).isoformat()
+    response = cliente.post(f"/editar_equipo/{equipo_id}", data={"tipo_equipo": "Ascensor", "ipo_proxima": fecha})
+    assert response.status_code == 302
+
+
+def test_segunda_pasada_no_repite_los_equipos_ya_en_umbral(digest):
+    assert digest.ejecutar_digest(forzar=True) is not None
+    # Sin esperar a que salgan del solape de updated_at: ninguno se toma por editado
+    assert pasada(digest) == {}
+
+
+def test_ediciones_avisan_solo_al_acercarse_de_umbral(digest, servidor, cliente):
+    pasada(digest)
+    equipo_id = fuera_de_umbral(servidor)
+    tipo = digest.TIPOS_VENCIMIENTO["ipo_proxima"]
+
+    editar_ipo(cliente, equipo_id, 45)
+    assert pasada(digest) == {(equipo_id, tipo): 60}
+    # Dentro del mismo umbral, o de vuelta a uno más lejano, no se repite
+    editar_ipo(cliente, equipo_id, 50)
+    assert pasada(digest) == {}
+    editar_ipo(cliente, equipo_id, 20)
+    assert pasada(digest) == {(equipo_id, tipo): 30}
+    # Un cambio en otra columna de un equipo ya avisado tampoco
+    response = cliente.post(f"/editar_equipo/{equipo_id}", data={
+        "tipo_equipo": "Ascensor", "descripcion": "Cambio de cabina",
+        "ipo_proxima": (datetime.date.today() + datetime.timedelta(days=20)).isoformat(),
+    })
+    assert response.status_code == 302
+    assert pasada(digest) == {}
+
+
+def test_digest_acumula_las_pasadas_del_dia(digest, servidor, cliente):
+    primero = digest.ejecutar_digest(forzar=True)
+    equipo_id = fuera_de_umbral(servidor)
+    editar_ipo(cliente, equipo_id, 10)
+    segundo = digest.ejecutar_digest(forzar=True)
+    ids = {aviso["equipo_id"] for aviso in segundo["avisos"]}
+    assert {aviso["equipo_id"] for aviso in primero["avisos"]} <= ids
+    assert equipo_id in ids
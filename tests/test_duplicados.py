@@ -0,0 +1,60 @@
+import pytest
+
+
+@pytest.mark.parametrize("a, b", [
+    (("C/ Triana, nº 12", "35002"), ("calle TRIANA 12", "35002")),
+    (("Avda. Marítima 5", "35010"), ("avenida maritima 05", "35010")),
+    (("Triana 12", "35002"), ("Calle de Triana 12", "35002")),
+    (("Camino Viejo s/n", "35200"), ("cm viejo S/N", "35200")),
+])
+def test_misma_clave(modulo, a, b):
+    assert modulo.clave_direccion(*a) == modulo.clave_direccion(*b)
+
+
+@pytest.mark.parametrize("a, b", [
+    (("Calle Triana 12", "35002"), ("Calle Triana 12", "35003")),
+    (("Calle Triana 12", "35002"), ("Calle Triana 21", "35002")),
+    (("Plaza Mayor 1", "35002"), ("Calle Mayor 1", "35002")),
+])
+def test_distinta_clave(modulo, a, b):
+    assert modulo.clave_direccion(*a) != modulo.clave_direccion(*b)
+
+
+ALTA = {
+    "tipo_lead": "Comunidad", "direccion": "C/ Duplicada, nº 7", "nombre_lead": "Comunidad Duplicada",
+    "codigo_postal": "35099", "localidad": "Telde",
+}
+
+
+def test_alta_ofrece_el_lead_existente_y_olvida_los_borrados(modulo, servidor, cliente):
+    assert modulo.cargar_indice_leads() is None
+    existente = servidor.base.insertar("clientes", {
+        "tipo_cliente": "Comunidad", "direccion": "calle duplicada 7", "nombre_cliente": "Ya estaba",
+        "codigo_postal": "35099", "localidad": "Telde",
+    })
+    modulo.indexar_lead(existente)
+
+    response = cliente.post("/formulario_lead", data=ALTA)
+    assert response.status_code == 200
+    assert "Ya estaba" in response.get_data(as_text=True)
+
+    # Borrado desde otro worker: el índice de este aún lo tiene, pero no se ofrece
+    modulo.supabase.delete(f"clientes?id=eq.{existente['id']}", headers={"Prefer": "return=minimal"})
+    assert modulo.indice_leads.obtener(existente["id"]) is not None
+    response = cliente.post("/formulario_lead", data=ALTA)
+    assert "Ya estaba" not in response.get_data(as_text=True)
+    assert modulo.indice_leads.obtener(existente["id"]) is None
+
+
+def test_reconciliar_quita_los_borrados_de_otros_workers(modulo, servidor):
+    nuevos = [servidor.base.insertar("clientes", {
+        "tipo_cliente": "Otro", "direccion": f"Calle Borrada {i}", "nombre_cliente": f"Borrado {i}",
+        "codigo_postal": "35098", "localidad": "Telde",
+    }) for i in range(3)]
+    assert modulo.cargar_indice_leads() is None
+    borrados = [lead["id"] for lead in nuevos]
+    for lead_id in borrados:
+        modulo.supabase.delete(f"clientes?id=eq.{lead_id}", headers={"Prefer": "return=minimal"})
+    assert modulo.reconciliar_indice_leads() is None
+    assert all(modulo.indice_leads.obtener(lead_id) is None for lead_id in borrados)
+    assert len(modulo.indice_leads) == len(servidor.base.tablas["clientes"])
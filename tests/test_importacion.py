@@ -0,0 +1,97 @@
+import io
+import threading
+
+import pytest
+
+CABECERA = "tipo_lead;nombre_lead;direccion;codigo_postal;localidad;tipo_equipo;empresa_mantenedora;fecha_ipo\n"
+
+
+def subir(modulo, cliente, nombre, contenido):
+    """Sube el fichero, espera a que termine el hilo de la importación y devuelve (id, estado)."""
+    response = cliente.post("/importar", data={"fichero": (io.BytesIO(contenido), nombre)},
+                            content_type="multipart/form-data")
+    assert response.status_code == 302
+    trabajo_id = response.headers["Location"].rsplit("/", 1)[-1]
+    return trabajo_id, esperar(modulo, trabajo_id)
+
+
+def esperar(modulo, trabajo_id):
+    for hilo in threading.enumerate():
+        if hilo.name == f"importacion-{trabajo_id}":
+            hilo.join(30)
+    return modulo._trabajo_importacion(trabajo_id)
+
+
+def filas_csv(prefijo, n):
+    return CABECERA + "".join(
+        f"Comunidad;Comunidad {prefijo} {i};Calle {prefijo} {i};35{i:03d};Telde;Ascensor;Otis;01/0{1 + i % 9}/2027\n"
+        for i in range(n)
+    )
+
+
+def clientes_con_direccion(servidor, prefijo):
+    return [lead for lead in servidor.base.tablas["clientes"] if lead["direccion"].startswith(f"Calle {prefijo} ")]
+
+
+def test_importacion_completa(modulo, servidor, cliente):
+    _, estado = subir(modulo, cliente, "completa.csv", filas_csv("Completa", 12).encode())
+    assert estado["fase"] == "terminada"
+    assert (len(estado["leads"]), len(estado["equipos_hechos"]), estado["errores"]) == (12, 12, {})
+    assert len(clientes_con_direccion(servidor, "Completa")) == 12
+
+
+def test_filas_invalidas_se_anotan_sin_parar_la_importacion(modulo, cliente):
+    contenido = filas_csv("Mixta", 3) + "Comunidad;;Calle Mixta 9;35009;Telde;;;\n" \
+        + "Comunidad;Comunidad Mixta 8;Calle Mixta 8;35008;Telde;Ascensor;Otis;31/02/2027\n"
+    _, estado = subir(modulo, cliente, "mixta.csv", contenido.encode())
+    assert estado["fase"] == "terminada"
+    assert set(estado["errores"]) == {"5", "6"}
+    assert "nombre_cliente" in estado["errores"]["5"]
+    assert "fecha no válida" in estado["errores"]["6"]
+
+
+@pytest.mark.parametrize("nombre, contenido", [
+    ("roto.xlsx", b"esto no es un libro de Excel"),
+    ("roto_zip.xlsx", b"PK\x03\x04basura"),
+    ("campo_enorme.csv", (CABECERA + "Comunidad;" + "x" * 140000 + ";Calle;35001;Telde;;;\n").encode()),
+])
+def test_fichero_ilegible_interrumpe_sin_matar_el_hilo(modulo, cliente, nombre, contenido):
+    _, estado = subir(modulo, cliente, nombre, contenido)
+    assert estado["fase"] == "pendiente"
+    assert estado["mensaje"].startswith("Interrumpida:")
+
+
+def test_formato_no_soportado(cliente):
+    response = cliente.post("/importar", data={"fichero": (io.BytesIO(b"x"), "datos.txt")},
+                            content_type="multipart/form-data")
+    assert response.status_code == 400
+
+
+def test_reanudar_tras_caida_no_duplica_leads(modulo, servidor, cliente, monkeypatch):
+    # Supabase deja de responder tras el segundo lote de leads
+    monkeypatch.setattr(modulo, "IMPORTAR_LOTE", 3)
+    post = modulo.supabase.post
+    llamadas = []
+
+    def post_que_falla(ruta, *args, **kwargs):
+        llamadas.append(ruta)
+        if len(llamadas) > 2:
+            raise modulo.SupabaseNoDisponible("caída simulada")
+        return post(ruta, *args, **kwargs)
+
+    monkeypatch.setattr(modulo.supabase, "post", post_que_falla)
+    trabajo_id, estado = subir(modulo, cliente, "reanudar.csv", filas_csv("Reanudar", 10).encode())
+    assert estado["fase"] == "leads"
+    assert estado["mensaje"] == "Interrumpida: caída simulada"
+    assert len(estado["leads"]) == 6
+
+    monkeypatch.setattr(modulo.supabase, "post", post)
+    assert cliente.post(f"/importar/{trabajo_id}/reanudar").status_code == 302
+    estado = esperar(modulo, trabajo_id)
+    assert estado["fase"] == "terminada"
+    assert (len(estado["leads"]), len(estado["equipos_hechos"])) == (10, 10)
+    assert len(clientes_con_direccion(servidor, "Reanudar")) == 10
+
+    # Volver a subir el mismo fichero retoma el trabajo terminado: no inserta nada más
+    assert subir(modulo, cliente, "reanudar.csv", filas_csv("Reanudar", 10).encode())[0] == trabajo_id
+    assert len(clientes_con_direccion(servidor, "Reanudar")) == 10